@@ -0,0 +1,291 @@
+#!/usr/bin/env python
+"""
+Network analytics: which stations, interchanges and tracks carry the most shortest-path traffic
+
+Both betweenness centrality and the loads of an origin-destination demand matrix are accumulated
+by Brandes' algorithm over the expanded (Station, RailLine) network, as weighed by route_stops():
+one Dijkstra search per origin station counts the cheapest paths to every other stop, after which
+each destination's journeys flow back along those paths in a single sweep over the stops in
+reverse order of cost. For betweenness, journeys split evenly between paths costing the same,
+while demand is assigned wholly to one of them, as passengers would be routed. A station's score
+is the flow leaving it along track, counting journeys passing through but neither starting nor
+ending there, while an interchange's is the flow changing lines there.
+
+Origins are sharded in blocks across a process pool, each worker returning partial sums keyed by
+dataset ids, which are merged as they arrive.
+"""
+
+__author__ = 'https://github.com/Drullkus'
+
+import collections
+import heapq
+import itertools
+import time
+from typing import NamedTuple
+
+import as13
+import batch
+from subway_lib import RailLine, Station
+
+_tolerance = 1e-9  # Kilometres within which two path costs count as equal
+
+
+class Analysis(NamedTuple):
+  """
+  Flow through each station, interchange and track, over ordered (origin, destination) pairs
+  """
+  stations: dict[Station, float]  # Journeys passing through each station
+  interchanges: dict[Station, float]  # Journeys changing lines at each station
+  edges: dict[tuple[RailLine, Station, Station], float]  # Journeys riding each track, per direction
+  timings: dict[str, float]  # Seconds spent searching across all workers, merging, and overall
+
+  def top_stations(self, count: int = 10) -> list[tuple[Station, float]]:
+    return collections.Counter(self.stations).most_common(count)
+
+  def top_interchanges(self, count: int = 10) -> list[tuple[Station, float]]:
+    return collections.Counter(self.interchanges).most_common(count)
+
+  def top_edges(self, count: int = 10) -> list[tuple[tuple[RailLine, Station, Station], float]]:
+    return collections.Counter(self.edges).most_common(count)
+
+
+def _accumulate(origin: Station, demand: dict[Station, float] | None, stations: dict,
+                interchanges: dict, edges: dict) -> None:
+  """
+  Adds the flow of every journey from the origin into the running totals. If demand is None, each
+  destination station receives one journey, split evenly between all of its cheapest paths.
+  Otherwise each receives its demand, all along the one cheapest path found first, as a single
+  route_stops() journey would be ridden.
+  """
+  split = demand is None
+  rail_network, st_routes = as13.rail_network, as13.st_routes
+
+  # Dijkstra's algorithm, counting the cheapest paths to each stop and their last steps
+  best: dict = {}
+  paths: dict = {}  # Count of cheapest paths reaching each stop
+  previous: dict = {}  # Stops preceding each along those paths
+  order = []
+  heap = []
+  for rail_line in st_routes[origin]:
+    stop = (origin, rail_line)
+    best[stop], paths[stop], previous[stop] = 0.0, 1, []
+    heap.append((0.0, len(heap), stop))
+  heapq.heapify(heap)
+
+  tie = itertools.count(len(heap))
+  settled = set()
+  while heap:
+    cost, _, stop = heapq.heappop(heap)
+    if stop in settled:
+      continue
+    settled.add(stop)
+    order.append(stop)
+    for adjacent, weight in rail_network[stop].items():
+      new_cost, known = cost + weight, best.get(adjacent)
+      if known is None or new_cost < known - _tolerance:
+        best[adjacent], paths[adjacent], previous[adjacent] = new_cost, paths[stop], [stop]
+        heapq.heappush(heap, (new_cost, next(tie), adjacent))
+      elif split and new_cost <= known + _tolerance and adjacent not in settled:
+        paths[adjacent] += paths[stop]
+        previous[adjacent].append(stop)
+
+  # Each destination's journeys end at whichever of its stops are reached most cheaply
+  arriving: dict = {}
+  for st_goal, rail_lines in st_routes.items():
+    trips = 1.0 if demand is None else demand.get(st_goal, 0.0)
+    if st_goal == origin or not trips:
+      continue
+    reached = [(st_goal, rail_line) for rail_line in rail_lines if (st_goal, rail_line) in best]
+    if not reached:
+      continue
+    if not split:  # Wholly at one stop, even where lines sharing track tie
+      arriving[min(reached, key=best.__getitem__)] = trips
+      continue
+    cheapest = min(best[stop] for stop in reached)
+    reached = [stop for stop in reached if best[stop] <= cheapest + _tolerance]
+    total_paths = sum(paths[stop] for stop in reached)
+    for stop in reached:
+      arriving[stop] = trips * paths[stop] / total_paths
+
+  # Brandes' sweep, passing each stop's flow back to the stops preceding it
+  onward = dict.fromkeys(order, 0.0)
+  for stop in reversed(order):
+    flow = arriving.get(stop, 0.0) + onward[stop]
+    if not flow:
+      continue
+    station, rail_line = stop
+    for prior in previous[stop]:
+      share = flow * paths[prior] / paths[stop]
+      onward[prior] += share
+      if prior[1] != rail_line:
+        interchanges[station] += share
+        continue
+      edges[rail_line, prior[0], station] += share
+      if prior[0] != origin:
+        stations[prior[0]] += share
+
+
+def _analyse_block(origin_ids: list[str], demand: dict[str, dict[str, float]] | None
+                   ) -> tuple[dict, dict, dict, float]:
+  """
+  Process pool task: accumulates one block of origins, keyed by dataset ids to cross processes
+  """
+  start_time = time.perf_counter()
+  id_stations, station_ids, line_ids = as13.id_stations, as13.station_ids, as13.line_ids
+  stations, interchanges, edges = (collections.defaultdict(float) for _ in range(3))
+  for origin_id in origin_ids:
+    origin_demand = None if demand is None else \
+      {id_stations[st_id]: trips for st_id, trips in demand[origin_id].items()}
+    _accumulate(id_stations[origin_id], origin_demand, stations, interchanges, edges)
+
+  return ({station_ids[station]: flow for station, flow in stations.items()},
+          {station_ids[station]: flow for station, flow in interchanges.items()},
+          {(line_ids[rail_line], station_ids[station1], station_ids[station2]): flow
+           for (rail_line, station1, station2), flow in edges.items()},
+          time.perf_counter() - start_time)
+
+
+def _analyse(origin_ids: list[str], demand: dict[str, dict[str, float]] | None,
+             workers: int | None, block_size: int) -> Analysis:
+  start_time = time.perf_counter()
+  blocks = [origin_ids[idx:idx + block_size] for idx in range(0, len(origin_ids), block_size)]
+  demands = [None if demand is None else {origin_id: demand[origin_id] for origin_id in block}
+             for block in blocks]  # Only the rows each block needs
+  if workers == 0:
+    partials = map(_analyse_block, blocks, demands)
+    executor = None
+  else:
+    executor = batch.fork_executor(workers)
+    partials = executor.map(_analyse_block, blocks, demands)
+
+  id_stations, id_lines = as13.id_stations, as13.id_lines
+  totals = [collections.Counter() for _ in range(3)]
+  searching = merging = 0.0
+  try:
+    for *partial, seconds in partials:
+      merge_time = time.perf_counter()
+      for total, flows in zip(totals, partial):
+        total.update(flows)
+      searching += seconds
+      merging += time.perf_counter() - merge_time
+  finally:
+    if executor is not None:
+      executor.shutdown(cancel_futures=True)
+
+  stations, interchanges, edges = totals
+  return Analysis({id_stations[st_id]: flow for st_id, flow in stations.items()},
+                  {id_stations[st_id]: flow for st_id, flow in interchanges.items()},
+                  {(id_lines[line_id], id_stations[st_id1], id_stations[st_id2]): flow
+                   for (line_id, st_id1, st_id2), flow in edges.items()},
+                  {'searching': searching, 'merging': merging,
+                   'total': time.perf_counter() - start_time})
+
+
+def betweenness(origins: list[Station] | None = None, workers: int | None = None,
+                block_size: int = 16) -> Analysis:
+  """
+  Betweenness centrality: flows of one journey from each origin, by default every station, to
+  every other station.
+
+  workers: Process count, defaulting to one per CPU. Zero accumulates within the calling process.
+  block_size: Origins per worker task.
+  """
+  station_ids = as13.station_ids
+  origins = as13.id_stations.values() if origins is None else origins
+  return _analyse([station_ids[origin] for origin in origins], None, workers, block_size)
+
+
+def demand_loads(demand: dict[tuple[Station, Station], float], workers: int | None = None,
+                 block_size: int = 16) -> Analysis:
+  """
+  Flows of an origin-destination matrix, mapping (origin, destination) pairs to trips, each
+  assigned to the cheapest journey between them as gen_route_instr() would route it. See
+  betweenness() for the other arguments.
+  """
+  station_ids = as13.station_ids
+  rows: dict[str, dict[str, float]] = collections.defaultdict(dict)
+  for (st_start, st_goal), trips in demand.items():
+    rows[station_ids[st_start]][station_ids[st_goal]] = trips
+  return _analyse(list(rows), dict(rows), workers, block_size)
+
+
+if __name__ == '__main__':
+  by_name = {station.name: station for station in as13.id_stations.values()}
+  acton, upminster, bank = by_name['Acton Town'], by_name['Upminster'], by_name['Bank']
+  served = [station for station, routes in as13.st_routes.items() if routes]
+
+  def assign(demand: dict[tuple[Station, Station], float]) -> tuple[dict, dict, dict]:
+    """
+    Expected flows, from routing each pair in turn along route_stops()
+    """
+    stations, interchanges, edges = (collections.Counter() for _ in range(3))
+    for (st_start, st_goal), trips in demand.items():
+      stops = as13.route_stops(st_start, st_goal)
+      for (station1, line1), (station2, line2) in itertools.pairwise(stops):
+        if line1 != line2:
+          interchanges[station1] += trips
+        else:
+          edges[line1, station1, station2] += trips
+          if station1 != st_start:
+            stations[station1] += trips
+    return stations, interchanges, edges
+
+  def matches(flows: dict, expected: dict) -> bool:
+    return all(abs(flows.get(key, 0.0) - expected.get(key, 0.0)) < 1e-6
+               for key in flows.keys() | expected.keys())
+
+  def by_track(edges: dict) -> collections.Counter:
+    """
+    Flows between adjacent stations whichever line rides them, as lines sharing track (such as
+    the Circle and Hammersmith & City) tie for journeys along it
+    """
+    tracks = collections.Counter()
+    for (_, station1, station2), flow in edges.items():
+      tracks[station1, station2] += flow
+    return tracks
+
+  # Betweenness over a few origins matches routing every pair one at a time
+  origins = served[::40]
+  analysis = betweenness(origins, workers=0)
+  expected = assign({(origin, st_goal): 1 for origin in origins for st_goal in served
+                     if st_goal != origin})
+  assert matches(analysis.stations, expected[0])
+  assert matches(by_track(analysis.edges), by_track(expected[2]))
+  assert abs(sum(analysis.interchanges.values()) - sum(expected[1].values())) < 1e-6
+  assert betweenness(origins, workers=2)[:3] == analysis[:3]
+
+  demand = {(acton, bank): 120.0, (acton, upminster): 45.0, (upminster, bank): 80.0,
+            (bank, acton): 30.0, (bank, bank): 10.0}
+  loads, expected = demand_loads(demand, workers=0), assign(demand)
+  assert matches(loads.stations, expected[0]) and matches(loads.interchanges, expected[1])
+  assert matches(by_track(loads.edges), by_track(expected[2]))
+  assert all(flow in (30.0, 45.0, 80.0, 120.0, 125.0, 165.0, 200.0, 245.0)
+             for flow in loads.edges.values())  # Never split between paths
+  # Nor between lines sharing track into the destination, as the Circle, Hammersmith & City and
+  # Metropolitan lines do into Baker Street
+  arnos_grove, baker_street = by_name['Arnos Grove'], by_name['Baker Street']
+  tied = demand_loads({(arnos_grove, baker_street): 90.0}, workers=0)
+  assert set(tied.edges.values()) == {90.0}
+  assert sum(1 for (_, _, station2) in tied.edges if station2 == baker_street) == 1
+  district = next(rl for rl in as13.id_lines.values() if rl.name == 'District Line')
+  assert sum(flow for (rail_line, station1, _), flow in loads.edges.items()
+             if rail_line == district and station1 == acton) >= 45.0
+
+  # Closures divert flows around the closed station
+  as13.network.close_station(bank)
+  closed = betweenness(origins, workers=0)
+  assert bank not in closed.stations and closed.stations != analysis.stations
+  as13.network.reopen_all()
+
+  full = betweenness()
+  assert set(full.interchanges) <= set(as13.st_multi_routes)
+  print('Busiest stations:', ', '.join(f'{station.name} {flow:.0f}'
+                                       for station, flow in full.top_stations(5)))
+  print('Busiest interchanges:', ', '.join(f'{station.name} {flow:.0f}'
+                                           for station, flow in full.top_interchanges(5)))
+  print('Busiest track:', ', '.join(f'{station1.name} > {station2.name} ({rail_line.name}) '
+                                    f'{flow:.0f}' for (rail_line, station1, station2), flow
+                                    in full.top_edges(3)))
+  print('Timings: ' + ', '.join(f'{name} {seconds:.2f}s' for name, seconds in full.timings.items()))
+
+  print('All assertions passed!')
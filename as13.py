@@ -7,141 +7,884 @@ The main implementation involving the graph.
 
 __author__ = 'https://github.com/Drullkus'
 
+import contextlib
 import csv
+import functools
+import hashlib
 import itertools
 import math
 import operator
-from graph import Graph
-from subway_lib import RailLine, Station
+import os
+import pickle
+from typing import Iterator
+
+import geometry
+import instrument
+from branches import LineIndex
+from columnar import ColumnarDataset, columnar_file
+from graph import FrozenGraph, Graph
+from route_cache import RouteCache
+from spatial import StationIndex
+from subway_lib import RailLine, Station, StationTable
 
 path = './datasets/'
-
-with open(f'{path}lines.csv', newline='') as lines_file:
-  next(lines_file)  # Skip table header
-  id_lines = {row[0]: RailLine(*row[1:]) for row in csv.reader(lines_file)}
-
-with open(f'{path}stations.csv', newline='') as stations_file:
-  next(stations_file)  # Skip table header
-  id_stations = {row[0]: Station(*row[1:]) for row in csv.reader(stations_file)}
-
-with open(f'{path}routes.csv', newline='') as routes_file:
-  next(routes_file)  # Skip table header
-  line_edges: dict[RailLine, list[tuple[Station, Station]]] = {li: [] for li in id_lines.values()}
-  for station1_id, station2_id, line_id in csv.reader(routes_file):
-    line_edges[id_lines[line_id]].append((id_stations[station1_id], id_stations[station2_id]))
-
-station_coords: list[tuple[float, float]] = list(map(Station.coords, id_stations.values()))
-# Find min-max geopositional coordinate boundaries
-min_lat = float(min(map(operator.itemgetter(1), station_coords)))
-min_lon = float(min(map(operator.itemgetter(0), station_coords)))
-max_lat = float(max(map(operator.itemgetter(1), station_coords)))
-max_lon = float(max(map(operator.itemgetter(0), station_coords)))
-
-enum_stations = list(id_stations.items())
-
-# Simplified version of line_edges
-rail_stations: dict[RailLine, set[Station]] = {rail: set() for rail in line_edges}
-# For reverse station -> RailLine lookup
-st_routes: dict[Station, set[RailLine]] = {li: set() for li in id_stations.values()}
-for rail_line, station_connections in line_edges.items():
-  for station in set(itertools.chain.from_iterable(station_connections)):
-    st_routes[station].add(rail_line)
-    rail_stations[rail_line].add(station)
-
-# Same LUT as above, except only with stations connecting multiple lines
-st_multi_routes: dict[Station, set[RailLine]] = dict(filter(lambda t: len(t[1]) > 1,
-                                                            st_routes.items()))
-
-# Super-graph where all connections between routes are mapped.
-# Each vertex is a rail line, in which its connections are lists of stations intersecting the lines
-rail_supergraph = Graph()
-for overlapped_station, routes in st_multi_routes.items():
-  for rail1, rail2 in itertools.combinations(routes, 2):
-    if rail2 not in rail_supergraph[rail1]:
-      rail_supergraph[rail1][rail2] = list()
-    if rail1 not in rail_supergraph[rail2]:
-      rail_supergraph[rail2][rail1] = list()
-
-    rail_supergraph[rail1][rail2].append(overlapped_station)
-    rail_supergraph[rail2][rail1].append(overlapped_station)
-
-rail_subgraphs: dict[RailLine, Graph] = {}
-for rail_line, station_pairs in line_edges.items():
-  for station1, station2 in station_pairs:
-    if rail_line not in rail_subgraphs:
-      rail_subgraphs[rail_line] = Graph()
-
-    coords1, coords2 = station1.geo_coords, station2.geo_coords
-
-    dist = math.sqrt((coords2[0] - coords1[0])**2 + (coords2[1] - coords1[1])**2)
-
-    rail_graph: Graph = rail_subgraphs[rail_line]
-    rail_graph[station1][station2] = dist
-    rail_graph[station2][station1] = dist
+snapshot_file = 'network.pickle'
+_SNAPSHOT_VERSION = 3
+
+# Expanded routing graph: each vertex is a (Station, RailLine) pair. Riding between adjacent
+# stations of a line costs the distance, while changing lines at an interchange costs the penalty
+transfer_penalty = 1.6  # Kilometres like distances, roughly the length of one or two stops
+
+
+def dataset_digest(dataset_path: str = path) -> bytes:
+  """
+  SHA-256 over the dataset CSV files, identifying the exact network data anything was derived from
+  """
+  digest = hashlib.sha256()
+  for file_name in ('lines.csv', 'stations.csv', 'routes.csv'):
+    with open(f'{dataset_path}{file_name}', 'rb') as dataset_file:
+      digest.update(dataset_file.read())
+  return digest.digest()
+
+
+@contextlib.contextmanager
+def atomic_open(file_path: str):
+  """
+  Opens a binary file for writing under a temporary name, which replaces file_path only once fully
+  written, so that readers (even other processes) never see a partly written file
+  """
+  temp_path = f'{file_path}.{os.getpid()}.tmp'
+  try:
+    with open(temp_path, 'wb') as temp_file:
+      yield temp_file
+    os.replace(temp_path, file_path)
+  except BaseException:
+    with contextlib.suppress(OSError):
+      os.remove(temp_path)
+    raise
+
+
+def read_csv(file_path: str) -> list[list[str]]:
+  """
+  Rows of one of the dataset's CSV files, without its header
+  """
+  with open(file_path, newline='') as csv_file:
+    next(csv_file)  # Skip table header
+    return list(csv.reader(csv_file))
+
+
+class Disruption:
+  """
+  Record of everything removed from the network by one closure, for invalidating cached routes
+  """
+  def __init__(self):
+    self.tracks: set[tuple[RailLine, Station, Station]] = set()  # Closed, in both directions
+    self.stops: set[tuple[Station, RailLine]] = set()  # Stations no longer served by a line
+    self.links: set[tuple[RailLine, RailLine]] = set()  # Lines no longer sharing any station
+
+  @property
+  def lines(self) -> set[RailLine]:
+    return {track[0] for track in self.tracks} | {stop[1] for stop in self.stops}
+
+  def severs_line_path(self, rail_line: RailLine, stations) -> bool:
+    return any((station, rail_line) in self.stops for station in stations) or \
+      any((rail_line, *pair) in self.tracks for pair in itertools.pairwise(stations))
+
+  def severs_line_sequence(self, rail_lines) -> bool:
+    return any(pair in self.links for pair in itertools.pairwise(rail_lines))
+
+  def severs_journey(self, stops) -> bool:
+    return any(stop in self.stops for stop in stops) or \
+      any((line1, station1, station2) in self.tracks
+          for (station1, line1), (station2, line2) in itertools.pairwise(stops) if line1 == line2)
+
+
+class MetroNetwork:
+  """
+  The Metro network of a dataset directory, with every structure built only once first accessed.
+
+  Once the routing graph has been built, all structures are pickled into a snapshot beside the
+  dataset. Later processes load that snapshot instead of parsing and building anything, for as long
+  as the dataset files and transfer penalty remain unchanged.
+
+  Closures are applied in place to every structure, keeping only cached routes they don't affect.
+  """
+  _SNAPSHOTTED = ('id_lines', 'id_stations', 'line_edges', 'rail_stations', 'st_routes',
+                  'st_multi_routes', 'rail_supergraph', 'rail_subgraphs', 'rail_network')
+
+  def __init__(self, dataset_path: str = path, penalty: float = transfer_penalty,
+               use_snapshot: bool = True):
+    self.path = dataset_path
+    self.transfer_penalty = penalty
+    self.snapshot_path = f'{dataset_path}{snapshot_file}' if use_snapshot else None
+    self.route_cache = RouteCache()  # Each route stamped with the version of the graph searched
+    self.closures: list[tuple[RailLine, Station, Station, float]] = []  # Tracks closed, to reopen
+
+  @functools.cached_property
+  def digest(self) -> bytes:
+    return dataset_digest(self.path)
+
+  @functools.cached_property
+  def _snapshot(self) -> dict | None:
+    if not self.snapshot_path or not os.path.exists(self.snapshot_path):
+      return None
+
+    try:
+      with open(self.snapshot_path, 'rb') as snapshot:
+        version, digest, penalty, structures = pickle.load(snapshot)
+    except (pickle.UnpicklingError, AttributeError, TypeError, ValueError, EOFError, OSError):
+      return None  # Unreadable, or pickled from classes of an older layout
+    if (version, digest, penalty) != (_SNAPSHOT_VERSION, self.digest, self.transfer_penalty):
+      return None  # Stale, built from other dataset files or transfer penalty
+
+    self.__dict__.update(structures)  # Populates every cached_property at once
+    return structures
+
+  def save_snapshot(self) -> bool:
+    """
+    Saves the snapshot, returning False if it couldn't be written, such as to a read-only dataset
+    directory. Snapshots only speed up later loads, so failing to save one is no error.
+    """
+    structures = {name: getattr(self, name) for name in self._SNAPSHOTTED}
+    try:
+      with atomic_open(self.snapshot_path) as snapshot:
+        pickle.dump((_SNAPSHOT_VERSION, self.digest, self.transfer_penalty, structures), snapshot,
+                    protocol=pickle.HIGHEST_PROTOCOL)
+    except OSError:
+      return False
+    return True
+
+  @functools.cached_property
+  def columns(self) -> ColumnarDataset | None:
+    """
+    Memory-mapped columnar copy of the dataset once converted by columnar.py, for as long as the
+    CSV files remain unchanged, from which edges and the station table are read in place
+    """
+    return ColumnarDataset.open(f'{self.path}{columnar_file}', self.digest)
+
+  @functools.cached_property
+  def id_lines(self) -> dict[str, RailLine]:
+    if self._snapshot:
+      return self._snapshot['id_lines']
+    return {row[0]: RailLine(*row) for row in read_csv(f'{self.path}lines.csv')}
+
+  @functools.cached_property
+  def id_stations(self) -> dict[str, Station]:
+    if self._snapshot:
+      return self._snapshot['id_stations']
+    return {row[0]: Station(*row) for row in read_csv(f'{self.path}stations.csv')}
+
+  @functools.cached_property
+  def line_edges(self) -> dict[RailLine, list[tuple[Station, Station]]]:
+    if self._snapshot:
+      return self._snapshot['line_edges']
+    if self.columns:
+      return self.columns.line_edges(self.id_lines, self.id_stations)
+
+    id_lines, id_stations = self.id_lines, self.id_stations
+    line_edges = {li: [] for li in id_lines.values()}
+    for station1_id, station2_id, line_id in read_csv(f'{self.path}routes.csv'):
+      line_edges[id_lines[line_id]].append((id_stations[station1_id], id_stations[station2_id]))
+    return line_edges
+
+  # Reverse lookups, for keying persisted data by the dataset's own ids
+  @functools.cached_property
+  def line_ids(self) -> dict[RailLine, str]:
+    return {rail_line: line_id for line_id, rail_line in self.id_lines.items()}
+
+  @functools.cached_property
+  def station_ids(self) -> dict[Station, str]:
+    return {station: st_id for st_id, station in self.id_stations.items()}
+
+  @functools.cached_property
+  def station_coords(self) -> list[tuple[float, float]]:
+    return list(map(Station.coords, self.id_stations.values()))
+
+  @functools.cached_property
+  def station_table(self) -> StationTable:
+    """
+    Every station's coordinates, zone and line count as arrays, mapped in place when possible
+    """
+    if self.columns:
+      return self.columns.station_table(self.id_stations.values())
+    return StationTable(self.id_stations.values())
+
+  @functools.cached_property
+  def distance_matrix(self) -> geometry.DistanceMatrix:
+    """
+    Great-circle kilometres between stations, indexed by their station_table rows
+    """
+    table = self.station_table
+    return geometry.DistanceMatrix(table.longitudes, table.latitudes)
+
+  @functools.cached_property
+  def station_vectors(self) -> list[tuple[float, float, float] | None]:
+    """
+    Earth-centred coordinates of each station in kilometres, between which chords are measured.
+    Indexed by station id, sparing the heuristics hashing stations.
+    """
+    table = self.station_table
+    station_vectors = [None] * (max(table.ids, default=-1) + 1)
+    for st_id, vector in zip(table.ids, geometry.geocentric(table.longitudes, table.latitudes)):
+      station_vectors[st_id] = vector
+    return station_vectors
+
+  @functools.cached_property
+  def projected_coords(self):
+    """
+    Station coordinates as kilometres east and north of their centre, in station_table row order
+    """
+    return geometry.project(self.station_table.longitudes, self.station_table.latitudes)
+
+  @functools.cached_property
+  def station_index(self) -> StationIndex:
+    """
+    Spatial index for nearest-station, radius and bounding-box queries
+    """
+    return StationIndex(self.id_stations.values())
+
+  # Min-max geopositional coordinate boundaries, found while indexing
+  @property
+  def min_lat(self) -> float:
+    return self.station_index.bounds[1]
+
+  @property
+  def min_lon(self) -> float:
+    return self.station_index.bounds[0]
+
+  @property
+  def max_lat(self) -> float:
+    return self.station_index.bounds[3]
+
+  @property
+  def max_lon(self) -> float:
+    return self.station_index.bounds[2]
+
+  @functools.cached_property
+  def enum_stations(self) -> list[tuple[str, Station]]:
+    return list(self.id_stations.items())
+
+  def _index_routes(self) -> None:
+    # Simplified version of line_edges
+    rail_stations: dict[RailLine, set[Station]] = {rail: set() for rail in self.line_edges}
+    # For reverse station -> RailLine lookup
+    st_routes: dict[Station, set[RailLine]] = {li: set() for li in self.id_stations.values()}
+    for rail_line, station_connections in self.line_edges.items():
+      for station in set(itertools.chain.from_iterable(station_connections)):
+        st_routes[station].add(rail_line)
+        rail_stations[rail_line].add(station)
+
+    self.__dict__.update(rail_stations=rail_stations, st_routes=st_routes)
+
+  @functools.cached_property
+  def rail_stations(self) -> dict[RailLine, set[Station]]:
+    if self._snapshot:
+      return self._snapshot['rail_stations']
+    self._index_routes()
+    return self.__dict__['rail_stations']
+
+  @functools.cached_property
+  def st_routes(self) -> dict[Station, set[RailLine]]:
+    if self._snapshot:
+      return self._snapshot['st_routes']
+    self._index_routes()
+    return self.__dict__['st_routes']
+
+  @functools.cached_property
+  def st_multi_routes(self) -> dict[Station, set[RailLine]]:
+    """
+    Same LUT as st_routes, except only with stations connecting multiple lines
+    """
+    if self._snapshot:
+      return self._snapshot['st_multi_routes']
+    return dict(filter(lambda t: len(t[1]) > 1, self.st_routes.items()))
+
+  @functools.cached_property
+  def rail_supergraph(self) -> Graph:
+    """
+    Super-graph where all connections between routes are mapped. Each vertex is a rail line, in
+    which its connections are lists of stations intersecting the lines
+    """
+    if self._snapshot:
+      return self._snapshot['rail_supergraph']
+
+    rail_supergraph = Graph()
+    for overlapped_station, routes in self.st_multi_routes.items():
+      for rail1, rail2 in itertools.combinations(routes, 2):
+        if rail2 not in rail_supergraph[rail1]:
+          rail_supergraph[rail1][rail2] = list()
+        if rail1 not in rail_supergraph[rail2]:
+          rail_supergraph[rail2][rail1] = list()
+
+        rail_supergraph[rail1][rail2].append(overlapped_station)
+        rail_supergraph[rail2][rail1].append(overlapped_station)
+
+    return rail_supergraph
+
+  @functools.cached_property
+  def rail_subgraphs(self) -> dict[RailLine, Graph]:
+    if self._snapshot:
+      return self._snapshot['rail_subgraphs']
+
+    rail_subgraphs: dict[RailLine, Graph] = {}
+    edge_lengths = geometry.edge_lengths(self.line_edges)  # Great-circle kilometres
+    for rail_line, station_pairs in self.line_edges.items():
+      for (station1, station2), dist in zip(station_pairs, edge_lengths[rail_line]):
+        if rail_line not in rail_subgraphs:
+          rail_subgraphs[rail_line] = Graph()
+
+        rail_graph: Graph = rail_subgraphs[rail_line]
+        rail_graph[station1][station2] = dist
+        rail_graph[station2][station1] = dist
+
+    return rail_subgraphs
+
+  @functools.cached_property
+  def rail_network(self) -> Graph:
+    if self._snapshot:
+      return self._snapshot['rail_network']
+
+    rail_network = Graph()
+    for rail_line, rail_graph in self.rail_subgraphs.items():
+      for station1, station2, dist in rail_graph.edges():
+        rail_network[station1, rail_line][station2, rail_line] = dist
+
+    for interchange, routes in self.st_multi_routes.items():
+      for rail1, rail2 in itertools.permutations(routes, 2):
+        rail_network[interchange, rail1][interchange, rail2] = self.transfer_penalty
+
+    if self.snapshot_path:
+      self.__dict__['rail_network'] = rail_network  # Snapshot the graph being returned
+      self.save_snapshot()
+    return rail_network
+
+  @property
+  def rail_router(self) -> FrozenGraph:
+    """
+    Array-backed snapshot of rail_network which routing searches run over, refrozen whenever
+    rail_network has since been mutated
+    """
+    router = self.__dict__.get('_rail_router')
+    if router is None or router.source_version != self.rail_network.version:
+      router = self.__dict__['_rail_router'] = self.rail_network.freeze()
+    return router
+
+  def line_index(self, rail_line: RailLine) -> LineIndex:
+    """
+    Branch decomposition of a line's subgraph which same-line routes are read from, rebuilt
+    whenever the subgraph has since been mutated
+    """
+    indices = self.__dict__.setdefault('_line_indices', {})
+    index = indices.get(rail_line)
+    if index is None or index.source_version != self.rail_subgraphs[rail_line].version:
+      index = indices[rail_line] = LineIndex(self.rail_subgraphs[rail_line])
+    return index
+
+  # Closures, propagated incrementally through every structure derived from the line subgraphs
+
+  def close_track(self, rail_line: RailLine, station1: Station, station2: Station) -> Disruption:
+    """
+    Closes the track between two adjacent stations of a line, in both directions. Either station
+    left without any track of the line is no longer served by it.
+    """
+    with self._disrupting() as disruption:
+      self._close_track(rail_line, station1, station2, disruption)
+    return disruption
+
+  def close_station(self, station: Station, rail_line: RailLine | None = None) -> Disruption:
+    """
+    Closes a station to one line, or to every line serving it if none is given
+    """
+    with self._disrupting() as disruption:
+      for line in [rail_line] if rail_line else list(self.st_routes[station]):
+        rail_graph = self.rail_subgraphs[line]
+        for adjacent in rail_graph.neighbors(station) if station in rail_graph else ():
+          self._close_track(line, station, adjacent, disruption)
+        self._withdraw(station, line, disruption)
+    return disruption
+
+  def suspend_line(self, rail_line: RailLine) -> Disruption:
+    """
+    Closes every track of a line
+    """
+    with self._disrupting() as disruption:
+      for station1, station2 in list(self.line_edges[rail_line]):
+        self._close_track(rail_line, station1, station2, disruption)
+    return disruption
+
+  def reopen_all(self) -> None:
+    """
+    Reinstates every closed track. Reopened track may shorten any journey, so all cached routes are
+    dropped.
+    """
+    closures, self.closures = self.closures, []
+    for rail_line, station1, station2, dist in closures:
+      rail_graph = self.rail_subgraphs[rail_line]
+      rail_graph[station1][station2] = rail_graph[station2][station1] = dist
+      self.rail_network[station1, rail_line][station2, rail_line] = dist
+      self.rail_network[station2, rail_line][station1, rail_line] = dist
+      self.line_edges[rail_line].append((station1, station2))
+      for station in (station1, station2):
+        self._serve(station, rail_line)
+    self.route_cache.clear()
+
+  @contextlib.contextmanager
+  def _disrupting(self):
+    """
+    Yields a Disruption to record closures into, then drops only the cached routes passing through
+    anything it removed. Every other cached route remains optimal, as closures only remove edges.
+    """
+    rail_network, rail_supergraph, rail_subgraphs = \
+      self.rail_network, self.rail_supergraph, self.rail_subgraphs  # Built before any mutation
+    network_version, supergraph_version = rail_network.version, rail_supergraph.version
+    line_versions = {rail_line: graph.version for rail_line, graph in rail_subgraphs.items()}
+
+    disruption = Disruption()
+    yield disruption
+
+    cache = self.route_cache
+    for rail_line in disruption.lines:
+      cache.lines.invalidate(lambda key, path: key[0] == rail_line and
+                             disruption.severs_line_path(rail_line, path))
+      cache.lines.restamp(line_versions[rail_line], rail_subgraphs[rail_line].version,
+                          lambda key: key[0] == rail_line)
+    cache.supergraph.invalidate(lambda key, lines: disruption.severs_line_sequence(lines))
+    cache.supergraph.restamp(supergraph_version, rail_supergraph.version)
+    cache.itineraries.invalidate(lambda key, itinerary: disruption.severs_journey(itinerary[0]))
+    cache.itineraries.restamp(network_version, rail_network.version)
+
+  def _close_track(self, rail_line: RailLine, station1: Station, station2: Station,
+                   disruption: Disruption) -> None:
+    rail_graph = self.rail_subgraphs[rail_line]
+    if station1 not in rail_graph or station2 not in rail_graph[station1]:
+      return  # Already closed
+
+    self.closures.append((rail_line, station1, station2, rail_graph[station1][station2]))
+    del rail_graph[station1][station2], rail_graph[station2][station1]
+    del self.rail_network[station1, rail_line][station2, rail_line]
+    del self.rail_network[station2, rail_line][station1, rail_line]
+    self.line_edges[rail_line][:] = [pair for pair in self.line_edges[rail_line]
+                                     if pair not in ((station1, station2), (station2, station1))]
+    disruption.tracks.update(((rail_line, station1, station2), (rail_line, station2, station1)))
+
+    for station in (station1, station2):
+      if not rail_graph[station] and not rail_graph.predecessors(station):
+        self._withdraw(station, rail_line, disruption)
+
+  def _withdraw(self, station: Station, rail_line: RailLine, disruption: Disruption) -> None:
+    """
+    Stops a line serving a station, dropping the station's vertex and transfers for that line
+    """
+    if rail_line not in self.st_routes[station]:
+      return
+
+    if station in self.rail_subgraphs[rail_line]:
+      del self.rail_subgraphs[rail_line][station]
+    if (station, rail_line) in self.rail_network:
+      del self.rail_network[station, rail_line]  # Along with every transfer to and from it
+    self.rail_stations[rail_line].discard(station)
+    self.st_routes[station].discard(rail_line)  # Same set as within st_multi_routes
+    if len(self.st_routes[station]) < 2:
+      self.st_multi_routes.pop(station, None)
+
+    rail_supergraph = self.rail_supergraph
+    for other_line in self.st_routes[station]:
+      for rail1, rail2 in ((rail_line, other_line), (other_line, rail_line)):
+        # Replaced rather than edited in place, so that the supergraph's version is bumped
+        shared = [st for st in rail_supergraph[rail1][rail2] if st != station]
+        if shared:
+          rail_supergraph[rail1][rail2] = shared
+        else:
+          del rail_supergraph[rail1][rail2]
+          disruption.links.add((rail1, rail2))
+    disruption.stops.add((station, rail_line))
+
+  def _serve(self, station: Station, rail_line: RailLine) -> None:
+    """
+    Inverse of _withdraw(), transfers included
+    """
+    if rail_line in self.st_routes[station]:
+      return
+
+    rail_supergraph = self.rail_supergraph
+    for other_line in self.st_routes[station]:
+      for rail1, rail2 in ((rail_line, other_line), (other_line, rail_line)):
+        rail_supergraph[rail1][rail2] = rail_supergraph[rail1].get(rail2, []) + [station]
+        self.rail_network[station, rail1][station, rail2] = self.transfer_penalty
+
+    self.rail_stations[rail_line].add(station)
+    self.st_routes[station].add(rail_line)
+    if len(self.st_routes[station]) > 1:
+      self.st_multi_routes[station] = self.st_routes[station]
+
+
+network = MetroNetwork()
+
+# Module-level names preceding MetroNetwork, now resolved lazily through the default network
+_NETWORK_ATTRIBUTES = frozenset(('id_lines', 'id_stations', 'line_edges', 'line_ids', 'station_ids',
+                                 'station_coords', 'station_table', 'distance_matrix',
+                                 'station_vectors', 'projected_coords', 'station_index', 'min_lat',
+                                 'min_lon', 'max_lat', 'max_lon', 'enum_stations', 'rail_stations',
+                                 'st_routes', 'st_multi_routes', 'rail_supergraph',
+                                 'rail_subgraphs', 'rail_network', 'route_cache'))
+
+
+def __getattr__(name: str):
+  if name in _NETWORK_ATTRIBUTES:
+    return getattr(network, name)
+  raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
+
+
+def geo_heuristic(goals: list[Station]):
+  """
+  A* heuristic estimating remaining distance as the straight chord towards the closest goal
+  station. Never overestimates, as every edge weight in rail_subgraphs is a great-circle distance,
+  which no chord between the same stations exceeds.
+  """
+  station_vectors = network.station_vectors
+  goal_vectors = [station_vectors[goal.id] for goal in goals]
+  if len(goal_vectors) == 1:
+    goal_vector = goal_vectors[0]
+    return lambda station: math.dist(station_vectors[station.id], goal_vector)
+  return lambda station: min(math.dist(station_vectors[station.id], vector)
+                             for vector in goal_vectors)
+
+
+precomputed_routes = None  # All-pairs route_table.RouteTable serving route_stops(), once enabled
+
+
+def enable_route_table(workers: int | None = None) -> None:
+  """
+  Serves subsequent routing from the on-disk all-pairs route table, building it if missing or if it
+  was built from different dataset files. While any track is closed, the table is built in memory
+  only, and is disabled again by any further closure.
+  """
+  global precomputed_routes
+  from route_table import RouteTable  # Deferred, as route_table builds upon this module
+  if network.closures:
+    precomputed_routes = RouteTable.build(workers)
+  else:
+    precomputed_routes = RouteTable.load_or_build(f'{network.path}route_table.bin', workers)
+
+
+def current_route_table():
+  """
+  The enabled route table, or None if disabled or since outdated by closures
+  """
+  if precomputed_routes is not None and \
+     precomputed_routes.source_version == network.rail_network.version:
+    return precomputed_routes
+  return None
+
+
+hierarchy_file = 'hierarchy.pickle'
+rail_hierarchy = None  # hierarchy.ContractionHierarchy over rail_network serving route_stops()
+
+
+def enable_hierarchy() -> None:
+  """
+  Serves subsequent routing through a contraction hierarchy of rail_network, loaded from beside the
+  dataset or else built and saved there. As with enable_route_table(), it is built in memory only
+  while any track is closed, and is disabled again by any further closure.
+  """
+  global rail_hierarchy
+  from hierarchy import ContractionHierarchy  # Deferred, as hierarchy is optional preprocessing
+  file_path = f'{network.path}{hierarchy_file}'
+  source_key = (network.digest, network.transfer_penalty)
+  station_ids, line_ids = network.station_ids, network.line_ids
+  id_stations, id_lines = network.id_stations, network.id_lines
+
+  hierarchy = None if network.closures else ContractionHierarchy.load(
+    file_path, source_key, lambda ids: (id_stations[ids[0]], id_lines[ids[1]]))
+  if hierarchy is None:
+    hierarchy = ContractionHierarchy.build(network.rail_network)
+    if not network.closures:
+      hierarchy.save(file_path, source_key, lambda stop: (station_ids[stop[0]], line_ids[stop[1]]))
+  hierarchy.source_version = network.rail_network.version
+  rail_hierarchy = hierarchy
+
+
+def current_hierarchy():
+  """
+  The enabled contraction hierarchy, or None if disabled or since outdated by closures
+  """
+  if rail_hierarchy is not None and rail_hierarchy.source_version == network.rail_network.version:
+    return rail_hierarchy
+  return None
+
+
+def current_router():
+  """
+  The router route_stops() searches with: the contraction hierarchy where enabled, else rail_router
+  """
+  return current_hierarchy() or network.rail_router
+
+
+def reload_network(dataset_path: str = path, use_snapshot: bool = True) -> None:
+  """
+  Replaces the network with a fresh load of the dataset, discarding every route derived from the
+  previous one
+  """
+  global network, precomputed_routes, rail_hierarchy
+  network = MetroNetwork(dataset_path, network.transfer_penalty, use_snapshot)
+  precomputed_routes = rail_hierarchy = None
 
 
 def route_rail(line: RailLine, st_start: Station, st_goal: Station) -> list[Station]:
-  return rail_subgraphs[line].start_search(st_start, st_goal)
+  rail_graph = network.rail_subgraphs[line]
+
+  def search() -> tuple[Station, ...]:
+    with instrument.phase('route_rail'):
+      if (index := network.line_index(line)).linear:
+        return tuple(index.shortest_path(st_start, st_goal))
+      return tuple(rail_graph.shortest_path(st_start, st_goal, geo_heuristic([st_goal])))
+
+  key = (line, st_start, st_goal)
+  return list(network.route_cache.lines.lookup(key, rail_graph.version, search))
 
 
 def route_closest(line: RailLine, st_start: Station, goals: list[Station]) -> list[Station]:
-  return min((route_rail(line, st_start, st_goal) for st_goal in goals), key=len)
+  rail_graph = network.rail_subgraphs[line]
+
+  def search() -> tuple[Station, ...]:
+    # One search towards whichever goal is nearest, rather than a search per goal
+    with instrument.phase('route_closest'):
+      if (index := network.line_index(line)).linear:
+        return tuple(index.nearest_path(st_start, goals)[0])
+      return tuple(rail_graph.nearest_path((st_start,), goals, geo_heuristic(goals))[0])
+
+  key = (line, st_start, frozenset(goals))
+  return list(network.route_cache.lines.lookup(key, rail_graph.version, search))
 
 
 def route_between_lines(rl_start: RailLine, rl_goal: RailLine) -> list[RailLine]:
-  return rail_supergraph.start_search(rl_start, rl_goal)
+  rail_supergraph = network.rail_supergraph
+
+  def search() -> tuple[RailLine, ...]:
+    with instrument.phase('route_between_lines'):
+      return tuple(rail_supergraph.start_search(rl_start, rl_goal))
+
+  key = (rl_start, rl_goal)
+  return list(network.route_cache.supergraph.lookup(key, rail_supergraph.version, search))
 
 
 def gen_st_instr(line: RailLine, stations: list[Station]) -> tuple[RailLine, str]:
-  stations = list(map(operator.attrgetter("name"), stations))
-  mid_stations = '\n'.join(map(lambda txt: '\t\t- ' + txt, stations[1:-1]))
-  mid_steps = f'\n\n\tWait through:\n{mid_stations}\n\n' if len(stations) > 2 else '\n\n'
-  rail_info = f'Use the {line.name}:'
-  return line, f'{rail_info}\n\tEmbark at: {stations[0]}{mid_steps}\tDisembark at: {stations[-1]}'
+  with instrument.phase('gen_st_instr'):
+    stations = list(map(operator.attrgetter("name"), stations))
+    mid_stations = '\n'.join(map(lambda txt: '\t\t- ' + txt, stations[1:-1]))
+    mid_steps = f'\n\n\tWait through:\n{mid_stations}\n\n' if len(stations) > 2 else '\n\n'
+    rail_info = f'Use the {line.name}:'
+    return line, f'{rail_info}\n\tEmbark at: {stations[0]}{mid_steps}\tDisembark at: {stations[-1]}'
 
 
-def gen_route_instr(st_start: Station, st_goal: Station) -> (tuple[RailLine, str] |
-                                                             list[str | tuple[RailLine, str]]):
-  overlaps: set[RailLine] = st_routes[st_start].intersection(st_routes[st_goal])
+def route_stops(st_start: Station, st_goal: Station) -> list[tuple[Station, RailLine]]:
+  """
+  Globally cheapest journey across rail_network, as a list of (Station, RailLine) stops.
+  Empty if the goal cannot be reached.
+  """
+  with instrument.phase('route_stops'):
+    if route_table := current_route_table():
+      return route_table.stops(st_start, st_goal)
 
-  if len(overlaps) > 0:
-    # Stations are not disjoint by Metro line connections, permute lines & minimize for stops passed
-    possibilities = ((overlap, route_rail(overlap, st_start, st_goal)) for overlap in overlaps)
-    return gen_st_instr(*min(possibilities, key=len))
-  else:  # Reached only if stations are disjoint by rail-lines
-    # Start determining complex route by first reducing necessary line transfers
-    rails = itertools.product(st_routes[st_start], st_routes[st_goal])
-    super_route = list(min(itertools.starmap(route_between_lines, rails), key=len))
+    starts = [(st_start, rail_line) for rail_line in network.st_routes[st_start]]
+    goals = [(st_goal, rail_line) for rail_line in network.st_routes[st_goal]]
+    heuristic = geo_heuristic([st_goal])
+    return current_router().nearest_path(starts, goals, lambda stop: heuristic(stop[0]))[0]
 
-    routing_instrs: list[str | tuple[RailLine, str]] = []
-    mid_disembark: Station = st_start
 
-    for rail_start, rail_goal in itertools.pairwise(super_route):
-      # Seek for closest possible station to exit the first Metro line, with stops minimized
-      target_stations = list(rail_stations[rail_start].intersection(rail_stations[rail_goal]))
-      closest_for_entry = route_closest(rail_start, mid_disembark, target_stations)
-      mid_disembark = closest_for_entry[-1]
+def route_alternatives(st_start: Station, st_goal: Station, k: int | None = None
+                       ) -> Iterator[tuple[list[tuple[Station, RailLine]], float]]:
+  """
+  Lazily yields up to k journeys across rail_network (or all of them), cheapest first, alongside
+  their costs, as lists of (Station, RailLine) stops. The first is the journey route_stops() would
+  have found. Journeys passing through the same station twice, other than to change lines there,
+  are skipped.
+  """
+  starts = [(st_start, rail_line) for rail_line in network.st_routes[st_start]]
+  goals = [(st_goal, rail_line) for rail_line in network.st_routes[st_goal]]
+  heuristic = geo_heuristic([st_goal])
+  journeys = network.rail_router.shortest_paths(starts, goals, lambda stop: heuristic(stop[0]))
 
-      # Actually add data for return
-      routing_instrs.append(gen_st_instr(rail_start, closest_for_entry))
-      routing_instrs.append(f'Line transfer {rail_start.name} -> {rail_goal.name}')
+  def loopless(stops: list[tuple[Station, RailLine]]) -> bool:
+    stations = [station for station, _ in itertools.groupby(stops, key=operator.itemgetter(0))]
+    return len(stations) == len(set(stations))
 
-    last_leg = gen_st_instr(super_route[-1], route_rail(super_route[-1], mid_disembark, st_goal))
-    routing_instrs.append(last_leg)
+  yield from itertools.islice(((stops, cost) for stops, cost in journeys if loopless(stops)), k)
 
-    return routing_instrs
 
+def nearest_station(coords: tuple[float, float]) -> Station:
+  """
+  Closest station to (longitude, latitude) coordinates, for routing from a location
+  """
+  return network.station_index.nearest(coords)[0][1]
 
-if __name__ == '__main__':
-  assert len(id_stations) == 308  # Total stations
-  assert len(id_lines) == 13  # Total metro lines
 
-  assert len(id_stations) == len(st_routes)  # Parity check
-  assert len(id_lines) == len(line_edges)  # Parity check
+def route_from_coords(coords: tuple[float, float],
+                      st_goal: Station) -> list[tuple[Station, RailLine]]:
+  return route_stops(nearest_station(coords), st_goal)
+
 
-  assert len(st_multi_routes) == 78  # Total stations s. t. passengers can switch lines
+def split_legs(stops: list[tuple[Station, RailLine]]) -> list[tuple[RailLine, list[Station]]]:
+  """
+  Groups consecutive stops by line, each group being one leg of the journey.
+  A transfer ends one leg and starts the next at the same station.
+  """
+  return [(rail_line, list(map(operator.itemgetter(0), leg)))
+          for rail_line, leg in itertools.groupby(stops, key=operator.itemgetter(1))]
 
-  assert (min_lon, max_lon) == (-0.611, 0.251)  # Longitude bounds, immutable from source
-  assert (min_lat, max_lat) == (51.4022, 51.7052)  # Latitude bounds, immutable from source
+
+def gen_legs_instr(legs: list[tuple[RailLine, list[Station]]]
+                   ) -> tuple[RailLine, str] | list[str | tuple[RailLine, str]]:
+  if len(legs) == 1:
+    return gen_st_instr(*legs[0])
+
+  routing_instrs: list[str | tuple[RailLine, str]] = []
+  for (rail_start, stations), (rail_goal, _) in itertools.pairwise(legs):
+    routing_instrs.append(gen_st_instr(rail_start, stations))
+    routing_instrs.append(f'Line transfer {rail_start.name} -> {rail_goal.name}')
+  if legs:
+    routing_instrs.append(gen_st_instr(*legs[-1]))
+
+  return routing_instrs
+
+
+def gen_route_instr(st_start: Station, st_goal: Station) -> (tuple[RailLine, str] |
+                                                             list[str | tuple[RailLine, str]]):
+  def itinerary() -> tuple[tuple[tuple[Station, RailLine], ...], tuple | list]:
+    stops = route_stops(st_start, st_goal)
+    return tuple(stops), gen_legs_instr(split_legs(stops))  # Stops kept to check closures against
+
+  with instrument.query('gen_route_instr', st_start, st_goal):
+    _, instructions = network.route_cache.itineraries.lookup(
+      (st_start, st_goal), network.rail_network.version, itinerary
+    )
+  return list(instructions) if isinstance(instructions, list) else instructions
+
+
+if __name__ == '__main__':
+  assert len(network.id_stations) == 308  # Total stations
+  assert len(network.id_lines) == 13  # Total metro lines
+
+  assert len(network.id_stations) == len(network.st_routes)  # Parity check
+  assert len(network.id_lines) == len(network.line_edges)  # Parity check
+
+  assert len(network.st_multi_routes) == 78  # Total stations s. t. passengers can switch lines
+
+  # Longitude & latitude bounds, immutable from source
+  assert (network.min_lon, network.max_lon) == (-0.611, 0.251)
+  assert (network.min_lat, network.max_lat) == (51.4022, 51.7052)
+
+  acton, upminster = (next(st for st in network.id_stations.values() if st.name == name)
+                      for name in ('Acton Town', 'Upminster'))
+  assert isinstance(gen_route_instr(acton, upminster), tuple)  # Both on the District Line
+  assert all(len(gen_route_instr(acton, st_goal)) > 0 for st_goal in network.id_stations.values())
+
+  cache = network.route_cache
+  hits = cache.itineraries.hits
+  assert gen_route_instr(acton, upminster) == gen_route_instr(acton, upminster)
+  assert cache.itineraries.hits == hits + 2
+  district = next(rl for rl in network.id_lines.values() if rl.name == 'District Line')
+  assert route_rail(district, acton, upminster) == route_rail(district, acton, upminster)
+  assert cache.lines.hits == 1
+  assert network.line_index(district).linear
+  network.rail_subgraphs[district][acton][upminster] = 0.0  # Imaginary express service
+  assert not network.line_index(district).linear  # Rebuilt, only ridden one way so searched
+  assert route_rail(district, acton, upminster) == [acton, upminster]
+  assert cache.lines.invalidations == 1
+  del network.rail_subgraphs[district][acton][upminster]
+  assert network.line_index(district).linear
+  earls_court = next(st for st in network.id_stations.values() if st.name == "Earl's Court")
+  assert route_closest(district, acton, [upminster, earls_court]) == \
+    network.rail_subgraphs[district].nearest_path((acton,), [upminster, earls_court])[0]
+  victoria = next(rl for rl in network.id_lines.values() if rl.name == 'Victoria Line')
+  assert route_between_lines(district, victoria) == route_between_lines(district, victoria)
+  assert cache.supergraph.hits == 1
+
+  # Alternatives, cheapest first, the first being the journey route_stops() finds
+  alternatives = list(route_alternatives(acton, upminster, k=4))
+  assert len(alternatives) == 4 and alternatives[0][0] == route_stops(acton, upminster)
+  assert [cost for _, cost in alternatives] == sorted(cost for _, cost in alternatives)
+  for stops, cost in alternatives:
+    assert stops[0][0] == acton and stops[-1][0] == upminster
+    assert abs(network.rail_network.path_length(stops) - cost) < 1e-9
+  assert len({tuple(stops) for stops, _ in alternatives}) == len(alternatives)
+  assert next(route_alternatives(acton, acton))[1] == 0
+
+  # Closures
+  def supergraph_links() -> dict[tuple[RailLine, RailLine], set[Station]]:
+    return {(rail1, rail2): set(network.rail_supergraph[rail1][rail2])
+            for rail1 in network.rail_supergraph.vertices()
+            for rail2 in network.rail_supergraph.neighbors(rail1)}
+
+  original_edges, original_links = network.rail_network.edges(), supergraph_links()
+  journeys = {st_goal: route_stops(acton, st_goal) for st_goal in network.id_stations.values()}
+  bank = next(st for st in network.id_stations.values() if st.name == 'Bank')
+  bank_lines = set(network.st_routes[bank])
+  hits, invalidations = cache.itineraries.hits, cache.itineraries.invalidations
+  disruption = network.close_station(bank)
+  # Including any terminus left stranded, such as Waterloo on the Waterloo & City line
+  assert disruption.stops >= {(bank, rail_line) for rail_line in bank_lines}
+  assert not network.st_routes[bank] and bank not in network.st_multi_routes
+  assert not any(bank in network.rail_stations[rail_line] for rail_line in bank_lines)
+  assert not any(bank in stations for stations in supergraph_links().values())
+  assert not any(stop[0] == bank for stop in network.rail_network.vertices())
+  severed = {st_goal for st_goal, stops in journeys.items() if disruption.severs_journey(stops)}
+  assert severed and len(severed) < len(journeys)
+  assert cache.itineraries.invalidations == invalidations + len(severed)
+  for st_goal in journeys.keys() - severed:  # Unaffected routes remain cached
+    gen_route_instr(acton, st_goal)
+  assert cache.itineraries.hits == hits + len(journeys) - len(severed)
+  for st_goal in severed - {bank}:
+    stops = route_stops(acton, st_goal)
+    assert stops and all(station != bank for station, _ in stops)
+  assert route_stops(acton, bank) == []
+
+  network.suspend_line(district)
+  assert not network.rail_stations[district] and not network.rail_subgraphs[district].edges()
+  assert district not in network.rail_supergraph.neighbors(next(iter(bank_lines)))
+  assert all(rail_line != district for _, rail_line in route_stops(acton, upminster))
+
+  network.reopen_all()
+  assert network.rail_network.edges() == original_edges
+  assert supergraph_links() == original_links
+  assert len(network.st_multi_routes) == 78 and network.st_routes[bank] == bank_lines
+  assert isinstance(gen_route_instr(acton, upminster), tuple)
+
+  snapshotted = MetroNetwork()  # Loads the snapshot saved upon building network.rail_network
+  assert snapshotted._snapshot is not None
+  assert len(snapshotted.rail_network) == len(network.rail_network)
+
+  def edge_ids(rail_network: Graph) -> set[tuple[int, int, int, int, float]]:
+    return {(station1.id, line1.id, station2.id, line2.id, weight)
+            for (station1, line1), (station2, line2), weight in rail_network.edges()}
+
+  assert edge_ids(snapshotted.rail_network) == edge_ids(network.rail_network)  # Same by their ids
+  assert snapshotted.id_stations['1'] is not network.id_stations['1']  # Yet distinct instances
+
+  # Snapshots are best-effort: unwritable or torn files are only ever rebuilt from the CSV files
+  import tempfile
+  with tempfile.TemporaryDirectory() as temp_dir:
+    unwritable = MetroNetwork()
+    unwritable.snapshot_path = os.path.join(temp_dir, 'missing', snapshot_file)
+    assert edge_ids(unwritable.rail_network) == edge_ids(network.rail_network)
+    assert not unwritable.save_snapshot() and not os.listdir(temp_dir)
+    torn = MetroNetwork()
+    torn.snapshot_path = os.path.join(temp_dir, snapshot_file)
+    with open(snapshotted.snapshot_path, 'rb') as snapshot, open(torn.snapshot_path, 'wb') as copy:
+      copy.write(snapshot.read()[:1000])
+    assert torn._snapshot is None and torn.save_snapshot()
+    assert os.listdir(temp_dir) == [snapshot_file]  # Replaced whole, no temporary file left over
+
+  assert pickle.loads(pickle.dumps(bank)).astuple() == bank.astuple()
+  snapshotted_bank = snapshotted.id_stations[network.station_ids[bank]]
+  assert snapshotted_bank != bank and snapshotted_bank.astuple() == bank.astuple()
+  assert {rail_line.id for rail_line in snapshotted.st_routes[snapshotted_bank]} == \
+    {rail_line.id for rail_line in bank_lines}
+  with contextlib.suppress(AttributeError):
+    bank.zone = '2'
+    assert False, 'Stations are immutable'
+  table = network.station_table
+  assert table[table.rows[bank]] is bank and table.coords(table.rows[bank]) == bank.geo_coords
+  assert table.zones[table.rows[bank]] == float(bank.zone)
 
   print('All assertions passed!')
@@ -0,0 +1,183 @@
+#!/usr/bin/env python
+"""
+Batch routing of many origin-destination pairs across a process pool
+
+Pairs are routed in blocks, each block handed to a worker process which shares the network already
+loaded by as13 (inherited when forked, otherwise loaded from the network snapshot). Within a block,
+pairs sharing an origin reuse one single-source search tree rather than searching pair by pair.
+Results stream back in the same order the pairs were given.
+"""
+
+__author__ = 'https://github.com/Drullkus'
+
+import collections
+import itertools
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import Iterable, Iterator, NamedTuple
+
+import as13
+from subway_lib import RailLine, Station
+
+
+class RouteResult(NamedTuple):
+  """
+  Structured itinerary between two stations, keyed by dataset ids so it may cross processes.
+  Legs are (line id, station ids) pairs, and are empty along with cost if the goal is unreachable.
+  Instructions, only when requested, are as gen_legs_instr() returns them, RailLine records and all;
+  those records are copies once across processes, to be matched by id rather than identity.
+  """
+  start: str
+  goal: str
+  cost: float | None
+  legs: tuple[tuple[str, tuple[str, ...]], ...]
+  instructions: tuple[RailLine, str] | list[str | tuple[RailLine, str]] | None = None
+
+  @property
+  def transfers(self) -> int:
+    return max(len(self.legs) - 1, 0)
+
+  @property
+  def stops(self) -> int:
+    return sum(len(stations) - 1 for _, stations in self.legs)
+
+
+def _tree_stops(tree: tuple[dict, dict], st_goal: Station) -> tuple[list, float | None]:
+  costs, previous = tree
+  reached = [stop for stop in ((st_goal, rail_line) for rail_line in as13.st_routes[st_goal])
+             if stop in costs]
+  if not reached:
+    return [], None
+
+  stop = min(reached, key=costs.__getitem__)
+  cost, path = costs[stop], []
+  while stop is not None:
+    path.append(stop)
+    stop = previous[stop]
+  return path[::-1], cost
+
+
+def _pair_stops(st_start: Station, st_goal: Station) -> tuple[list, float | None]:
+  if route_table := as13.current_route_table():
+    return route_table.stops(st_start, st_goal), route_table.cost(st_start, st_goal)
+
+  starts = [(st_start, rail_line) for rail_line in as13.st_routes[st_start]]
+  goals = [(st_goal, rail_line) for rail_line in as13.st_routes[st_goal]]
+  heuristic = as13.geo_heuristic([st_goal])
+  return as13.current_router().nearest_path(starts, goals, lambda stop: heuristic(stop[0]))
+
+
+def _route_block(pairs: list[tuple[str, str]], instructions: bool,
+                 tree_threshold: int) -> list[RouteResult]:
+  """
+  Process pool task: routes one block of pairs, in order
+  """
+  id_stations, line_ids, station_ids = as13.id_stations, as13.line_ids, as13.station_ids
+  origin_counts = collections.Counter(start for start, _ in pairs)
+  trees: dict[str, tuple[dict, dict]] = {}
+
+  results = []
+  for start, goal in pairs:
+    st_start, st_goal = id_stations[start], id_stations[goal]
+    # Search trees come from rail_router, so only where route_stops() would search it too
+    if origin_counts[start] >= tree_threshold and as13.current_route_table() is None \
+       and as13.current_router() is as13.network.rail_router:
+      if start not in trees:
+        starts = [(st_start, rail_line) for rail_line in as13.st_routes[st_start]]
+        trees[start] = as13.network.rail_router.search_tree(starts)
+      stops, cost = _tree_stops(trees[start], st_goal)
+    else:
+      stops, cost = _pair_stops(st_start, st_goal)
+
+    legs = as13.split_legs(stops)
+    results.append(RouteResult(
+      start, goal, cost,
+      tuple((line_ids[rail_line], tuple(map(station_ids.__getitem__, stations)))
+            for rail_line, stations in legs),
+      as13.gen_legs_instr(legs) if instructions else None
+    ))
+
+  return results
+
+
+def fork_executor(workers: int | None = None) -> ProcessPoolExecutor:
+  """
+  Process pool of workers, defaulting to one per CPU, forked from this process where the platform
+  allows. Forked workers inherit the network as loaded by as13, closures included, so everything
+  is built up front for them rather than once per worker. Elsewhere each worker loads the network
+  afresh, from its snapshot, without any closures.
+  """
+  as13.network.rail_router
+  context = multiprocessing.get_context('fork') \
+    if 'fork' in multiprocessing.get_all_start_methods() else None
+  return ProcessPoolExecutor(max_workers=workers or os.cpu_count() or 1, mp_context=context)
+
+
+def _blocks(pairs: Iterable[tuple[str, str]], block_size: int) -> Iterator[list[tuple[str, str]]]:
+  pairs = iter(pairs)
+  while block := list(itertools.islice(pairs, block_size)):
+    yield block
+
+
+def route_batch(pairs: Iterable[tuple[str, str]], workers: int | None = None,
+                instructions: bool = False, block_size: int = 512,
+                tree_threshold: int = 4) -> Iterator[RouteResult]:
+  """
+  Routes every (start, goal) pair of station ids, yielding a RouteResult per pair in input order.
+
+  workers: Process count, defaulting to one per CPU. Zero routes within the calling process.
+  instructions: Whether to also generate gen_route_instr() text, skipped by default.
+  block_size: Pairs per worker task. Sorting pairs by origin lets more of them share search trees.
+  tree_threshold: Pairs sharing an origin within one block needed to search a whole tree instead.
+  """
+  blocks = _blocks(pairs, block_size)
+  if workers == 0:
+    for block in blocks:
+      yield from _route_block(block, instructions, tree_threshold)
+    return
+
+  workers = workers or os.cpu_count() or 1
+  with fork_executor(workers) as executor:
+    # Bounded window of in-flight blocks, so arbitrarily long inputs are streamed through
+    window = collections.deque()
+    for block in blocks:
+      window.append(executor.submit(_route_block, block, instructions, tree_threshold))
+      if len(window) >= workers * 2:
+        yield from window.popleft().result()
+    while window:
+      yield from window.popleft().result()
+
+
+if __name__ == '__main__':
+  all_pairs = list(itertools.permutations(as13.id_stations, 2))
+
+  start_time = time.perf_counter()
+  batched = list(route_batch(all_pairs))
+  print(f'Routed {len(batched)} pairs in {time.perf_counter() - start_time:.2f}s')
+
+  assert [(result.start, result.goal) for result in batched] == all_pairs  # Order is preserved
+  assert all(result.legs for result in batched)
+  for result in batched[::97]:
+    st_start, st_goal = as13.id_stations[result.start], as13.id_stations[result.goal]
+    expected = as13.rail_network.path_length(as13.route_stops(st_start, st_goal))
+    assert abs(result.cost - expected) < 1e-9
+    assert result.legs[0][1][0] == result.start and result.legs[-1][1][-1] == result.goal
+
+  serial = list(route_batch(all_pairs[:50], workers=0, instructions=True))
+  assert [result.cost for result in serial] == [result.cost for result in batched[:50]]
+  assert all(result.instructions for result in serial)
+
+  # With a hierarchy enabled, batches follow it just as route_stops() does, trees and all
+  as13.enable_hierarchy()
+  hierarchical = list(route_batch(all_pairs[:200], workers=0))
+  for result in hierarchical:
+    stops = as13.route_stops(as13.id_stations[result.start], as13.id_stations[result.goal])
+    assert [as13.line_ids[rail_line] for rail_line, _ in as13.split_legs(stops)] == \
+           [line_id for line_id, _ in result.legs]
+  assert all(abs(result.cost - expected.cost) < 1e-9
+             for result, expected in zip(hierarchical, batched))
+  as13.rail_hierarchy = None
+
+  print('All assertions passed!')
@@ -0,0 +1,172 @@
+#!/usr/bin/env python
+"""
+Benchmarks of the routing stack, emitted as JSON for comparison between commits
+
+Each run times dataset loading, graph construction, and the graph and routing queries built upon
+them, against the London datasets or synthetic networks of increasing size. Every stage records its
+total seconds, operation count and microseconds per operation.
+"""
+
+__author__ = 'https://github.com/Drullkus'
+
+import argparse
+import itertools
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+import time
+
+import as13
+import synthetic
+
+
+def _timed(stages: dict[str, dict], name: str, run) -> None:
+  """
+  Calls run(), which returns how many operations it performed, and records how long it took
+  """
+  start_time = time.perf_counter()
+  operations = run()
+  seconds = time.perf_counter() - start_time
+  stages[name] = {'seconds': round(seconds, 6), 'operations': operations,
+                  'per_op_us': round(seconds / operations * 1e6, 3) if operations else None}
+
+
+def _sample(population: list, limit: int | None, rng: random.Random) -> list:
+  return population if limit is None or len(population) <= limit else rng.sample(population, limit)
+
+
+def bench_network(dataset_path: str, max_pairs: int | None = None, seed: int = 0) -> dict:
+  """
+  Benchmarks every stage against a freshly loaded dataset, bypassing any network snapshot. Each
+  run records whether its edges and station table were read from the dataset's columnar copy.
+  max_pairs: Station pairs sampled for each query stage, otherwise every pair is queried.
+  """
+  as13.reload_network(dataset_path, use_snapshot=False)
+  network = as13.network
+  rng = random.Random(seed)
+  stages: dict[str, dict] = {}
+
+  def load() -> int:
+    network.id_lines, network.id_stations, network.line_edges
+    return len(network.id_stations)
+
+  def construct() -> int:
+    network.rail_subgraphs, network.rail_supergraph, network.rail_network
+    return len(network.rail_network)
+
+  _timed(stages, 'dataset_load', load)
+  _timed(stages, 'graph_construction', construct)
+
+  rail_supergraph, rail_network = network.rail_supergraph, network.rail_network
+  line_pairs = _sample(list(itertools.permutations(rail_supergraph.vertices(), 2)), max_pairs, rng)
+  stops = list(rail_network.vertices())
+  stop_pairs = [(rng.choice(stops), rng.choice(stops)) for _ in range(max_pairs or len(stops) * 10)]
+  stations = [station for station, routes in network.st_routes.items() if routes]
+  station_pairs = _sample(list(itertools.permutations(stations, 2)), max_pairs, rng)
+  closest_queries = _sample([(rail_line, station, [goal for goal in network.rail_stations[rail_line]
+                                                   if goal in network.st_multi_routes])
+                             for rail_line in network.rail_subgraphs
+                             for station in network.rail_stations[rail_line]], max_pairs, rng)
+
+  def start_search() -> int:
+    for rl_start, rl_goal in line_pairs:
+      rail_supergraph.start_search(rl_start, rl_goal)
+    return len(line_pairs)
+
+  def are_connected() -> int:
+    for start, goal in stop_pairs:
+      rail_network.are_connected(start, goal)
+    return len(stop_pairs)
+
+  def is_connected() -> int:
+    graphs = [rail_network, *network.rail_subgraphs.values()]
+    for graph in graphs:
+      graph.is_connected()
+    return len(graphs)
+
+  def route_closest() -> int:
+    for query in closest_queries:
+      as13.route_closest(*query)
+    return len(closest_queries)
+
+  def gen_route_instr() -> int:
+    for st_start, st_goal in station_pairs:
+      as13.gen_route_instr(st_start, st_goal)
+    return len(station_pairs)
+
+  _timed(stages, 'start_search', start_search)
+  _timed(stages, 'are_connected', are_connected)
+  _timed(stages, 'is_connected', is_connected)
+  _timed(stages, 'route_closest', route_closest)
+  _timed(stages, 'gen_route_instr', gen_route_instr)
+
+  return {'dataset': dataset_path, 'lines': len(network.id_lines),
+          'stations': len(network.id_stations), 'interchanges': len(network.st_multi_routes),
+          'rail_network_vertices': len(rail_network), 'columnar': network.columns is not None,
+          'stages': stages}
+
+
+def _commit() -> str | None:
+  try:
+    return subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True,
+                          cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+  except OSError:
+    return None
+
+
+def compare(baseline: dict, current: dict) -> list[str]:
+  """
+  Per-stage ratios of current over baseline time per operation, for runs of the same dataset
+  """
+  baseline_runs = {run['dataset']: run for run in baseline['runs']}
+  lines = []
+  for new_run in current['runs']:
+    old_run = baseline_runs.get(new_run['dataset'], {'stages': {}})
+    for stage, result in new_run['stages'].items():
+      old_result = old_run['stages'].get(stage)
+      if old_result and old_result['per_op_us'] and result['per_op_us']:
+        lines.append(f"{new_run['dataset']:<24} {stage:<20} "
+                     f"{result['per_op_us'] / old_result['per_op_us']:6.2f}x")
+  return lines
+
+
+if __name__ == '__main__':
+  parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+  parser.add_argument('--dataset', default=as13.path, help='Dataset directory to benchmark')
+  parser.add_argument('--synthetic', type=lambda text: list(map(int, text.split(','))),
+                      metavar='STATIONS,...', help='Benchmark synthetic networks of these sizes')
+  parser.add_argument('--lines', type=int, default=13, help='Lines of each synthetic network')
+  parser.add_argument('--interchange-density', type=float, default=0.25)
+  parser.add_argument('--seed', type=int, default=0)
+  parser.add_argument('--max-pairs', type=int, help='Pairs sampled per query stage')
+  parser.add_argument('--output', help='File to write JSON results to, instead of stdout')
+  parser.add_argument('--compare', help='Earlier JSON results to print per-stage ratios against')
+  args = parser.parse_args()
+
+  runs = []
+  if args.synthetic:
+    for station_count in args.synthetic:
+      with tempfile.TemporaryDirectory() as directory:
+        synthetic.generate(directory, args.lines, station_count, args.interchange_density,
+                           args.seed)
+        runs.append(bench_network(f'{directory}/', args.max_pairs, args.seed))
+        runs[-1]['dataset'] = f'synthetic:{station_count}'
+  else:
+    runs.append(bench_network(args.dataset, args.max_pairs, args.seed))
+
+  results = {'commit': _commit(), 'python': platform.python_version(),
+             'platform': platform.platform(), 'runs': runs}
+  if args.output:
+    with open(args.output, 'w') as output_file:
+      json.dump(results, output_file, indent=2)
+  else:
+    json.dump(results, sys.stdout, indent=2)
+    print()
+
+  if args.compare:
+    with open(args.compare) as baseline_file:
+      print('\n'.join(compare(json.load(baseline_file), results)), file=sys.stderr)
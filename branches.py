@@ -0,0 +1,325 @@
+#!/usr/bin/env python
+"""
+Branch decomposition of a line's subgraph, answering same-line routes by index arithmetic
+
+Nearly every line is a tree of track: a chain of stations which may fork into branches. Rooted at
+one of its stations, the tree splits into branches, each a run of stations hanging below the
+station it forks from, with every station's branch, position along it, hop depth and distance from
+the root held in lookup tables. The one path between two stations is then found by climbing from
+each towards the root a branch at a time, and its length is pure arithmetic over those distances.
+
+A line with loops, such as the Circle Line, is indexed as the tree left after setting aside one
+track of each loop. Paths then run along the tree, possibly crossing set-aside tracks between
+stretches of it, by way of the shortest routes between the ends of those tracks, searched once when
+indexing. Lines with more loops than max_loops, or with track only ridden one way, are left to
+general graph search.
+"""
+
+__author__ = 'https://github.com/Drullkus'
+
+import heapq
+import itertools
+import time
+
+from graph import Graph
+from subway_lib import Station
+
+max_loops = 4  # Per connected stretch of a line, beyond which it is searched as a general graph
+
+
+class LineIndex:
+  """
+  Branches of one line's subgraph, as of the graph version it was built from. If linear is False,
+  the topology is too irregular to index and routes must be searched for instead.
+  """
+  def __init__(self, rail_graph: Graph):
+    self.source_version = rail_graph.version
+    self.linear = True
+    self.branches: list[list[Station]] = []
+    self._branch: dict[Station, int] = {}
+    self._position: dict[Station, int] = {}
+    self._depth: dict[Station, int] = {}  # Hops from the root of the station's component
+    self._distance: dict[Station, float] = {}  # Track length from that root
+    self._fork: list[Station | None] = []  # Station each branch hangs below, None for roots
+    self._forks_above: list[tuple[tuple[int, int], ...]] = []  # (branch, position) up to the root
+    self._component: dict[Station, Station] = {}  # Root of each station's component
+    self._loops: dict[Station, list[tuple[Station, Station, float]]] = {}  # Set aside, per root
+    self._track_ends: dict[Station, list[Station]] = {}  # Ends of those tracks, per root
+    self._end_routes: dict[Station, dict] = {}  # Shortest routes between those ends, per root
+    self._station_end_lengths: dict[Station, list[float]] = {}  # Filled in as first needed
+
+    for station1, station2, weight in rail_graph.edges():
+      if rail_graph[station2].get(station1) != weight:
+        self.linear = False  # Ridden one way only, or at different lengths each way
+        return
+
+    for root in rail_graph.vertices():
+      if root not in self._component and not self._index_component(rail_graph, root):
+        self.linear = False
+        return
+
+  def _index_component(self, rail_graph: Graph, root: Station) -> bool:
+    """
+    Depth-first pass over one connected component, extending the current branch through each
+    station's first unvisited neighbour and starting a new branch for every other. False if the
+    component has more than max_loops loops.
+    """
+    self._depth[root], self._distance[root] = 0, 0.0
+    self._start_branch(root, None)
+    extra_tracks = {}  # Tracks joining stations already reached some other way
+    stack = [(root, None)]
+    while stack:
+      station, parent = stack.pop()
+      self._component[station] = root
+      continued = False
+      for adjacent, weight in sorted(rail_graph[station].items(), key=lambda item: item[0].id):
+        if adjacent == parent:
+          continue
+        if adjacent in self._depth:
+          extra_tracks[frozenset((station, adjacent))] = (station, adjacent, weight)
+          continue
+
+        self._depth[adjacent] = self._depth[station] + 1
+        self._distance[adjacent] = self._distance[station] + weight
+        if continued:
+          self._start_branch(adjacent, station)
+        else:  # Nothing but this station's own descendants can have extended its branch yet
+          self._extend_branch(adjacent, self._branch[station])
+          continued = True
+        stack.append((adjacent, station))
+
+    if len(extra_tracks) > max_loops:
+      return False
+    if extra_tracks:
+      self._loops[root] = list(extra_tracks.values())
+      self._end_routes[root] = self._link_track_ends(self._loops[root])
+      self._track_ends[root] = list(self._end_routes[root])
+    return True
+
+  def _start_branch(self, station: Station, fork: Station | None) -> None:
+    self.branches.append([])
+    self._fork.append(fork)
+    self._forks_above.append(() if fork is None else (
+      (self._branch[fork], self._position[fork]), *self._forks_above[self._branch[fork]]))
+    self._extend_branch(station, len(self.branches) - 1)
+
+  def _extend_branch(self, station: Station, branch: int) -> None:
+    self._branch[station], self._position[station] = branch, len(self.branches[branch])
+    self.branches[branch].append(station)
+
+  def _tree_path(self, start: Station, goal: Station) -> list[Station]:
+    """
+    The one path between two stations of the same component within the tree, by climbing
+    whichever of the two sits on the branch forking off deeper until both share a branch
+    """
+    from_start, from_goal = [], []
+    while self._branch[start] != self._branch[goal]:
+      start_top = self.branches[self._branch[start]][0]
+      goal_top = self.branches[self._branch[goal]][0]
+      if self._depth[start_top] >= self._depth[goal_top]:
+        branch = self.branches[self._branch[start]]
+        from_start.extend(branch[self._position[start]::-1])
+        start = self._fork[self._branch[start]]
+      else:
+        branch = self.branches[self._branch[goal]]
+        from_goal.extend(branch[self._position[goal]::-1])
+        goal = self._fork[self._branch[goal]]
+
+    branch, start_pos, goal_pos = self.branches[self._branch[start]], \
+      self._position[start], self._position[goal]
+    shared = branch[start_pos:goal_pos + 1] if start_pos <= goal_pos else \
+      branch[start_pos:goal_pos - 1 if goal_pos else None:-1]
+    return from_start + shared + from_goal[::-1]
+
+  def _ancestry(self, station: Station) -> dict[int, int]:
+    """
+    Position along each branch of the stations passed climbing from the station up to its root
+    """
+    branch = self._branch[station]
+    return dict(((branch, self._position[station]), *self._forks_above[branch]))
+
+  def _tree_length(self, ancestry: dict[int, int], start: Station, goal: Station) -> float:
+    """
+    Length of _tree_path(start, goal) given the ancestry of start, by climbing from the goal up to
+    the first branch shared with that ancestry, where the two paths towards the root meet
+    """
+    branch, position = self._branch[goal], self._position[goal]
+    if branch not in ancestry:
+      for branch, position in self._forks_above[branch]:
+        if branch in ancestry:
+          break
+    meeting = self.branches[branch][min(ancestry[branch], position)]
+    return self._distance[start] + self._distance[goal] - 2 * self._distance[meeting]
+
+  def _link_track_ends(self, loops: list[tuple[Station, Station, float]]) -> dict:
+    """
+    Shortest routes between every pair of set-aside track ends of one component, as their lengths
+    and hops, each hop (from, to, along_tree) running either along the tree or over a set-aside
+    track. Found by Dijkstra's algorithm from each end over only those stations.
+    """
+    tracks: dict[Station, list[tuple[Station, float]]] = {}
+    for station1, station2, weight in loops:
+      tracks.setdefault(station1, []).append((station2, weight))
+      tracks.setdefault(station2, []).append((station1, weight))
+    ancestries = {end: self._ancestry(end) for end in tracks}
+
+    routes = {}
+    for source in tracks:
+      best: dict[Station, tuple[float, tuple]] = {source: (0.0, ())}
+      heap, tie, settled = [(0.0, 0, source)], itertools.count(1), {}
+      while heap:
+        length, _, end = heapq.heappop(heap)
+        if end in settled:
+          continue
+        settled[end] = best[end]
+        hops = best[end][1]
+        steps = [(other, self._tree_length(ancestries[end], end, other), True) for other in tracks]
+        steps += [(other, weight, False) for other, weight in tracks[end]]
+        for other, weight, along_tree in steps:
+          if other not in best or length + weight < best[other][0]:
+            best[other] = length + weight, (*hops, (end, other, along_tree))
+            heapq.heappush(heap, (length + weight, next(tie), other))
+      routes[source] = settled
+    return routes
+
+  def _end_lengths(self, station: Station) -> list[float]:
+    """
+    Tree lengths from each set-aside track end of the station's component, in _track_ends order
+    """
+    lengths = self._station_end_lengths.get(station)
+    if lengths is None:
+      ancestry = self._ancestry(station)
+      lengths = [self._tree_length(ancestry, station, end)
+                 for end in self._track_ends[self._component[station]]]
+      self._station_end_lengths[station] = lengths
+    return lengths
+
+  def _nearest(self, start: Station, goals) -> tuple[float, tuple, Station] | None:
+    """
+    Length and hops of the shortest route to whichever goal is nearest, and that goal. The route
+    either stays on the tree, or runs along it to a set-aside track end, follows the precomputed
+    route from there to another end, then runs along the tree again.
+    """
+    if start not in self._component:
+      return None
+    component, ancestry = self._component[start], self._ancestry(start)
+    ends = self._track_ends.get(component, ())
+    if ends:
+      # Best way into each end, via whichever end is entered from the tree first
+      routes, start_lengths = self._end_routes[component], self._end_lengths(start)
+      entries = [min((start_lengths[idx] + routes[entry][end][0], idx, entry)
+                     for idx, entry in enumerate(ends)) for end in ends]
+
+    nearest = None
+    for goal in goals:
+      if self._component.get(goal) is not component:
+        continue
+      length = self._tree_length(ancestry, start, goal)
+      if nearest is None or length < nearest[0]:
+        nearest = length, ((start, goal, True),), goal
+      if ends:
+        for end, goal_length, (entry_length, _, entry) in zip(ends, self._end_lengths(goal),
+                                                              entries):
+          if entry_length + goal_length < nearest[0]:
+            hops = ((start, entry, True), *self._end_routes[component][entry][end][1],
+                    (end, goal, True))
+            nearest = entry_length + goal_length, hops, goal
+    return nearest
+
+  def reaches(self, start: Station, goal: Station) -> bool:
+    return start in self._component and self._component.get(goal) is self._component[start]
+
+  def path_length(self, start: Station, goal: Station) -> float | None:
+    """
+    Length of the shortest path between two stations of the line, or None if unreachable
+    """
+    nearest = self._nearest(start, (goal,))
+    return nearest[0] if nearest else None
+
+  def nearest_path(self, start: Station, goals) -> tuple[list[Station], float | None]:
+    """
+    Same as Graph.nearest_path() over the line's subgraph, from one start station
+    """
+    if start in goals:
+      return [start], 0
+    if not (nearest := self._nearest(start, goals)):
+      return [], None
+    path = [start]
+    for hop_start, hop_end, along_tree in nearest[1]:
+      path += self._tree_path(hop_start, hop_end)[1:] if along_tree else [hop_end]
+    return path, nearest[0]
+
+  def shortest_path(self, start: Station, goal: Station) -> list[Station]:
+    """
+    Same as Graph.shortest_path() over the line's subgraph
+    """
+    return self.nearest_path(start, (goal,))[0]
+
+
+if __name__ == '__main__':
+  import as13
+
+  def check_line(rail_graph: Graph, index: LineIndex) -> None:
+    stations = sorted(rail_graph.vertices(), key=lambda station: station.id)
+    for start, goal in itertools.product(stations, repeat=2):
+      expected = rail_graph.shortest_path(start, goal)
+      path = index.shortest_path(start, goal)
+      if not expected:
+        assert not path and index.path_length(start, goal) is None
+        continue
+      assert rail_graph.path_valid(path) and path[0] == start and path[-1] == goal
+      assert abs((rail_graph.path_length(path) or 0) - (rail_graph.path_length(expected) or 0)) \
+        < 1e-9
+      assert abs(index.path_length(start, goal) - (rail_graph.path_length(path) or 0)) < 1e-9
+
+  for rail_line, rail_graph in as13.rail_subgraphs.items():
+    index = LineIndex(rail_graph)
+    assert index.linear, rail_line
+    assert sum(map(len, index.branches)) == len(rail_graph)
+    check_line(rail_graph, index)
+
+  by_name = {station.name: station for station in as13.id_stations.values()}
+  circle = next(rl for rl in as13.id_lines.values() if rl.name == 'Circle Line')
+  assert LineIndex(as13.rail_subgraphs[circle])._loops  # Indexed around its loop
+
+  # Shortcuts forming more loops are indexed up to max_loops, past which graph search takes over
+  district = next(rl for rl in as13.id_lines.values() if rl.name == 'District Line')
+  acton, upminster, bank = by_name['Acton Town'], by_name['Upminster'], by_name['Bank']
+  rail_graph = as13.rail_subgraphs[district].copy()
+  assert len(LineIndex(rail_graph).branches) > 1 and not LineIndex(rail_graph)._loops
+  district_stations = sorted(rail_graph.vertices(), key=lambda station: station.id)
+  for shortcut in range(max_loops + 1):
+    station1, station2 = district_stations[shortcut * 3], district_stations[-1 - shortcut * 2]
+    rail_graph[station1][station2] = rail_graph[station2][station1] = 0.5 + shortcut
+    index = LineIndex(rail_graph)
+    assert index.linear == (shortcut < max_loops)
+    if index.linear:
+      check_line(rail_graph, index)
+  rail_graph = as13.rail_subgraphs[district].copy()
+  rail_graph[acton][upminster] = 0.0
+  assert not LineIndex(rail_graph).linear
+
+  # Closures split lines into several components, each indexed separately
+  rail_graph = as13.rail_subgraphs[district].copy()
+  middle = by_name['Earl\'s Court']
+  del rail_graph[middle]
+  index = LineIndex(rail_graph)
+  assert index.linear and not index.reaches(acton, upminster)
+  assert index.shortest_path(acton, upminster) == [] and index.path_length(acton, upminster) is None
+  check_line(rail_graph, index)
+  assert LineIndex(Graph()).shortest_path(bank, bank) == [bank]
+
+  stations = list(as13.rail_subgraphs[district].vertices())
+  index, rail_graph = LineIndex(as13.rail_subgraphs[district]), as13.rail_subgraphs[district]
+  start_time = time.perf_counter()
+  for start, goal in itertools.product(stations, repeat=2):
+    rail_graph.shortest_path(start, goal, as13.geo_heuristic([goal]))
+  searched = time.perf_counter() - start_time
+  start_time = time.perf_counter()
+  for start, goal in itertools.product(stations, repeat=2):
+    index.shortest_path(start, goal)
+  indexed = time.perf_counter() - start_time
+  print(f'District Line paths: {searched / len(stations)**2 * 1e6:.1f}us searched, '
+        f'{indexed / len(stations)**2 * 1e6:.1f}us indexed')
+
+  print('All assertions passed!')
@@ -0,0 +1,235 @@
+#!/usr/bin/env python
+"""
+Columnar binary copy of a dataset directory, loaded through mmap
+
+A one-time conversion writes every CSV column as a fixed-width array, with text held in one shared
+string table. Loading maps the file read-only and views each array in place, so no parsing takes
+place, and every process loading the same file shares the same physical pages.
+
+Stations and lines themselves are still parsed from the CSV files, which is quicker than decoding
+their text from the string table. What is read in place is everything numeric: the station table's
+coordinates, zones and line counts, and each line's edges as station rows.
+"""
+
+__author__ = 'https://github.com/Drullkus'
+
+import array
+import mmap
+import os
+import struct
+import sys
+import time
+
+from subway_lib import RailLine, Station, StationTable
+
+columnar_file = 'dataset.bin'
+
+_MAGIC = b'MCOL'
+_FORMAT_VERSION = 1
+# Magic, format version, little-endian flag, dataset digest, line, station, route & string counts
+_HEADER = struct.Struct('<4sH?32sIIII')
+_ALIGNMENT = 8
+
+
+def _column_layout(line_count: int, station_count: int, route_count: int,
+                   string_count: int) -> list[tuple[str, str, int]]:
+  """
+  Every array in file order, as (name, typecode, length)
+  """
+  return [('line_ids', 'i', line_count),
+          ('line_strings', 'i', line_count * 3),  # Name, colour, stripe
+          ('station_ids', 'i', station_count),
+          ('latitudes', 'd', station_count),
+          ('longitudes', 'd', station_count),
+          ('zones', 'f', station_count),
+          ('total_lines', 'h', station_count),
+          ('rail', 'b', station_count),
+          ('station_strings', 'i', station_count * 2),  # Name, display name
+          ('routes', 'i', route_count * 3),  # Station row, station row, line row
+          ('string_offsets', 'i', string_count + 1)]
+
+
+def _aligned(offset: int) -> int:
+  return -(-offset // _ALIGNMENT) * _ALIGNMENT
+
+
+def _exact_number(text: str, parse, fmt=str):
+  """
+  Parses a CSV field, refusing any which wouldn't be restored to the exact same text
+  """
+  value = parse(text)
+  if fmt(value) != text:
+    raise ValueError(f'{text!r} would not survive conversion unchanged')
+  return value
+
+
+def convert(dataset_path: str) -> str:
+  """
+  Writes the columnar copy of a dataset directory's CSV files beside them, returning its path
+  """
+  import as13  # Deferred, as as13 loads datasets through this module
+
+  strings: dict[str, int] = {}
+
+  def intern(text: str) -> int:
+    return strings.setdefault(text, len(strings))
+
+  columns = {name: array.array(typecode) for name, typecode, _ in _column_layout(0, 0, 0, 0)}
+
+  line_rows = {}
+  for row_idx, (line_id, *fields) in enumerate(as13.read_csv(f'{dataset_path}lines.csv')):
+    columns['line_ids'].append(_exact_number(line_id, int))
+    columns['line_strings'].extend(map(intern, fields))
+    line_rows[line_id] = row_idx
+
+  station_rows = {}
+  for row_idx, row in enumerate(as13.read_csv(f'{dataset_path}stations.csv')):
+    station_id, latitude, longitude, name, display_name, zone, total_lines, rail = row
+    columns['station_ids'].append(_exact_number(station_id, int))
+    columns['latitudes'].append(float(latitude))
+    columns['longitudes'].append(float(longitude))
+    columns['zones'].append(_exact_number(zone, lambda text: array.array('f', [float(text)])[0],
+                                          '{:g}'.format))
+    columns['total_lines'].append(_exact_number(total_lines, int))
+    columns['rail'].append(_exact_number(rail, int))
+    columns['station_strings'].extend((intern(name), intern(display_name)))
+    station_rows[station_id] = row_idx
+
+  for station1_id, station2_id, line_id in as13.read_csv(f'{dataset_path}routes.csv'):
+    columns['routes'].extend((station_rows[station1_id], station_rows[station2_id],
+                              line_rows[line_id]))
+
+  encoded = [text.encode() for text in strings]
+  columns['string_offsets'].append(0)
+  for text in encoded:
+    columns['string_offsets'].append(columns['string_offsets'][-1] + len(text))
+
+  file_path = f'{dataset_path}{columnar_file}'
+  # Written aside then swapped in, as truncating the file would break processes mapping it
+  with as13.atomic_open(file_path) as columnar:
+    columnar.write(_HEADER.pack(_MAGIC, _FORMAT_VERSION, sys.byteorder == 'little',
+                                as13.dataset_digest(dataset_path), len(line_rows),
+                                len(station_rows), len(columns['routes']) // 3, len(strings)))
+    for name, _, _ in _column_layout(0, 0, 0, 0):
+      columnar.write(bytes(_aligned(columnar.tell()) - columnar.tell()))
+      columnar.write(columns[name].tobytes())
+    columnar.write(bytes(_aligned(columnar.tell()) - columnar.tell()))
+    columnar.write(b''.join(encoded))
+  return file_path
+
+
+class ColumnarDataset:
+  """
+  Read-only views over a memory-mapped columnar dataset, one memoryview per column
+  """
+  def __init__(self, file_path: str):
+    with open(file_path, 'rb') as columnar:
+      self._map = mmap.mmap(columnar.fileno(), 0, access=mmap.ACCESS_READ)
+    view = memoryview(self._map)
+
+    magic, self.version, self.little_endian, self.digest, line_count, station_count, route_count, \
+      string_count = _HEADER.unpack_from(view)
+    self.valid = (magic, self.version, self.little_endian) == \
+      (_MAGIC, _FORMAT_VERSION, sys.byteorder == 'little')
+    if not self.valid:
+      return
+
+    offset = _HEADER.size
+    for name, typecode, length in _column_layout(line_count, station_count, route_count,
+                                                 string_count):
+      offset, end = _aligned(offset), _aligned(offset) + length * array.array(typecode).itemsize
+      if end > len(view):
+        raise ValueError(f'{file_path} is truncated')
+      setattr(self, name, view[offset:end].cast(typecode))
+      offset = end
+    self._strings = view[_aligned(offset):]
+    if len(self._strings) != self.string_offsets[-1]:
+      raise ValueError(f'{file_path} is truncated')
+
+  @classmethod
+  def open(cls, file_path: str, digest: bytes) -> 'ColumnarDataset | None':
+    """
+    Maps a columnar dataset, or returns None if it is missing, empty, truncated, unreadable by
+    this machine, or was converted from different CSV files
+    """
+    if not os.path.exists(file_path):
+      return None
+    try:
+      dataset = cls(file_path)
+    except (OSError, ValueError, struct.error):
+      return None
+    return dataset if dataset.valid and dataset.digest == digest else None
+
+  def string(self, idx: int) -> str:
+    return str(self._strings[self.string_offsets[idx]:self.string_offsets[idx + 1]], 'utf-8')
+
+  def station_table(self, stations) -> StationTable:
+    """
+    Table of the given stations, which must be in file order, viewing the mapped columns in place
+    """
+    return StationTable(stations, self.station_ids, self.longitudes, self.latitudes, self.zones,
+                        self.total_lines)
+
+  def line_edges(self, id_lines: dict[str, RailLine],
+                 id_stations: dict[str, Station]) -> dict[RailLine, list[tuple[Station, Station]]]:
+    """
+    Same as as13.MetroNetwork.line_edges, resolving rows through the given id lookups
+    """
+    lines = [id_lines[str(line_id)] for line_id in self.line_ids]
+    stations = [id_stations[str(station_id)] for station_id in self.station_ids]
+    line_edges = {rail_line: [] for rail_line in lines}
+    routes = self.routes
+    for idx in range(0, len(routes), 3):
+      line_edges[lines[routes[idx + 2]]].append((stations[routes[idx]], stations[routes[idx + 1]]))
+    return line_edges
+
+
+if __name__ == '__main__':
+  import tempfile
+
+  import as13
+
+  dataset_path = sys.argv[1] if len(sys.argv) > 1 else as13.path
+  start_time = time.perf_counter()
+  file_path = convert(dataset_path)
+  print(f'Converted {dataset_path} in {time.perf_counter() - start_time:.3f}s '
+        f'({os.path.getsize(file_path)} bytes)')
+
+  from_csv = as13.MetroNetwork(dataset_path, use_snapshot=False)
+  from_columns = as13.MetroNetwork(dataset_path, use_snapshot=False)
+  assert from_columns.columns is not None
+  from_csv.columns = None  # Forces parsing the CSV files instead
+  for network in (from_csv, from_columns):
+    network.id_lines, network.id_stations  # Parsed from CSV either way
+
+  timings = {}
+  for name in ('line_edges', 'station_table'):
+    for network in (from_csv, from_columns):
+      start_time = time.perf_counter()
+      getattr(network, name)
+      timings[name, network is from_columns] = time.perf_counter() - start_time
+  print(', '.join(f'{name} built in {timings[name, False] * 1e3:.2f}ms from CSV, '
+                  f'{timings[name, True] * 1e3:.2f}ms mapped' for name in ('line_edges',
+                                                                          'station_table')))
+
+  csv_table, mapped_table = from_csv.station_table, from_columns.station_table
+  assert isinstance(mapped_table.latitudes, memoryview)  # Viewed in place, not copied
+  for field in ('ids', 'longitudes', 'latitudes', 'zones', 'total_lines'):
+    assert list(getattr(csv_table, field)) == list(getattr(mapped_table, field))
+  assert [station.name for station in mapped_table.stations] == \
+    [from_columns.columns.string(idx) for idx in from_columns.columns.station_strings[::2]]
+  assert [[(s1.name, s2.name) for s1, s2 in edges] for edges in from_csv.line_edges.values()] == \
+    [[(s1.name, s2.name) for s1, s2 in edges] for edges in from_columns.line_edges.values()]
+  assert ColumnarDataset.open(file_path, bytes(32)) is None  # Converted from other files
+
+  # Empty or cut short copies are ignored, leaving the CSV files to be parsed
+  digest = from_columns.digest
+  with open(file_path, 'rb') as columnar:
+    content = columnar.read()
+  with tempfile.TemporaryDirectory() as temp_dir:
+    for size in (0, 10, _HEADER.size, len(content) // 2, len(content) - 1):
+      with open(f'{temp_dir}/{columnar_file}', 'wb') as damaged:
+        damaged.write(content[:size])
+      assert ColumnarDataset.open(f'{temp_dir}/{columnar_file}', digest) is None
+
+  print('All assertions passed!')
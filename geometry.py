@@ -0,0 +1,175 @@
+#!/usr/bin/env python
+"""
+Batched geometry over many station coordinates at once
+
+Great-circle lengths, distance matrices and planar projections are computed in one vectorised pass
+with NumPy when it is installed, otherwise falling back to the math module one point at a time.
+Either way the results are plain lists or arrays of floats in kilometres, so callers never depend
+on which was used. Coordinates follow Station.geo_coords, as (longitude, latitude) in degrees.
+"""
+
+__author__ = 'https://github.com/Drullkus'
+
+import array
+import itertools
+import math
+import statistics
+
+from spatial import EARTH_RADIUS_KM, KM_PER_DEGREE, haversine
+from subway_lib import RailLine, Station
+
+try:
+  import numpy
+except ImportError:  # Optional, only speeding up the same computations
+  numpy = None
+
+
+def _numpy_haversines(lons1, lats1, lons2, lats2):
+  lon1, lat1, lon2, lat2 = (numpy.radians(numpy.asarray(degrees, dtype=float))
+                            for degrees in (lons1, lats1, lons2, lats2))
+  hav = numpy.sin((lat2 - lat1) / 2)**2 + \
+    numpy.cos(lat1) * numpy.cos(lat2) * numpy.sin((lon2 - lon1) / 2)**2
+  return 2 * EARTH_RADIUS_KM * numpy.arcsin(numpy.minimum(1.0, numpy.sqrt(hav)))
+
+
+def haversines(coords1: list[tuple[float, float]],
+               coords2: list[tuple[float, float]]) -> list[float]:
+  """
+  Great-circle kilometres between each pair of corresponding coordinates of the two lists
+  """
+  if numpy is None:
+    return list(map(haversine, coords1, coords2))
+  if not coords1:
+    return []
+  (lons1, lats1), (lons2, lats2) = zip(*coords1), zip(*coords2)
+  return _numpy_haversines(lons1, lats1, lons2, lats2).tolist()
+
+
+def edge_lengths(line_edges: dict[RailLine, list[tuple[Station, Station]]]
+                 ) -> dict[RailLine, list[float]]:
+  """
+  Great-circle kilometres of every edge, in the same order as line_edges, computed in one batch
+  """
+  edges = list(itertools.chain.from_iterable(line_edges.values()))
+  lengths = iter(haversines([station1.geo_coords for station1, _ in edges],
+                            [station2.geo_coords for _, station2 in edges]))
+  return {rail_line: list(itertools.islice(lengths, len(pairs)))
+          for rail_line, pairs in line_edges.items()}
+
+
+def project(longitudes, latitudes, origin: tuple[float, float] | None = None):
+  """
+  Equirectangular projection to kilometres east and north of the origin, by default the mean of
+  the coordinates, returned as (xs, ys) arrays. Distances between projected points stay within a
+  fraction of a percent of great-circle distances across a city, so equal axis scales plot true
+  shapes where raw degrees stretch east-west distances by 1/cos(latitude).
+  """
+  origin_lon, origin_lat = origin or (statistics.fmean(longitudes), statistics.fmean(latitudes))
+  x_scale = KM_PER_DEGREE * math.cos(math.radians(origin_lat))
+  if numpy is not None:
+    return ((numpy.asarray(longitudes, dtype=float) - origin_lon) * x_scale,
+            (numpy.asarray(latitudes, dtype=float) - origin_lat) * KM_PER_DEGREE)
+  return (array.array('d', ((lon - origin_lon) * x_scale for lon in longitudes)),
+          array.array('d', ((lat - origin_lat) * KM_PER_DEGREE for lat in latitudes)))
+
+
+def geocentric(longitudes, latitudes) -> list[tuple[float, float, float]]:
+  """
+  Earth-centred (x, y, z) kilometres of each coordinate. The straight chord between two such points
+  never exceeds their great-circle distance, and falls short by under a millionth across a city, so
+  math.dist over these makes a cheap, admissible and consistent A* heuristic.
+  """
+  if numpy is not None:
+    lons, lats = (numpy.radians(numpy.asarray(degrees, dtype=float))
+                  for degrees in (longitudes, latitudes))
+    cos_lats = numpy.cos(lats)
+    xyz = numpy.stack((cos_lats * numpy.cos(lons), cos_lats * numpy.sin(lons), numpy.sin(lats)))
+    return list(zip(*(EARTH_RADIUS_KM * xyz).tolist()))
+  return [(EARTH_RADIUS_KM * math.cos(lat) * math.cos(lon),
+           EARTH_RADIUS_KM * math.cos(lat) * math.sin(lon), EARTH_RADIUS_KM * math.sin(lat))
+          for lon, lat in zip(map(math.radians, longitudes), map(math.radians, latitudes))]
+
+
+class DistanceMatrix:
+  """
+  Great-circle kilometres between every pair of points, indexed by their positions, with each row
+  computed once first needed
+  """
+  def __init__(self, longitudes, latitudes):
+    self._coords = list(zip(longitudes, latitudes))
+    self._rows: dict[int, list[float]] = {}
+    if numpy is not None:
+      self._lons, self._lats = (numpy.asarray(degrees, dtype=float)
+                                for degrees in (longitudes, latitudes))
+
+  def __len__(self) -> int:
+    return len(self._coords)
+
+  def __getitem__(self, idx: int) -> list[float]:
+    row = self._rows.get(idx)
+    if row is None:
+      if numpy is None:
+        row = [haversine(self._coords[idx], coords) for coords in self._coords]
+      else:
+        row = _numpy_haversines(*self._coords[idx], self._lons, self._lats).tolist()
+      self._rows[idx] = row
+    return row
+
+  def full(self) -> list[list[float]]:
+    """
+    Every row, all computed at once by broadcasting when NumPy is installed
+    """
+    if numpy is not None and len(self._rows) < len(self._coords):
+      lons, lats = self._lons, self._lats
+      matrix = _numpy_haversines(lons[:, None], lats[:, None], lons, lats).tolist()
+      self._rows.update(enumerate(matrix))
+    return [self[idx] for idx in range(len(self._coords))]
+
+  def nearest(self, idx: int, candidates) -> int:
+    """
+    Position among the candidate positions closest to that of idx
+    """
+    row = self[idx]
+    return min(candidates, key=row.__getitem__)
+
+
+if __name__ == '__main__':
+  import as13
+
+  table = as13.station_table
+  stations = table.stations
+  by_name = {station.name: station for station in stations}
+  bank, monument, upminster = by_name['Bank'], by_name['Monument'], by_name['Upminster']
+
+  lengths = edge_lengths(as13.line_edges)
+  for rail_line, pairs in as13.line_edges.items():
+    for (station1, station2), length in zip(pairs, lengths[rail_line]):
+      assert math.isclose(length, haversine(station1.geo_coords, station2.geo_coords))
+
+  matrix = as13.distance_matrix
+  rows = table.rows
+  full = matrix.full()
+  assert len(full) == len(matrix) == len(stations)
+  assert all(full[idx][idx] == 0 for idx in range(len(full)))
+  assert all(math.isclose(full[idx1][idx2], full[idx2][idx1], abs_tol=1e-9)
+             for idx1, idx2 in itertools.combinations(range(0, len(full), 7), 2))
+  assert math.isclose(matrix[rows[bank]][rows[upminster]],
+                      haversine(bank.geo_coords, upminster.geo_coords))
+  assert stations[matrix.nearest(rows[bank], (rows[monument], rows[upminster]))] is monument
+
+  vectors = geocentric(table.longitudes, table.latitudes)
+  for idx1, idx2 in itertools.combinations(range(0, len(stations), 5), 2):
+    chord = math.dist(vectors[idx1], vectors[idx2])
+    assert chord <= full[idx1][idx2] + 1e-9 and math.isclose(chord, full[idx1][idx2], rel_tol=1e-5)
+
+  xs, ys = as13.projected_coords
+  assert abs(statistics.fmean(xs)) < 1e-9 and abs(statistics.fmean(ys)) < 1e-9
+  for idx1, idx2 in itertools.combinations(range(0, len(stations), 13), 2):
+    planar = math.dist((xs[idx1], ys[idx1]), (xs[idx2], ys[idx2]))
+    assert math.isclose(planar, full[idx1][idx2], rel_tol=5e-3, abs_tol=1e-6)
+
+  # Degrees overstate east-west distances, which projecting corrects
+  west_east = math.dist(bank.geo_coords, upminster.geo_coords) * KM_PER_DEGREE
+  assert west_east > matrix[rows[bank]][rows[upminster]] * 1.5
+
+  print('All assertions passed!')
@@ -2,39 +2,418 @@
 """
 Duplicated from Assignment 12
 
-Upgraded with additional methods for traversal (start_search, _search_graph)
+Upgraded with additional methods for traversal (start_search, _search_graph), and a priority-queue
+shortest-path engine (shortest_path, nearest_path) supporting both Dijkstra and A* searches
 """
 
 __author__ = 'https://github.com/Drullkus'
 
+import array
 import collections
+import heapq
 import itertools
 from functools import reduce as func_reduce
 from operator import add as op_add
 
 
+def _fewest_hops(paths):
+  return min(paths, key=len)
+
+
+def _unit_cost(_weight) -> int:
+  return 1
+
+
+def _no_heuristic(_vertex) -> int:
+  return 0
+
+
+def _identity(weight):
+  return weight
+
+
+_observer = None  # Called as observer(event, amount) by searches while instrumentation is enabled
+
+
+def set_observer(observer) -> None:
+  """
+  Installs a callable receiving search events, such as ('vertices_expanded', count) once a search
+  completes, or None to stop. Searches only check for an observer once each, not per vertex.
+  """
+  global _observer
+  _observer = observer
+
+
+def report(event: str, amount: int) -> None:
+  """
+  Passes an event to any installed observer, for searches implemented outside this module
+  """
+  if _observer is not None:
+    _observer(event, amount)
+
+
 class _Node(dict):
   """
-  Internal mutable record of edge weights in the direction of another vertex
+  Internal mutable record of edge weights in the direction of another vertex.
+  Mirrors each edge into the parent's reverse adjacency index, under its own vertex.
   """
-  def __init__(self, parent):
+  def __init__(self, parent, vertex):
     self._parent = parent
+    self._vertex = vertex
 
   def __setitem__(self, key, value) -> None:
     self._parent[key]  # Polite poke to ensure existence of other edge in graph
+    self._parent._incoming[key].add(self._vertex)
+    self._parent._version += 1
     return super().__setitem__(key, value)
 
   def copy(self, new_parent):
-    copied = _Node(parent=new_parent)
-    copied.update(self)
+    copied = _Node(parent=new_parent, vertex=self._vertex)
+    for key, value in self.items():
+      copied[key] = value
     return copied
 
+  def update(self, *args, **kwargs) -> None:
+    for key, value in dict(*args, **kwargs).items():
+      self[key] = value
+
   def __delitem__(self, key) -> None:
     if key in self:  # NOOP any key misses
+      self._parent._incoming[key].discard(self._vertex)
+      self._parent._version += 1
       return super().__delitem__(key)
 
+  def clear(self) -> None:
+    for key in list(self):
+      del self[key]
 
-class Graph:
+
+class _Vertices(dict):
+  """
+  Internal vertex -> _Node mapping, adding any missing vertex upon lookup as a defaultdict would
+  """
+  def __init__(self, parent):
+    self._parent = parent
+
+  def __missing__(self, key) -> _Node:
+    node = self[key] = _Node(parent=self._parent, vertex=key)
+    self._parent._version += 1
+    return node
+
+
+class _Traversal:
+  """
+  Path measurement, connectivity and searching, shared by any graph able to iterate its vertices
+  and the edges leaving a vertex
+  """
+  def path_length(self, vertices):
+    """
+    path_length(vertices) shall return the path length of a sequence of vertices, or None if
+    the path is invalid or trivial (one vertex). The length shall the be sum of all edge weights
+    (you may assume that any_weight + any_other_weight is a valid expression)
+
+    The addition op is essential and sum() will not suffice.
+    """
+    if len(vertices) > 1 and self.path_valid(vertices):
+      return func_reduce(op_add, itertools.starmap(self._get_weight, itertools.pairwise(vertices)))
+
+  def _strong_components(self) -> tuple[dict, list[int]]:
+    """
+    Iterative Tarjan's algorithm, in one linear pass. Returns the component label of every vertex,
+    labelled in order of completion (so components only reach lower labels), alongside a bitmask
+    per component of every component reachable from it, including itself.
+    """
+    order: dict = {}  # Visitation index of each vertex
+    low: dict = {}
+    stack, on_stack = [], set()
+    labels: dict = {}
+    reach: list[int] = []
+
+    for root in self._vertex_keys():
+      if root in order:
+        continue
+      order[root] = low[root] = len(order)
+      stack.append(root)
+      on_stack.add(root)
+      work = [(root, iter(self._edges_from(root)))]
+
+      while work:
+        vertex, edges = work[-1]
+        for adjacent, _ in edges:
+          if adjacent not in order:  # Descend, resuming this vertex's edges afterwards
+            order[adjacent] = low[adjacent] = len(order)
+            stack.append(adjacent)
+            on_stack.add(adjacent)
+            work.append((adjacent, iter(self._edges_from(adjacent))))
+            break
+          elif adjacent in on_stack:
+            low[vertex] = min(low[vertex], order[adjacent])
+        else:
+          work.pop()
+          if work:
+            parent = work[-1][0]
+            low[parent] = min(low[parent], low[vertex])
+
+          if low[vertex] == order[vertex]:  # Vertex roots a component, pop it off the stack
+            label = len(reach)
+            members = []
+            while not members or members[-1] != vertex:
+              members.append(stack.pop())
+              on_stack.discard(members[-1])
+              labels[members[-1]] = label
+
+            # Every other component adjacent to this one has already been completed
+            mask = 1 << label
+            for member in members:
+              for adjacent, _ in self._edges_from(member):
+                if labels[adjacent] != label:
+                  mask |= reach[labels[adjacent]]
+            reach.append(mask)
+
+    return labels, reach
+
+  def _connectivity(self) -> tuple[dict, list[int]]:
+    # Components are cached until the graph is next mutated
+    if self._scc is None or self._scc[0] != self.version:
+      self._scc = (self.version, *self._strong_components())
+    return self._scc[1:]
+
+  def components(self) -> list[set]:
+    """
+    components() returns the strongly connected components of the graph, as sets of vertices
+    mutually reachable from one another. A component can only reach components listed before it.
+    """
+    labels, reach = self._connectivity()
+    grouped = [set() for _ in reach]
+    for vertex, label in labels.items():
+      grouped[label].add(vertex)
+    return grouped
+
+  def component_of(self, vertex) -> int:
+    """
+    component_of(vertex) returns the index of the vertex's component within components()
+    """
+    return self._connectivity()[0][vertex]
+
+  def are_connected(self, src, dst) -> bool:
+    """
+    are_connected(src, dst) shall return whether a path leads from src to dst.
+    """
+    if src == dst or src not in self or dst not in self:
+      return False
+    labels, reach = self._connectivity()
+    return bool(reach[labels[src]] >> labels[dst] & 1)
+
+  def is_connected(self):
+    """
+    is_connected() shall return whether the graph is connected.
+    """
+    return len(self._connectivity()[1]) <= 1
+
+  # Naive recursive graph-searching algorithm, enumerating every simple path for a custom reducer
+  def _search_graph(self, visited: set, start, target, reducer) -> list | None:
+    paths = []
+
+    for adjacent, _ in self._edges_from(start):
+      if adjacent == target:
+        if _observer is not None:
+          _observer('paths_enumerated', 1)
+        return [target, start]
+
+      if adjacent not in visited:
+        visited.add(adjacent)
+        if ret := self._search_graph(set(visited), adjacent, target, reducer):
+          ret.append(start)
+          paths.append(ret)
+
+    return reducer(paths) if paths else None
+
+  def _settle(self, starts, cost, heuristic, previous: dict):
+    """
+    Priority-queue search from the start vertices, behaving as Dijkstra's algorithm, or as A* when
+    the heuristic estimates remaining cost. Yields each vertex alongside its cost once settled, in
+    increasing order of estimated total cost, while recording the search tree into previous.
+    """
+    tie = itertools.count()  # Vertices needn't be orderable, so heap ties are broken by insertion
+    heap = []
+    best: dict = {}
+    for start in starts:
+      best[start], previous[start] = 0, None
+      heap.append((heuristic(start), next(tie), 0, start))
+    heapq.heapify(heap)
+
+    settled = set()
+    while heap:
+      _, _, dist, vertex = heapq.heappop(heap)
+      if vertex in settled:
+        continue  # Stale queue entry, vertex was already reached more cheaply
+      settled.add(vertex)
+      yield vertex, dist
+
+      for adjacent, weight in self._edges_from(vertex):
+        new_dist = dist + cost(weight)
+        if adjacent not in best or new_dist < best[adjacent]:
+          best[adjacent], previous[adjacent] = new_dist, vertex
+          heapq.heappush(heap, (new_dist + heuristic(adjacent), next(tie), new_dist, adjacent))
+
+  @staticmethod
+  def _trace(previous: dict, vertex) -> list:
+    """
+    Walks a search tree back to its root, returning the path reversed as with _search_graph
+    """
+    path = []
+    while vertex is not None:
+      path.append(vertex)
+      vertex = previous[vertex]
+    return path
+
+  def _best_first(self, starts, targets: set, cost, heuristic) -> tuple[list, object] | None:
+    previous: dict = {}
+    found, expanded = None, 0
+    for expanded, (vertex, dist) in enumerate(self._settle(starts, cost, heuristic, previous), 1):
+      if vertex in targets:
+        found = self._trace(previous, vertex), dist
+        break
+
+    if _observer is not None:
+      _observer('vertices_expanded', expanded)
+    return found
+
+  def search_tree(self, starts, cost=None) -> tuple[dict, dict]:
+    """
+    search_tree(starts) runs a full Dijkstra search from the start vertices, returning the cost of
+    reaching every reachable vertex, and the predecessor of every reachable vertex (None for
+    starts).
+    """
+    previous: dict = {}
+    costs = dict(self._settle(starts, cost or _identity, _no_heuristic, previous))
+    if _observer is not None:
+      _observer('vertices_expanded', len(costs))
+    return costs, {vertex: previous[vertex] for vertex in costs}
+
+  def nearest_path(self, starts, targets, heuristic=None, cost=None) -> tuple[list, object]:
+    """
+    nearest_path(starts, targets) returns the cheapest path leaving any of the start vertices and
+    arriving at any of the target vertices, alongside its cost. Edge weights are used as costs
+    unless a cost function mapping weight -> cost is provided. A heuristic function estimating the
+    remaining cost from a vertex turns the search into A*, and must never overestimate.
+    Returns ([], None) if no target is reachable.
+    """
+    found = self._best_first(starts, set(targets), cost or _identity, heuristic or _no_heuristic)
+    return (found[0][::-1], found[1]) if found else ([], None)
+
+  def shortest_path(self, start, target, heuristic=None, cost=None) -> list:
+    """
+    shortest_path(start, target) returns the cheapest path from start to target as a list of
+    vertices, or an empty list if target is unreachable. See nearest_path() for the arguments.
+    """
+    return self.nearest_path((start,), (target,), heuristic, cost)[0]
+
+  def _restricted_path(self, starts, targets: set, cost, heuristic, banned: set,
+                       banned_edges: set) -> tuple[list, object] | None:
+    """
+    Same search as _best_first(), except never entering the banned vertices nor following the
+    banned (vertex, adjacent) edges. Returns the path in order, rather than reversed.
+    """
+    tie = itertools.count()
+    heap, best, previous = [], {}, {}
+    for start in starts:
+      if start not in banned:
+        best[start], previous[start] = 0, None
+        heap.append((heuristic(start), next(tie), 0, start))
+    heapq.heapify(heap)
+
+    settled = set()
+    found = None
+    while heap:
+      _, _, dist, vertex = heapq.heappop(heap)
+      if vertex in settled:
+        continue
+      settled.add(vertex)
+      if vertex in targets:
+        found = self._trace(previous, vertex)[::-1], dist
+        break
+
+      for adjacent, weight in self._edges_from(vertex):
+        if adjacent in banned or (vertex, adjacent) in banned_edges:
+          continue
+        new_dist = dist + cost(weight)
+        if adjacent not in best or new_dist < best[adjacent]:
+          best[adjacent], previous[adjacent] = new_dist, vertex
+          heapq.heappush(heap, (new_dist + heuristic(adjacent), next(tie), new_dist, adjacent))
+
+    if _observer is not None:
+      _observer('vertices_expanded', len(settled))
+    return found
+
+  def shortest_paths(self, starts, targets, heuristic=None, cost=None):
+    """
+    shortest_paths(starts, targets) lazily yields every loopless path leaving any of the start
+    vertices and arriving at any of the target vertices, alongside its cost, cheapest first.
+    See nearest_path() for the arguments.
+
+    Paths are found by Yen's algorithm: each next path deviates from an earlier one at some vertex,
+    as found by searching on from that vertex while avoiding the edges taken there by paths already
+    yielded, and the vertices before it. Only deviations past where each path itself deviated are
+    searched (Lawler's refinement). Memory is bounded by the paths yielded so far, each adding at
+    most one candidate per vertex along it, rather than by every path through the graph.
+    """
+    cost, heuristic = cost or _identity, heuristic or _no_heuristic
+    starts, targets = list(dict.fromkeys(starts)), set(targets)
+    found = self._restricted_path(starts, targets, cost, heuristic, set(), set())
+    if found is None:
+      return
+
+    tie = itertools.count()
+    candidates = [(found[1], next(tie), found[0], -1)]  # (cost, tie, path, deviation index)
+    yielded: list[list] = []
+    seen = {tuple(found[0])}
+    while candidates:
+      path_cost, _, path, deviation = heapq.heappop(candidates)
+      yielded.append(path)
+      yield path, path_cost
+
+      # Cost of the path up to each of its vertices
+      root_costs = [0]
+      for vertex, adjacent in itertools.pairwise(path):
+        root_costs.append(root_costs[-1] + cost(self._get_weight(vertex, adjacent)))
+
+      for idx in range(deviation, len(path) - 1):
+        if idx < 0:  # Deviating at the very start, from another start vertex
+          taken = {other[0] for other in yielded}
+          spur_starts = [start for start in starts if start not in taken]
+          banned, banned_edges = set(), set()
+        else:
+          root = path[:idx + 1]
+          spur_starts, banned = (path[idx],), set(path[:idx])
+          banned_edges = {(path[idx], other[idx + 1]) for other in yielded
+                          if len(other) > idx + 1 and other[:idx + 1] == root}
+
+        spur = self._restricted_path(spur_starts, targets, cost, heuristic, banned, banned_edges)
+        if spur is None:
+          continue
+        candidate = path[:max(idx, 0)] + spur[0]
+        if tuple(candidate) not in seen:
+          seen.add(tuple(candidate))
+          spur_cost = spur[1] if idx < 0 else root_costs[idx] + spur[1]
+          heapq.heappush(candidates, (spur_cost, next(tie), candidate, idx))
+
+  def start_search(self, start, target, reducer=_fewest_hops) -> list:
+    if reducer is _fewest_hops:  # Fewest hops needs no path enumeration, only unit edge costs
+      return self.shortest_path(start, target, cost=_unit_cost)
+
+    ret = self._search_graph({start}, start, target, reducer)
+    return list(ret)[::-1] if ret else []
+
+
+def _restore_graph(adjacency: dict) -> 'Graph':
+  graph = Graph()
+  for vertex, edges in adjacency.items():
+    graph[vertex].update(edges)
+  return graph
+
+
+class Graph(_Traversal):
   """
   A directed graph with arbitrary data for directional edges
   """
@@ -43,7 +422,21 @@ class Graph:
     shall accept no arguments and result in an empty graph containing no vertices or edges
     """
     # Nodes are lists of values. Defaults are empty and disconnected from all other nodes
-    self._nodes: dict[str, _Node] = collections.defaultdict(lambda: _Node(parent=self))
+    self._nodes: dict[str, _Node] = _Vertices(parent=self)
+    # Reverse adjacency index, the vertices with an edge towards each vertex
+    self._incoming: dict[str, set] = collections.defaultdict(set)
+    self._version = 0  # Bumped upon every mutation, so that derived data may detect staleness
+    self._scc = None  # Cached strongly connected components, tagged with the version they reflect
+
+  @property
+  def version(self) -> int:
+    """
+    Counter bumped upon every mutation of the graph
+    """
+    return self._version
+
+  def _vertex_keys(self):
+    return self._nodes.keys()
 
   def __getitem__(self, key):
     """
@@ -65,7 +458,14 @@ class Graph:
     and that complementary edges from a to b and from b to a could serve to represent an
     undirected graph.
     """
-    self._nodes.__setitem__(key, value)
+    if key in self._nodes:
+      for addr in self._nodes[key]:
+        self._incoming[addr].discard(key)
+
+    node = _Node(parent=self, vertex=key)
+    self._nodes.__setitem__(key, node)
+    self._version += 1
+    node.update(value)
 
   def __delitem__(self, key):
     """
@@ -73,10 +473,16 @@ class Graph:
     del g['a']  # Removes vertex 'a' and all associated edges
     del g['b']['c']  # Removes edge from vertex 'b' to vertex 'c', but not the vertices themselves
     """
-    for connected in self._nodes.values():
-      connected.__delitem__(key)
+    node = self._nodes.pop(key)
+    # Only the vertices known to have edges towards this one need visiting
+    for src in self._incoming.pop(key, ()):
+      if src != key:
+        dict.__delitem__(self._nodes[src], key)
+    for addr in node:
+      if addr != key:
+        self._incoming[addr].discard(key)
 
-    del self._nodes[key]
+    self._version += 1
 
   def __len__(self) -> int:
     """
@@ -102,9 +508,11 @@ class Graph:
   # g.clear()  # g is now empty
   def clear(self):
     for node in self._nodes.values():
-      node.clear()
+      dict.clear(node)
 
     self._nodes.clear()
+    self._incoming.clear()
+    self._version += 1
 
   def copy(self):
     new_graph = Graph()
@@ -113,6 +521,12 @@ class Graph:
 
     return new_graph
 
+  def predecessors(self, vertex) -> set:
+    """
+    predecessors(vertex) shall return a set of all vertices with an edge towards the given vertex.
+    """
+    return set(self._incoming.get(vertex, ()))
+
   def vertices(self):
     """
     vertices() shall return a set of all vertices in the graph.
@@ -162,63 +576,155 @@ class Graph:
     # Path is guaranteed to be greater than 1 element, exhaust path with recursive calls
     return vertices[1] in self._nodes[vertices[0]] and self.path_valid(vertices[1:])
 
+  def _edges_from(self, vertex):
+    """
+    Iterates (dst, weight) pairs leaving a vertex, without adding the vertex to the graph
+    """
+    node = self._nodes.get(vertex)
+    return node.items() if node is not None else ()
+
   def _get_weight(self, vertex, addr):
     if vertex in self._nodes:
       return self._nodes[vertex][addr]
 
-  def path_length(self, vertices):
+  def freeze(self) -> 'FrozenGraph':
     """
-    path_length(vertices) shall return the path length of a sequence of vertices, or None if
-    the path is invalid or trivial (one vertex). The length shall the be sum of all edge weights
-    (you may assume that any_weight + any_other_weight is a valid expression)
-
-    The addition op is essential and sum() will not suffice.
+    freeze() returns an immutable, array-backed snapshot of the graph, see FrozenGraph
     """
-    if len(vertices) > 1 and self.path_valid(vertices):
-      return func_reduce(op_add, itertools.starmap(self._get_weight, itertools.pairwise(vertices)))
+    return FrozenGraph(self)
 
-  def _seek_path(self, src, dst, _acc: set) -> bool:
-    if src == dst or src in _acc:
-      return False
-    _acc.add(src)
+  def __reduce__(self):
+    # Pickled as plain nested dicts, as neither the defaultdict factory nor _Node parents can be
+    return _restore_graph, ({vertex: dict(node) for vertex, node in self._nodes.items()},)
 
-    node = self._nodes[src]
-    return dst in node or any(self._seek_path(ed, dst, _acc) for ed in node if ed not in _acc)
+  def __eq__(self, other):
+    return isinstance(other, Graph) and self._nodes == other._nodes
 
-  def are_connected(self, src, dst) -> bool:
-    return self._seek_path(src, dst, set())
 
-  def is_connected(self):
+class FrozenGraph(_Traversal):
+  """
+  Immutable compressed-sparse-row snapshot of a Graph, as produced by Graph.freeze(), offering the
+  same read-only API
+
+  Vertices are numbered in insertion order. The edges leaving vertex i are stored at positions
+  offsets[i] up to offsets[i + 1] of the flat targets (vertex numbers) and weights buffers.
+  Weights are packed into an array when all of them are floats or all of them are ints.
+  """
+  def __init__(self, graph: Graph):
+    self._vertices = list(graph._nodes)
+    self._ids = {vertex: idx for idx, vertex in enumerate(self._vertices)}
+    self._offsets = array.array('q', [0])
+    self._targets = array.array('i')
+    weights = []
+    for node in graph._nodes.values():
+      for addr, weight in node.items():
+        self._targets.append(self._ids[addr])
+        weights.append(weight)
+      self._offsets.append(len(self._targets))
+
+    weight_types = set(map(type, weights))
+    if weight_types == {float}:
+      self._weights = array.array('d', weights)
+    elif weight_types == {int}:
+      self._weights = array.array('q', weights)
+    else:
+      self._weights = tuple(weights)
+    self.source_version = graph.version  # Compared against the Graph's version to detect staleness
+    self._scc = None
+
+  @property
+  def version(self) -> int:
+    return self.source_version
+
+  def _vertex_keys(self):
+    return self._vertices
+
+  def _span(self, idx: int) -> range:
+    return range(self._offsets[idx], self._offsets[idx + 1])
+
+  def __getitem__(self, key) -> dict:
     """
-    is_connected() shall return whether the graph is connected.
+    Returns a read-only copy of the edges leaving a vertex, as {dst: weight}
     """
-    return all(itertools.starmap(self.are_connected, itertools.permutations(self._nodes, 2)))
+    if key not in self._ids:
+      raise KeyError(key)
+    return dict(self._edges_from(key))
 
-  def __eq__(self, other):
-    return isinstance(other, Graph) and self._nodes == other._nodes
+  def __len__(self) -> int:
+    return len(self._vertices)
 
-  # Naive recursive graph-searching algorithm
-  def _search_graph(self, visited: set, start, target, reducer) -> list | None:
-    paths = []
+  def __contains__(self, key) -> bool:
+    return key in self._ids
 
-    for adjacent in self[start]:
-      if adjacent == target:
-        return [target, start]
+  def vertices(self):
+    return set(self._vertices)
 
-      if adjacent not in visited:
-        visited.add(adjacent)
-        if ret := self._search_graph(set(visited), adjacent, target, reducer):
-          ret.append(start)
-          paths.append(ret)
+  def edges(self):
+    return {(vertex, self._vertices[self._targets[pos]], self._weights[pos])
+            for idx, vertex in enumerate(self._vertices) for pos in self._span(idx)}
 
-    return reducer(paths) if paths else None
+  def _edges_from(self, vertex):
+    idx = self._ids.get(vertex)
+    if idx is None:
+      return ()
+    span = self._span(idx)
+    return zip(map(self._vertices.__getitem__, self._targets[span.start:span.stop]),
+               self._weights[span.start:span.stop])
 
-  def start_search(self, start, target, reducer=lambda paths: min(paths, key=len)) -> list:
-    ret = self._search_graph({start}, start, target, reducer)
-    return list(ret)[::-1] if ret else []
+  def adjacent(self, src, dst) -> bool:
+    span = self._span(self._ids[src])
+    return dst in self._ids and self._ids[dst] in self._targets[span.start:span.stop]
+
+  def neighbors(self, vertex) -> set:
+    return {addr for addr, _ in self._edges_from(vertex)}
+
+  def degree(self, vertex) -> int:
+    return len(self._span(self._ids[vertex]))
+
+  def path_valid(self, vertices) -> bool:
+    if not vertices:
+      return True
+    return vertices[0] in self._ids and all(itertools.starmap(self.adjacent,
+                                                              itertools.pairwise(vertices)))
+
+  def _get_weight(self, vertex, addr):
+    return self[vertex][addr]
+
+  def _settle(self, starts, cost, heuristic, previous: dict):
+    # Same search as Graph._settle(), except over vertex numbers and flat lists
+    vertices, offsets, targets = self._vertices, self._offsets, self._targets
+    weights = self._weights
+    best: list = [None] * len(vertices)
+    prior = [-1] * len(vertices)
+    settled = bytearray(len(vertices))
+
+    heap = []
+    for start in starts:
+      if (idx := self._ids.get(start)) is not None:
+        best[idx] = 0
+        heap.append((heuristic(start), idx, 0))  # Vertex numbers break ties, being orderable
+    heapq.heapify(heap)
+
+    while heap:
+      _, idx, dist = heapq.heappop(heap)
+      if settled[idx]:
+        continue
+      settled[idx] = 1
+      vertex = vertices[idx]
+      previous[vertex] = vertices[prior[idx]] if prior[idx] >= 0 else None
+      yield vertex, dist
+
+      for pos in range(offsets[idx], offsets[idx + 1]):
+        adj = targets[pos]
+        new_dist = dist + cost(weights[pos])
+        if best[adj] is None or new_dist < best[adj]:
+          best[adj], prior[adj] = new_dist, idx
+          heapq.heappush(heap, (new_dist + heuristic(vertices[adj]), adj, new_dist))
 
 
 if __name__ == '__main__':
+  import pickle
+
   g = Graph()
   assert len(g) == 0
   assert 'wat' not in g
@@ -247,6 +753,7 @@ if __name__ == '__main__':
   assert not g.is_connected()
   assert g.vertices() == set('bcd')
   assert g.degree('b') == 0
+  assert g.predecessors('b') == {'c', 'd'} and g.predecessors('d') == set()
   g2 = g.copy()
   assert g2 == g
   g2['b']['e'] = 1
@@ -257,8 +764,69 @@ if __name__ == '__main__':
   assert g2.path_length(('e', 'd', 'c', 'b')) == 23
   del g2['e']['d']
   assert g2.degree('e') == 0
+  assert g2.predecessors('d') == set() and g2.predecessors('e') == {'b'}
   assert g2.vertices() == set('bcde')
   assert not g2.is_connected()
+  assert g2.shortest_path('b', 'e') == ['b', 'e']
+  g2['b']['c'] = 30
+  g2['e']['c'] = 5
+  assert g2.shortest_path('b', 'c') == ['b', 'e', 'c']  # Cheaper by weight, despite extra hop
+  assert g2.start_search('b', 'c') == ['b', 'c']  # Fewest hops
+  assert g2.nearest_path(('b',), ('c', 'e')) == (['b', 'e'], 1)
+  assert g2.shortest_path('b', 'd') == []  # Unreachable
+  assert g2.search_tree(('b',)) == ({'b': 0, 'e': 1, 'c': 6}, {'b': None, 'e': 'b', 'c': 'e'})
+  assert pickle.loads(pickle.dumps(g2)) == g2
+  frozen = g2.freeze()
+  assert frozen.vertices() == g2.vertices() and frozen.edges() == g2.edges()
+  assert all(frozen.neighbors(v) == g2.neighbors(v) and frozen.degree(v) == g2.degree(v)
+             for v in g2.vertices())
+  assert frozen.adjacent('b', 'e') and not frozen.adjacent('e', 'b')
+  assert frozen.path_length(('b', 'e', 'c')) == g2.path_length(('b', 'e', 'c')) == 6
+  assert frozen.shortest_path('b', 'c') == ['b', 'e', 'c']
+  assert frozen.start_search('b', 'c') == ['b', 'c']
+  assert frozen.search_tree(('b',)) == g2.search_tree(('b',))
+  assert frozen.are_connected('d', 'e') and not frozen.are_connected('e', 'd')
+  assert not frozen.is_connected()
+  assert g2.components() == frozen.components() == [{'c', 'b', 'e'}, {'d'}]
+  assert g2.component_of('b') == g2.component_of('e') != g2.component_of('d')
+  long_line = Graph()
+  for idx in range(5000):  # Deeper than the recursion limit
+    long_line[idx][idx + 1] = long_line[idx + 1][idx] = 1
+  assert long_line.is_connected() and long_line.are_connected(0, 5000)
+  del long_line[2500][2501]
+  assert not long_line.is_connected() and long_line.are_connected(5000, 0)
   g.clear()
   assert len(g) == 0
   assert len(g2) == 4
+
+  # k shortest loopless paths, checked against every simple path
+  yen = Graph()
+  for v_from, v_to, weight in (('c', 'd', 3), ('c', 'e', 2), ('d', 'f', 4), ('e', 'd', 1),
+                               ('e', 'f', 2), ('e', 'g', 3), ('f', 'g', 2), ('f', 'h', 1),
+                               ('g', 'h', 2), ('h', 'e', 1)):
+    yen[v_from][v_to] = weight
+
+  def simple_paths(path: list, targets: set):
+    if path[-1] in targets:
+      yield path, yen.path_length(path)
+      return
+    for adjacent in yen.neighbors(path[-1]):
+      if adjacent not in path:
+        yield from simple_paths(path + [adjacent], targets)
+
+  def by_cost(found: tuple[list, int]) -> tuple[int, list]:
+    return found[1], found[0]
+
+  for search in (yen, yen.freeze()):
+    paths = list(search.shortest_paths(('c',), ('h',)))
+    assert paths[:2] == [(['c', 'e', 'f', 'h'], 5), (['c', 'e', 'g', 'h'], 7)]
+    assert sorted(paths, key=by_cost) == sorted(simple_paths(['c'], {'h'}), key=by_cost)
+    assert [cost for _, cost in paths] == sorted(cost for _, cost in paths)
+    assert next(search.shortest_paths(('c',), ('h',))) == \
+      (search.shortest_path('c', 'h'), search.path_length(search.shortest_path('c', 'h')))
+  # Several starts and targets, with each path ending at the first target it arrives at
+  paths = list(yen.shortest_paths(('c', 'd'), ('f', 'g')))
+  assert paths[0] == (['d', 'f'], 4)
+  assert sorted(paths, key=by_cost) == sorted(
+    (found for start in 'cd' for found in simple_paths([start], {'f', 'g'})), key=by_cost)
+  assert list(yen.shortest_paths(('h',), ('c',))) == []
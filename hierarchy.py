@@ -0,0 +1,350 @@
+#!/usr/bin/env python
+"""
+Contraction hierarchy over a weighted Graph, for point-to-point queries on large networks
+
+Preprocessing contracts vertices one at a time, least important first, adding a shortcut edge
+between the neighbours of each contracted vertex wherever it lay on their only shortest path.
+Queries then run a bidirectional Dijkstra which only ever climbs towards more important vertices,
+settling a small fraction of the graph, before unpacking shortcuts back into the original path.
+"""
+
+__author__ = 'https://github.com/Drullkus'
+
+import array
+import heapq
+import itertools
+import math
+import os
+import pickle
+import random
+import time
+
+from graph import Graph, report
+
+_FORMAT_VERSION = 1
+witness_settle_limit = 64  # Vertices a witness search may settle before assuming no witness exists
+
+
+class _Contraction:
+  """
+  Working state of preprocessing: the remaining graph as forward and reverse adjacency dicts,
+  keyed by vertex number
+  """
+  def __init__(self, vertex_count: int, edges):
+    self.outgoing: list[dict[int, float]] = [{} for _ in range(vertex_count)]
+    self.incoming: list[dict[int, float]] = [{} for _ in range(vertex_count)]
+    self.middle: dict[tuple[int, int], int] = {}  # Shortcut -> vertex it bypasses
+    self.deleted_neighbors = [0] * vertex_count
+    for src, dst, weight in edges:
+      if src != dst and weight < self.outgoing[src].get(dst, math.inf):
+        self.outgoing[src][dst] = self.incoming[dst][src] = weight
+
+  def _witness_costs(self, source: int, bypassed: int, limit: float) -> dict[int, float]:
+    """
+    Costs of a Dijkstra search from source within the remaining graph, avoiding the bypassed vertex
+    and giving up beyond the cost limit or settle limit
+    """
+    costs = {source: 0}
+    queue = [(0, source)]
+    settled = 0
+    while queue and settled < witness_settle_limit:
+      cost, vertex = heapq.heappop(queue)
+      if cost > costs[vertex]:
+        continue
+      if cost > limit:
+        break
+      settled += 1
+      for addr, weight in self.outgoing[vertex].items():
+        new_cost = cost + weight
+        if addr != bypassed and new_cost < costs.get(addr, math.inf):
+          costs[addr] = new_cost
+          heapq.heappush(queue, (new_cost, addr))
+    return costs
+
+  def shortcuts(self, vertex: int) -> list[tuple[int, int, float]]:
+    """
+    Shortcuts needed to contract a vertex, as (src, dst, weight)
+    """
+    needed = []
+    out_edges = self.outgoing[vertex]
+    for src, in_weight in self.incoming[vertex].items():
+      if not out_edges:
+        break
+      limit = in_weight + max(out_edges.values())
+      witness = self._witness_costs(src, vertex, limit)
+      for dst, out_weight in out_edges.items():
+        if dst != src and in_weight + out_weight < witness.get(dst, math.inf):
+          needed.append((src, dst, in_weight + out_weight))
+    return needed
+
+  def priority(self, vertex: int) -> int:
+    """
+    Edge difference: shortcuts added less edges removed, plus neighbours already contracted so
+    that contraction spreads evenly across the graph
+    """
+    removed = len(self.outgoing[vertex]) + len(self.incoming[vertex])
+    return len(self.shortcuts(vertex)) - removed + self.deleted_neighbors[vertex]
+
+  def contract(self, vertex: int) -> tuple[dict[int, float], dict[int, float]]:
+    """
+    Removes a vertex from the remaining graph, returning its edges towards and from the vertices
+    that remain, all of which rank higher
+    """
+    for src, dst, weight in self.shortcuts(vertex):
+      if weight < self.outgoing[src].get(dst, math.inf):
+        self.outgoing[src][dst] = self.incoming[dst][src] = weight
+        self.middle[src, dst] = vertex
+
+    upward, downward = self.outgoing[vertex], self.incoming[vertex]
+    for addr in upward:
+      del self.incoming[addr][vertex]
+      self.deleted_neighbors[addr] += 1
+    for src in downward:
+      del self.outgoing[src][vertex]
+      self.deleted_neighbors[src] += 1
+    self.outgoing[vertex], self.incoming[vertex] = {}, {}
+    return upward, downward
+
+
+def _pack(adjacency: list[dict[int, float]]) -> tuple[array.array, array.array, array.array]:
+  """
+  Compressed-sparse-row arrays of offsets, targets and weights, as kept by graph.FrozenGraph
+  """
+  offsets, targets, weights = array.array('q', [0]), array.array('i'), array.array('d')
+  for edges in adjacency:
+    targets.extend(edges.keys())
+    weights.extend(edges.values())
+    offsets.append(len(targets))
+  return offsets, targets, weights
+
+
+class ContractionHierarchy:
+  """
+  Vertices ranked by contraction order, each keeping only its edges towards higher ranks: upward
+  edges leaving it, and upward edges of the reverse graph arriving into it. Edge weights must be
+  non-negative numbers.
+  """
+  def __init__(self, vertices: list, upward: list[dict[int, float]],
+               downward: list[dict[int, float]], middle: dict[tuple[int, int], int],
+               source_version: int | None = None):
+    self._vertices = vertices
+    self._ids = {vertex: idx for idx, vertex in enumerate(vertices)}
+    self._forward = _pack(upward)
+    self._backward = _pack(downward)
+    self._middle = middle
+    self.source_version = source_version  # Version of the Graph built from, to detect staleness
+
+  def __len__(self) -> int:
+    return len(self._vertices)
+
+  @property
+  def shortcut_count(self) -> int:
+    return len(self._middle)
+
+  @classmethod
+  def build(cls, graph: Graph) -> 'ContractionHierarchy':
+    vertices = list(graph.vertices())
+    ids = {vertex: idx for idx, vertex in enumerate(vertices)}
+    contraction = _Contraction(len(vertices), ((ids[src], ids[dst], weight)
+                                               for src, dst, weight in graph.edges()))
+
+    # Lazily updated priorities: a popped vertex is only contracted if still the least important
+    queue = [(contraction.priority(vertex), vertex) for vertex in range(len(vertices))]
+    heapq.heapify(queue)
+    upward: list[dict[int, float]] = [{} for _ in vertices]
+    downward: list[dict[int, float]] = [{} for _ in vertices]
+    while queue:
+      _, vertex = heapq.heappop(queue)
+      priority = contraction.priority(vertex)
+      if queue and priority > queue[0][0]:
+        heapq.heappush(queue, (priority, vertex))
+        continue
+      upward[vertex], downward[vertex] = contraction.contract(vertex)
+
+    return cls(vertices, upward, downward, contraction.middle, graph.version)
+
+  def save(self, file_path: str, source_key, encode=None) -> bool:
+    """
+    Pickles the hierarchy, tagged with a source_key identifying the data it was built from.
+    Vertices are pickled through encode(vertex) if given, such as to persist ids in place of
+    objects hashed by identity. Returns False if it couldn't be written, as with
+    as13.MetroNetwork.save_snapshot(), since a missing hierarchy is only rebuilt.
+    """
+    import as13  # Deferred, as as13 loads hierarchies through this module
+
+    vertices = list(map(encode, self._vertices)) if encode else self._vertices
+    try:
+      with as13.atomic_open(file_path) as hierarchy_file:
+        pickle.dump((_FORMAT_VERSION, source_key, vertices, self._forward, self._backward,
+                     self._middle), hierarchy_file, protocol=pickle.HIGHEST_PROTOCOL)
+    except OSError:
+      return False
+    return True
+
+  @classmethod
+  def load(cls, file_path: str, source_key, decode=None) -> 'ContractionHierarchy | None':
+    """
+    Loads a saved hierarchy, or returns None if the file is missing, unreadable or its
+    source_key differs
+    """
+    if not os.path.exists(file_path):
+      return None
+
+    try:
+      with open(file_path, 'rb') as hierarchy_file:
+        version, saved_key, vertices, forward, backward, middle = pickle.load(hierarchy_file)
+    except (pickle.UnpicklingError, AttributeError, TypeError, ValueError, EOFError, OSError):
+      return None  # Torn or corrupted, to be rebuilt
+    if (version, saved_key) != (_FORMAT_VERSION, source_key):
+      return None
+
+    hierarchy = cls.__new__(cls)
+    hierarchy._vertices = list(map(decode, vertices)) if decode else vertices
+    hierarchy._ids = {vertex: idx for idx, vertex in enumerate(hierarchy._vertices)}
+    hierarchy._forward, hierarchy._backward, hierarchy._middle = forward, backward, middle
+    hierarchy.source_version = None
+    return hierarchy
+
+  def _unpack(self, src: int, dst: int, path: list[int]) -> None:
+    """
+    Appends the original vertices after src along the edge towards dst, expanding shortcuts
+    """
+    stack = [(src, dst)]
+    while stack:
+      src, dst = stack.pop()
+      middle = self._middle.get((src, dst))
+      if middle is None:
+        path.append(dst)
+      else:
+        stack.append((middle, dst))
+        stack.append((src, middle))
+
+  def nearest_path(self, starts, targets, heuristic=None) -> tuple[list, object]:
+    """
+    Same as graph.Graph.nearest_path(). Any heuristic is accepted for compatibility but unused.
+    """
+    starts = [self._ids[vertex] for vertex in starts if vertex in self._ids]
+    targets = [self._ids[vertex] for vertex in targets if vertex in self._ids]
+    forward_costs = dict.fromkeys(starts, 0)
+    backward_costs = dict.fromkeys(targets, 0)
+    forward_previous, backward_previous = dict.fromkeys(starts, -1), dict.fromkeys(targets, -1)
+    searches = ((self._forward, forward_costs, forward_previous, [(0, vertex) for vertex in starts],
+                 backward_costs),
+                (self._backward, backward_costs, backward_previous,
+                 [(0, vertex) for vertex in targets], forward_costs))
+
+    best, meeting = math.inf, -1
+    for vertex in forward_costs.keys() & backward_costs.keys():
+      best, meeting = 0, vertex
+
+    # Alternates directions, each stopping once nothing left in its queue could improve the best
+    active = [search for search in searches if search[3]]
+    while active:
+      for search in list(active):
+        (offsets, edge_targets, weights), costs, previous, queue, other_costs = search
+        while queue and queue[0][0] > costs[queue[0][1]]:
+          heapq.heappop(queue)  # Superseded entries
+        if not queue or queue[0][0] >= best:
+          active.remove(search)
+          continue
+
+        cost, vertex = heapq.heappop(queue)
+        for pos in range(offsets[vertex], offsets[vertex + 1]):
+          addr, new_cost = edge_targets[pos], cost + weights[pos]
+          if new_cost < costs.get(addr, math.inf):
+            costs[addr], previous[addr] = new_cost, vertex
+            heapq.heappush(queue, (new_cost, addr))
+            if addr in other_costs and new_cost + other_costs[addr] < best:
+              best, meeting = new_cost + other_costs[addr], addr
+
+    report('vertices_expanded', len(forward_costs) + len(backward_costs))
+    if meeting < 0:
+      return [], None
+
+    climb = [meeting]
+    while forward_previous[climb[-1]] >= 0:
+      climb.append(forward_previous[climb[-1]])
+    descent = [meeting]
+    while backward_previous[descent[-1]] >= 0:
+      descent.append(backward_previous[descent[-1]])
+    hops = climb[::-1] + descent[1:]  # Across the hierarchy, shortcuts included
+
+    path = hops[:1]
+    for src, dst in itertools.pairwise(hops):
+      self._unpack(src, dst, path)
+    return [self._vertices[idx] for idx in path], best
+
+  def shortest_path(self, start, target, heuristic=None) -> list:
+    return self.nearest_path((start,), (target,))[0]
+
+
+if __name__ == '__main__':
+  import tempfile
+
+  import as13
+
+  def benchmark(name: str, graph: Graph, pairs: list[tuple]) -> None:
+    start_time = time.perf_counter()
+    hierarchy = ContractionHierarchy.build(graph)
+    build_time = time.perf_counter() - start_time
+    router = graph.freeze()
+
+    start_time = time.perf_counter()
+    plain = [router.nearest_path((start,), (target,)) for start, target in pairs]
+    plain_time = time.perf_counter() - start_time
+    start_time = time.perf_counter()
+    contracted = [hierarchy.nearest_path((start,), (target,)) for start, target in pairs]
+    contracted_time = time.perf_counter() - start_time
+
+    print(f'{name}: {len(graph)} vertices, {len(graph.edges())} edges, '
+          f'{hierarchy.shortcut_count} shortcuts built in {build_time:.2f}s; per query '
+          f'{plain_time / len(pairs) * 1e3:.3f}ms Dijkstra vs '
+          f'{contracted_time / len(pairs) * 1e3:.3f}ms contracted')
+
+    for (plain_path, plain_cost), (path, cost) in zip(plain, contracted):
+      assert (plain_cost is None) == (cost is None)
+      if cost is not None:
+        assert math.isclose(cost, plain_cost) and math.isclose(graph.path_length(path) or 0, cost)
+        assert path[0] == plain_path[0] and path[-1] == plain_path[-1]
+
+  rng = random.Random(13)
+  stops = list(as13.rail_network.vertices())
+  benchmark('rail_network', as13.rail_network,
+            [(rng.choice(stops), rng.choice(stops)) for _ in range(2000)])
+
+  # Directed grid with random weights, standing in for a much larger merged network
+  side = 60
+  grid = Graph()
+  for x, y in itertools.product(range(side), repeat=2):
+    for dx, dy in ((1, 0), (0, 1), (-1, 0), (0, -1)):
+      if 0 <= x + dx < side and 0 <= y + dy < side:
+        grid[x, y][x + dx, y + dy] = rng.uniform(1, 10)
+  cells = list(grid.vertices())
+  benchmark('grid', grid, [(rng.choice(cells), rng.choice(cells)) for _ in range(500)])
+
+  hierarchy_path = f'{as13.network.path}hierarchy.pickle'
+  as13.enable_hierarchy()
+  assert os.path.exists(hierarchy_path)
+  reloaded = ContractionHierarchy.load(hierarchy_path, ('stale', 0.0))
+  assert reloaded is None
+  acton, upminster = (next(st for st in as13.id_stations.values() if st.name == name)
+                      for name in ('Acton Town', 'Upminster'))
+  assert as13.current_hierarchy() is not None
+  assert as13.gen_route_instr(acton, upminster)
+  as13.rail_hierarchy = None
+
+  # Torn files are rebuilt rather than loaded, and unwritable paths are no error
+  source_key = (as13.network.digest, as13.network.transfer_penalty)
+  with open(hierarchy_path, 'rb') as hierarchy_file:
+    content = hierarchy_file.read()
+  with tempfile.TemporaryDirectory() as temp_dir:
+    for size in (0, len(content) // 2):
+      with open(f'{temp_dir}/hierarchy.pickle', 'wb') as torn:
+        torn.write(content[:size])
+      assert ContractionHierarchy.load(f'{temp_dir}/hierarchy.pickle', source_key) is None
+    grid_hierarchy = ContractionHierarchy.build(grid)
+    assert not grid_hierarchy.save(f'{temp_dir}/missing/hierarchy.pickle', source_key)
+    assert grid_hierarchy.save(f'{temp_dir}/hierarchy.pickle', source_key)
+    assert os.listdir(temp_dir) == ['hierarchy.pickle']  # No temporary file left behind
+
+  print('All assertions passed!')
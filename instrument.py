@@ -0,0 +1,308 @@
+#!/usr/bin/env python
+"""
+Opt-in instrumentation of route queries
+
+While enabled, every instrumented query records a trace of how long each of its phases took and
+how many vertices its graph searches expanded and paths they enumerated, feeding counters and
+histograms that can be dumped as JSON or scraped in the Prometheus text format. While disabled, the
+instrumented code only pays for one flag check per query or phase.
+
+Enable with enable(), or by setting the AS13_INSTRUMENT environment variable before importing as13.
+"""
+
+__author__ = 'https://github.com/Drullkus'
+
+import bisect
+import collections
+import contextlib
+import cProfile
+import io
+import itertools
+import json
+import os
+import pstats
+import threading
+import time
+import tracemalloc
+
+import graph
+
+# Upper bounds of histogram buckets: seconds from a microsecond up, and counts from one up
+time_buckets = tuple(1e-6 * 2**exponent for exponent in range(24))
+count_buckets = tuple(2**exponent for exponent in range(24))
+
+
+class Histogram:
+  """
+  Counts of observed values per bucket, each bucket counting values up to its bound and above the
+  previous bound, plus an overflow bucket
+  """
+  def __init__(self, bounds: tuple[float, ...]):
+    self.bounds = bounds
+    self.buckets = [0] * (len(bounds) + 1)
+    self.count = 0
+    self.total = 0
+    self.min = self.max = None
+
+  def observe(self, value) -> None:
+    self.buckets[bisect.bisect_left(self.bounds, value)] += 1
+    self.count += 1
+    self.total += value
+    self.min = value if self.min is None else min(self.min, value)
+    self.max = value if self.max is None else max(self.max, value)
+
+  def quantile(self, fraction: float):
+    """
+    Upper bound of the bucket holding the given quantile, or the maximum if it overflowed
+    """
+    rank = fraction * self.count
+    for bound, cumulative in zip(self.bounds, itertools.accumulate(self.buckets)):
+      if cumulative >= rank:
+        return bound
+    return self.max
+
+  def as_dict(self) -> dict:
+    return {'count': self.count, 'total': self.total, 'min': self.min, 'max': self.max,
+            'p50': self.quantile(0.5), 'p99': self.quantile(0.99),
+            'buckets': dict(zip((*map(str, self.bounds), '+Inf'), self.buckets))}
+
+
+class Metrics:
+  """
+  Thread-safe registry of named counters and histograms
+  """
+  def __init__(self):
+    self._lock = threading.Lock()
+    self.counters: collections.Counter = collections.Counter()
+    self.histograms: dict[str, Histogram] = {}
+
+  def count(self, name: str, amount: int = 1) -> None:
+    with self._lock:
+      self.counters[name] += amount
+
+  def observe(self, name: str, value, bounds: tuple = time_buckets) -> None:
+    with self._lock:
+      if name not in self.histograms:
+        self.histograms[name] = Histogram(bounds)
+      self.histograms[name].observe(value)
+
+  def reset(self) -> None:
+    with self._lock:
+      self.counters.clear()
+      self.histograms.clear()
+
+  def snapshot(self) -> dict:
+    with self._lock:
+      return {'counters': dict(self.counters),
+              'histograms': {name: hist.as_dict() for name, hist in self.histograms.items()}}
+
+  def dump(self, file_path: str) -> None:
+    with open(file_path, 'w') as metrics_file:
+      json.dump(self.snapshot(), metrics_file, indent=2)
+
+  def exposition(self) -> str:
+    """
+    Prometheus text exposition of every counter and histogram
+    """
+    lines = []
+    with self._lock:
+      for name, value in sorted(self.counters.items()):
+        lines += [f'# TYPE as13_{name} counter', f'as13_{name} {value}']
+      for name, hist in sorted(self.histograms.items()):
+        lines.append(f'# TYPE as13_{name} histogram')
+        for bound, cumulative in zip((*map(repr, hist.bounds), '+Inf'),
+                                     itertools.accumulate(hist.buckets)):
+          lines.append(f'as13_{name}_bucket{{le="{bound}"}} {cumulative}')
+        lines += [f'as13_{name}_sum {hist.total}', f'as13_{name}_count {hist.count}']
+    return '\n'.join(lines) + '\n'
+
+
+class Trace:
+  """
+  Record of one query: its total and per-phase seconds, and search event counts
+  """
+  def __init__(self, name: str, key: tuple):
+    self.name = name
+    self.key = key
+    self.seconds = 0.0
+    self.phases: collections.Counter = collections.Counter()
+    self.events: collections.Counter = collections.Counter()
+    self.profile: str | None = None
+
+  def as_dict(self) -> dict:
+    return {'query': self.name, 'key': list(map(str, self.key)), 'seconds': self.seconds,
+            'phases': dict(self.phases), 'events': dict(self.events), 'profile': self.profile}
+
+
+enabled = False
+metrics = Metrics()
+recent_traces: collections.deque[Trace] = collections.deque(maxlen=256)
+
+_DISABLED = contextlib.nullcontext()
+_local = threading.local()  # Innermost active trace of each thread
+_armed: collections.deque[str] = collections.deque()  # Profilers awaiting the next queries
+
+
+def _on_search_event(event: str, amount: int) -> None:
+  metrics.count(f'{event}_total', amount)
+  if trace := getattr(_local, 'trace', None):
+    trace.events[event] += amount
+
+
+def enable() -> None:
+  global enabled
+  enabled = True
+  graph.set_observer(_on_search_event)
+
+
+def disable() -> None:
+  global enabled
+  enabled = False
+  graph.set_observer(None)
+
+
+@contextlib.contextmanager
+def profiled(stats_limit: int = 25):
+  """
+  Profiles the enclosed code with cProfile, yielding a list to which the report is appended
+  """
+  profiler, report = cProfile.Profile(), []
+  profiler.enable()
+  try:
+    yield report
+  finally:
+    profiler.disable()
+    stream = io.StringIO()
+    pstats.Stats(profiler, stream=stream).sort_stats('cumulative').print_stats(stats_limit)
+    report.append(stream.getvalue())
+
+
+@contextlib.contextmanager
+def allocations(stats_limit: int = 25):
+  """
+  Traces memory allocated within the enclosed code with tracemalloc, yielding a list to which the
+  report of the largest allocation sites is appended
+  """
+  already_tracing = tracemalloc.is_tracing()
+  if not already_tracing:
+    tracemalloc.start()
+  before, report = tracemalloc.take_snapshot(), []
+  try:
+    yield report
+  finally:
+    stats = tracemalloc.take_snapshot().compare_to(before, 'lineno')
+    if not already_tracing:
+      tracemalloc.stop()
+    report.append('\n'.join(map(str, stats[:stats_limit])))
+
+
+def profile_next(count: int = 1, mode: str = 'cprofile') -> None:
+  """
+  Wraps each of the next count queries in cProfile, or tracemalloc if mode is 'tracemalloc',
+  attaching the report to their traces. Enables instrumentation if needed.
+  """
+  if mode not in ('cprofile', 'tracemalloc'):
+    raise ValueError(f'Unknown profiling mode {mode!r}')
+  _armed.extend([mode] * count)
+  enable()
+
+
+@contextlib.contextmanager
+def _query(name: str, key: tuple):
+  outer = getattr(_local, 'trace', None)
+  trace = _local.trace = Trace(name, key)
+  try:
+    mode = _armed.popleft() if outer is None and _armed else None
+  except IndexError:  # Taken by another thread meanwhile
+    mode = None
+
+  start_time = time.perf_counter()
+  try:
+    if mode is None:
+      yield trace
+    else:
+      with (profiled() if mode == 'cprofile' else allocations()) as report:
+        yield trace
+  finally:
+    trace.seconds = time.perf_counter() - start_time
+    _local.trace = outer
+    if mode is not None:
+      trace.profile = report[0]
+
+    metrics.count(f'{name}_queries_total')
+    metrics.observe(f'{name}_seconds', trace.seconds)
+    for event, amount in trace.events.items():
+      metrics.observe(f'{name}_{event}', amount, count_buckets)
+    recent_traces.append(trace)
+
+
+def query(name: str, *key):
+  """
+  Context manager tracing one query while enabled, nested queries being traced separately
+  """
+  return _query(name, key) if enabled else _DISABLED
+
+
+@contextlib.contextmanager
+def _phase(name: str):
+  start_time = time.perf_counter()
+  try:
+    yield
+  finally:
+    seconds = time.perf_counter() - start_time
+    metrics.observe(f'phase_{name}_seconds', seconds)
+    if trace := getattr(_local, 'trace', None):
+      trace.phases[name] += seconds
+
+
+def phase(name: str):
+  """
+  Context manager timing one phase of the current query while enabled. Repeated phases accumulate.
+  """
+  return _phase(name) if enabled else _DISABLED
+
+
+if os.environ.get('AS13_INSTRUMENT'):
+  enable()
+
+
+if __name__ == '__main__':
+  import as13
+  import instrument  # The module as13 imported, rather than this __main__ copy
+
+  acton, upminster, bank = (next(st for st in as13.id_stations.values() if st.name == name)
+                            for name in ('Acton Town', 'Upminster', 'Bank'))
+  as13.route_stops(acton, bank)
+  assert not instrument.recent_traces and not instrument.metrics.counters  # Disabled by default
+
+  instrument.enable()
+  as13.gen_route_instr(acton, bank)
+  trace = instrument.recent_traces[-1]
+  assert trace.name == 'gen_route_instr' and trace.key == (acton, bank)
+  assert {'route_stops', 'gen_st_instr'} <= trace.phases.keys()
+  assert trace.events['vertices_expanded'] > 0 and trace.seconds >= sum(trace.phases.values())
+  as13.gen_route_instr(acton, bank)  # Cached, so no searching at all
+  assert not instrument.recent_traces[-1].events
+  assert 'route_stops' not in instrument.recent_traces[-1].phases
+
+  district = next(rl for rl in as13.id_lines.values() if rl.name == 'District Line')
+  as13.network.rail_supergraph.start_search(district, district, reducer=lambda paths: paths[0])
+  assert instrument.metrics.counters['paths_enumerated_total'] > 0
+
+  instrument.profile_next(mode='cprofile')
+  instrument.profile_next(mode='tracemalloc')
+  as13.gen_route_instr(upminster, bank)
+  assert 'route_stops' in instrument.recent_traces[-1].profile
+  as13.gen_route_instr(bank, upminster)
+  assert instrument.recent_traces[-1].profile is not None
+
+  snapshot = instrument.metrics.snapshot()
+  assert snapshot['counters']['gen_route_instr_queries_total'] == 4
+  assert snapshot['histograms']['gen_route_instr_seconds']['count'] == 4
+  assert 'as13_gen_route_instr_seconds_bucket{le="+Inf"} 4' in instrument.metrics.exposition()
+
+  instrument.disable()
+  as13.gen_route_instr(acton, upminster)
+  assert instrument.metrics.counters['gen_route_instr_queries_total'] == 4
+
+  print('All assertions passed!')
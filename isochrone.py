@@ -0,0 +1,242 @@
+#!/usr/bin/env python
+"""
+Single-source reachability, answering "everything within N km or K changes of a station"
+
+One Dijkstra pass over the expanded (Station, RailLine) network settles every station reachable
+from the origin, tracking alongside each route's cost the kilometres ridden, stops passed and line
+transfers made. Stations stream out as a generator in increasing order of cost, so a caller may
+stop at any budget without the rest of the network ever being searched. Several origins may be
+searched at once, each station then attributed to whichever origin reaches it most cheaply.
+
+Costs weigh each transfer by the transfer penalty, as route_stops() does, while kilometres ridden
+and transfers may each be capped separately. When they are, each (Station, RailLine) stop is
+settled again for every route riding fewer kilometres or making fewer transfers than those settled
+there before it, so that a cheaper route over budget can't hide a dearer one within it. Every
+origin's isochrone may also be searched across a process pool, as for heat maps over the whole
+network.
+"""
+
+__author__ = 'https://github.com/Drullkus'
+
+import collections
+import heapq
+import itertools
+import os
+import time
+from typing import Iterable, Iterator, NamedTuple
+
+import as13
+import batch
+from graph import report
+from subway_lib import Station
+
+
+class Reach(NamedTuple):
+  """
+  Cheapest route found from the origins to one station, weighed as as13.route_stops() weighs
+  journeys: kilometres ridden plus the transfer penalty for each transfer
+  """
+  station: Station
+  origin: Station  # Whichever origin the route leaves from
+  cost: float
+  distance: float  # Kilometres ridden, excluding any transfer penalty
+  stops: int  # Stations passed through after boarding, including the last
+  transfers: int
+
+
+def isochrone(origins: Station | Iterable[Station], max_cost: float | None = None,
+              max_transfers: int | None = None, max_distance: float | None = None,
+              network: as13.MetroNetwork | None = None) -> Iterator[Reach]:
+  """
+  Yields a Reach for every station reachable from the origin station (or nearest of several
+  origins) over the network's open tracks, in increasing order of cost, starting with the origins
+  themselves. Stops once costs, transfer penalties included, exceed max_cost. Only follows routes
+  with at most max_transfers transfers and riding at most max_distance kilometres, if given.
+  """
+  network = network or as13.network
+  origins = (origins,) if isinstance(origins, Station) else tuple(dict.fromkeys(origins))
+  rail_network = network.rail_network
+  reached = set()
+  for origin in origins:
+    reached.add(origin)
+    yield Reach(origin, origin, 0.0, 0.0, 0, 0)
+
+  # Labels are (cost, tie, stop, origin, distance, stops, transfers)
+  tie = itertools.count()
+  heap = [(0.0, next(tie), (origin, rail_line), origin, 0.0, 0, 0)
+          for origin in origins for rail_line in network.st_routes[origin]]
+  heapq.heapify(heap)
+
+  # Transfers and kilometres of the labels settled per stop, each settled more cheaply, counted
+  # as zero unless capped, so that without caps the first label settled dominates every other
+  capped_transfers, capped_distance = max_transfers is not None, max_distance is not None
+  capped = capped_transfers or capped_distance
+  settled: dict = {}
+
+  def dominated(stop, transfers: int, distance: float) -> bool:
+    transfers, distance = transfers * capped_transfers, distance * capped_distance
+    return any(settled_transfers <= transfers and settled_distance <= distance
+               for settled_transfers, settled_distance in settled.get(stop, ()))
+
+  try:
+    while heap:
+      cost, _, stop, origin, distance, stops, transfers = heapq.heappop(heap)
+      if max_cost is not None and cost > max_cost:
+        return
+      if stop in settled and (not capped or dominated(stop, transfers, distance)):
+        continue  # Already settled at least as cheaply, with no more transfers or kilometres
+      settled.setdefault(stop, []).append((transfers * capped_transfers,
+                                           distance * capped_distance))
+
+      station, rail_line = stop
+      if station not in reached:
+        reached.add(station)
+        yield Reach(station, origin, cost, distance, stops, transfers)
+
+      for adjacent, weight in rail_network[stop].items():
+        if adjacent[1] != rail_line:  # Changing lines within the same station
+          label = (cost + weight, next(tie), adjacent, origin, distance, stops, transfers + 1)
+          if max_transfers is not None and transfers >= max_transfers:
+            continue
+        else:
+          if capped_distance and distance + weight > max_distance:
+            continue
+          label = (cost + weight, next(tie), adjacent, origin, distance + weight, stops + 1,
+                   transfers)
+        if adjacent in settled and (not capped or dominated(adjacent, label[6], label[4])):
+          continue  # Spared queueing a label that would be discarded once popped
+        heapq.heappush(heap, label)
+  finally:
+    report('vertices_expanded', len(settled))
+
+
+def _isochrone_block(origin_ids: list[str], max_cost: float | None, max_transfers: int | None,
+                     max_distance: float | None) -> list[tuple[str, tuple]]:
+  """
+  Process pool task: searches each origin of one block, keyed by station ids to cross processes
+  """
+  id_stations, station_ids = as13.id_stations, as13.station_ids
+  return [(origin_id, tuple((station_ids[reach.station], reach.cost, reach.distance, reach.stops,
+                             reach.transfers)
+                            for reach in isochrone(id_stations[origin_id], max_cost,
+                                                   max_transfers, max_distance)))
+          for origin_id in origin_ids]
+
+
+def all_origins(origins: Iterable[Station] | None = None, max_cost: float | None = None,
+                max_transfers: int | None = None, max_distance: float | None = None,
+                workers: int | None = None,
+                block_size: int = 16) -> Iterator[tuple[Station, list[Reach]]]:
+  """
+  Yields each origin's isochrone as a list of Reach records, in the order the origins were given,
+  by default every station of the network. See isochrone() for the budgets.
+
+  workers: Process count, defaulting to one per CPU. Zero searches within the calling process.
+  block_size: Origins per worker task.
+  """
+  origins = list(as13.id_stations.values() if origins is None else origins)
+  if workers == 0:
+    for origin in origins:
+      yield origin, list(isochrone(origin, max_cost, max_transfers, max_distance))
+    return
+
+  id_stations, station_ids = as13.id_stations, as13.station_ids
+  workers = workers or os.cpu_count() or 1
+  origin_ids = iter([station_ids[origin] for origin in origins])
+
+  def unpack(future) -> Iterator[tuple[Station, list[Reach]]]:
+    for origin_id, reaches in future.result():
+      origin = id_stations[origin_id]
+      yield origin, [Reach(id_stations[st_id], origin, *criteria) for st_id, *criteria in reaches]
+
+  with batch.fork_executor(workers) as executor:
+    # Bounded window of in-flight blocks, as with batch.route_batch()
+    window = collections.deque()
+    while block := list(itertools.islice(origin_ids, block_size)):
+      window.append(executor.submit(_isochrone_block, block, max_cost, max_transfers,
+                                    max_distance))
+      if len(window) >= workers * 2:
+        yield from unpack(window.popleft())
+    while window:
+      yield from unpack(window.popleft())
+
+
+def heat_map(max_cost: float | None = None, max_transfers: int | None = None,
+             max_distance: float | None = None, workers: int | None = None) -> dict[Station, int]:
+  """
+  Count of stations reachable from every station within the budgets, itself included
+  """
+  return {origin: len(reaches)
+          for origin, reaches in all_origins(None, max_cost, max_transfers, max_distance, workers)}
+
+
+if __name__ == '__main__':
+  by_name = {station.name: station for station in as13.id_stations.values()}
+  acton, upminster, bank = by_name['Acton Town'], by_name['Upminster'], by_name['Bank']
+  served = [station for station, routes in as13.st_routes.items() if routes]
+  rail_network = as13.rail_network
+
+  def cheapest(st_start: Station, st_goal: Station) -> float:
+    return rail_network.path_length(as13.route_stops(st_start, st_goal)) or 0.0
+
+  # Costs match pairwise routing, streamed in increasing order
+  reaches = list(isochrone(acton))
+  assert reaches[0] == Reach(acton, acton, 0.0, 0.0, 0, 0)
+  assert {reach.station for reach in reaches} == set(served)
+  assert all(reach1.cost <= reach2.cost for reach1, reach2 in itertools.pairwise(reaches))
+  for reach in reaches[::5]:
+    assert abs(reach.cost - cheapest(acton, reach.station)) < 1e-9
+    assert abs(reach.distance + as13.transfer_penalty * reach.transfers - reach.cost) < 1e-9
+  assert next(reach for reach in reaches if reach.station == bank).stops > 0
+
+  # Budgets stop the search early, yielding exactly what lies within them
+  within = list(isochrone(acton, max_cost=10.0))
+  assert within == [reach for reach in reaches if reach.cost <= 10.0]
+  assert len(list(itertools.islice(isochrone(acton), 5))) == 5
+
+  costs = {reach.station: reach.cost for reach in reaches}
+  line_stations = set().union(*(as13.rail_stations[rail_line] for rail_line in
+                                as13.st_routes[acton]))
+  assert {reach.station for reach in isochrone(acton, max_transfers=0)} == line_stations
+  one_change = {reach.station: reach for reach in isochrone(acton, max_transfers=1)}
+  assert set(one_change) == set().union(*(as13.rail_stations[rail_line] for station in line_stations
+                                          for rail_line in as13.st_routes[station]))
+  assert all(reach.cost >= costs[station] - 1e-9 for station, reach in one_change.items())
+  assert all(reach.transfers <= 1 for reach in one_change.values())
+
+  # Kilometres ridden are capped apart from cost, so transfers cost no distance budget
+  within_km = {reach.station: reach for reach in isochrone(acton, max_distance=10.0)}
+  assert all(reach.distance <= 10.0 + 1e-9 for reach in within_km.values())
+  assert set(within_km) >= {reach.station for reach in reaches if reach.distance <= 10.0}
+  assert set(within_km) > {reach.station for reach in within}
+  assert all(reach.cost >= costs[station] - 1e-9 for station, reach in within_km.items())
+  assert all(reach.transfers <= 1 for reach in isochrone(acton, max_transfers=1,
+                                                          max_distance=10.0))
+
+  # Several origins, each station attributed to whichever reaches it most cheaply
+  nearest = {reach.station: reach for reach in isochrone((acton, upminster))}
+  assert nearest[acton].origin == acton and nearest[upminster].origin == upminster
+  for station, reach in list(nearest.items())[::7]:
+    assert abs(reach.cost - min(cheapest(acton, station), cheapest(upminster, station))) < 1e-9
+
+  # Closures are searched around
+  as13.network.close_station(bank)
+  assert bank not in {reach.station for reach in isochrone(acton)}
+  as13.network.reopen_all()
+
+  start_time = time.perf_counter()
+  for origin in served[::10]:
+    sum(1 for _ in isochrone(origin))
+  single = (time.perf_counter() - start_time) / len(served[::10])
+  start_time = time.perf_counter()
+  heat = heat_map(max_cost=15.0)
+  elapsed = time.perf_counter() - start_time
+  print(f'Isochrones: {single * 1e3:.2f}ms each, heat map over {len(heat)} origins in '
+        f'{elapsed:.2f}s')
+
+  assert heat[acton] == len(within) + sum(1 for reach in isochrone(acton)
+                                          if 10.0 < reach.cost <= 15.0)
+  assert dict(all_origins(served[:5], max_cost=15.0, workers=0)) == \
+    dict(all_origins(served[:5], max_cost=15.0, workers=2))
+
+  print('All assertions passed!')
@@ -0,0 +1,114 @@
+#!/usr/bin/env python
+"""
+Load test of the routing service, reporting throughput and latency percentiles as JSON
+
+Many concurrent clients, each over its own kept-alive connection, send /route queries between
+random stations as fast as they are answered. A share of the queries repeat a handful of popular
+pairs, as real traffic would, exercising the service's coalescing of identical queries.
+"""
+
+__author__ = 'https://github.com/Drullkus'
+
+import argparse
+import asyncio
+import json
+import random
+import statistics
+import sys
+import time
+
+
+class Client:
+  """
+  Minimal HTTP/1.1 JSON client holding one kept-alive connection, opened on first request
+  """
+  def __init__(self, host: str, port: int):
+    self.host, self.port = host, port
+    self._reader: asyncio.StreamReader | None = None
+    self._writer: asyncio.StreamWriter | None = None
+
+  async def request(self, method: str, target: str, payload=None) -> tuple[int, object]:
+    if self._writer is None:
+      self._reader, self._writer = await asyncio.open_connection(self.host, self.port)
+
+    body = b'' if payload is None else json.dumps(payload).encode()
+    self._writer.write(f'{method} {target} HTTP/1.1\r\nHost: {self.host}\r\n'
+                       f'Content-Type: application/json\r\nContent-Length: {len(body)}\r\n\r\n'
+                       .encode() + body)
+    await self._writer.drain()
+
+    status = int((await self._reader.readline()).split()[1])
+    headers = {}
+    while (line := await self._reader.readline()) not in (b'\r\n', b''):
+      name, _, value = line.decode('latin-1').partition(':')
+      headers[name.strip().lower()] = value.strip()
+    content = await self._reader.readexactly(int(headers['content-length']))
+    if headers.get('connection') == 'close':
+      await self.close()
+    return status, json.loads(content)
+
+  async def close(self) -> None:
+    if self._writer is not None:
+      self._writer.close()
+      self._reader = self._writer = None
+
+
+def _percentile(ordered: list[float], fraction: float) -> float:
+  return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+async def run(host: str, port: int, requests: int = 2000, concurrency: int = 32,
+              repeat_share: float = 0.2, seed: int = 0) -> dict:
+  """
+  Sends the requests across concurrent clients, returning throughput and latency statistics
+  """
+  rng = random.Random(seed)
+  client = Client(host, port)
+  _, stations = await client.request('GET', '/stations')
+  await client.close()
+  served = [station['id'] for station in stations if station['lines']]
+  popular = [tuple(rng.sample(served, 2)) for _ in range(5)]
+  pairs = [rng.choice(popular) if rng.random() < repeat_share else tuple(rng.sample(served, 2))
+           for _ in range(requests)]
+
+  latencies, failures = [], 0
+  queue = iter(pairs)
+
+  async def worker() -> None:
+    nonlocal failures
+    worker_client = Client(host, port)
+    for start, goal in queue:
+      sent = time.perf_counter()
+      status, _ = await worker_client.request('GET', f'/route?from={start}&to={goal}')
+      latencies.append(time.perf_counter() - sent)
+      failures += status != 200
+    await worker_client.close()
+
+  start_time = time.perf_counter()
+  await asyncio.gather(*(worker() for _ in range(concurrency)))
+  seconds = time.perf_counter() - start_time
+
+  ordered = sorted(latencies)
+  return {'requests': len(latencies), 'failures': failures, 'concurrency': concurrency,
+          'seconds': round(seconds, 3), 'requests_per_second': round(len(latencies) / seconds, 1),
+          'latency_ms': {'mean': round(statistics.fmean(ordered) * 1e3, 3),
+                         **{name: round(_percentile(ordered, fraction) * 1e3, 3)
+                            for name, fraction in (('p50', 0.5), ('p90', 0.9), ('p99', 0.99))},
+                         'max': round(ordered[-1] * 1e3, 3)}}
+
+
+if __name__ == '__main__':
+  parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+  parser.add_argument('--host', default='127.0.0.1')
+  parser.add_argument('--port', type=int, default=8013)
+  parser.add_argument('--requests', type=int, default=2000)
+  parser.add_argument('--concurrency', type=int, default=32)
+  parser.add_argument('--repeat-share', type=float, default=0.2,
+                      help='Share of requests repeating one of a few popular pairs')
+  parser.add_argument('--seed', type=int, default=0)
+  args = parser.parse_args()
+
+  results = asyncio.run(run(args.host, args.port, args.requests, args.concurrency,
+                            args.repeat_share, args.seed))
+  json.dump(results, sys.stdout, indent=2)
+  print()
@@ -0,0 +1,253 @@
+#!/usr/bin/env python
+"""
+Multi-criteria routing, offering every itinerary worth choosing rather than a single best one
+
+A label-setting search over the expanded (Station, RailLine) network tracks four criteria at once:
+line transfers, kilometres ridden, stops passed and fare zones spanned. Each vertex keeps only the
+labels no other label there dominates, being no worse in every criterion, and labels which can't
+beat an itinerary already found even by the most optimistic estimate are dropped, so that the
+search settles only a small share of all possible paths. The result is the Pareto set: itineraries
+each of which is better than every other in at least one criterion.
+
+Fare zones follow Station.zone, a station numbered between two zones (such as 2.5) counting as
+whichever of them spans fewer zones overall.
+"""
+
+__author__ = 'https://github.com/Drullkus'
+
+import functools
+import heapq
+import itertools
+import math
+import time
+from typing import NamedTuple
+
+import as13
+from graph import report
+from subway_lib import RailLine, Station
+
+
+class Itinerary(NamedTuple):
+  """
+  One Pareto-optimal journey between two stations, as (Station, RailLine) stops like
+  as13.route_stops() returns, alongside its criteria
+  """
+  transfers: int
+  distance: float  # Kilometres ridden, excluding any transfer penalty
+  stops: int  # Stations passed through after boarding, including the last
+  zones: int  # Fare zones spanned
+  route: tuple[tuple[Station, RailLine], ...]
+
+  @property
+  def criteria(self) -> tuple[int, float, int, int]:
+    return self.transfers, self.distance, self.stops, self.zones
+
+  def legs(self) -> list[tuple[RailLine, list[Station]]]:
+    return as13.split_legs(list(self.route))
+
+  def instructions(self) -> tuple[RailLine, str] | list[str | tuple[RailLine, str]]:
+    return as13.gen_legs_instr(self.legs())
+
+
+def _dominates(criteria1: tuple, criteria2: tuple) -> bool:
+  return criteria1[0] <= criteria2[0] and criteria1[1] <= criteria2[1] and \
+    criteria1[2] <= criteria2[2] and criteria1[3] <= criteria2[3]
+
+
+def _label_dominates(label1: tuple, label2: tuple) -> bool:
+  """
+  Whether every itinerary continuing the second label is dominated by one continuing the first,
+  comparing the zones each must reach and leave rather than the span so far, as labels spanning
+  as many zones may yet go on to span different numbers of zones
+  """
+  return label1[0] <= label2[0] and label1[1] <= label2[1] and label1[2] <= label2[2] and \
+    label1[3] <= label2[3] and label1[4] >= label2[4]
+
+
+def _zone_span(highest_floor: int, lowest_ceiling: int) -> int:
+  """
+  Fewest zones a journey spans, given the highest zone it must reach and the lowest it must leave,
+  rounding each station's zone down and up respectively
+  """
+  return max(1, highest_floor - lowest_ceiling + 1)
+
+
+@functools.lru_cache(maxsize=4)
+def _zone_bounds(network: as13.MetroNetwork) -> list[tuple[int, int] | None]:
+  """
+  Each station's zone rounded down and up, indexed by station id
+  """
+  table = network.station_table
+  zone_bounds = [None] * (max(table.ids, default=-1) + 1)
+  for st_id, zone in zip(table.ids, table.zones):
+    zone_bounds[st_id] = math.floor(zone), math.ceil(zone)
+  return zone_bounds
+
+
+def _transfers_to(network: as13.MetroNetwork, goal_lines) -> dict[RailLine, int]:
+  """
+  Fewest transfers from each line to any of the goal lines, by breadth-first search over
+  rail_supergraph. Lines missing cannot reach the goal at all.
+  """
+  transfers_left = dict.fromkeys(goal_lines, 0)
+  frontier = list(goal_lines)
+  for transfers in itertools.count(1):
+    if not frontier:
+      return transfers_left
+    frontier = [adjacent for rail_line in frontier
+                for adjacent in network.rail_supergraph.neighbors(rail_line)
+                if adjacent not in transfers_left]
+    transfers_left.update(dict.fromkeys(frontier, transfers))
+
+
+def pareto_routes(st_start: Station, st_goal: Station,
+                  network: as13.MetroNetwork | None = None) -> list[Itinerary]:
+  """
+  Every Pareto-optimal itinerary between the stations over the network's open tracks, ordered by
+  transfers then distance. Empty if the goal cannot be reached.
+  """
+  network = network or as13.network
+  rail_network, zone_bounds = network.rail_network, _zone_bounds(network)
+  station_vectors = network.station_vectors
+  goal_vector, goal_lines = station_vectors[st_goal.id], network.st_routes[st_goal]
+  goal_floor, goal_ceiling = zone_bounds[st_goal.id]
+  transfers_left = _transfers_to(network, goal_lines)
+
+  # Labels are (transfers, distance, stops, highest floor, lowest ceiling, stop, previous label),
+  # queued by transfers then distance plus the chord towards the goal, which never decreases along
+  # any path, so no label can be dominated by another queued after it
+  tie = itertools.count()
+  heap = []
+  start_floor, start_ceiling = zone_bounds[st_start.id]
+  for rail_line in network.st_routes[st_start]:
+    label = (0, 0.0, 0, start_floor, start_ceiling, (st_start, rail_line), None)
+    heap.append((0, 0.0, 0, 1, next(tie), label))
+  heapq.heapify(heap)
+
+  bags: dict[tuple[Station, RailLine], list[tuple]] = {}  # Labels settled per stop, criteria only
+  found: list[tuple[tuple, tuple]] = []  # Criteria of itineraries reaching the goal, with labels
+  expanded = 0
+  while heap:
+    _, _, _, _, _, label = heapq.heappop(heap)
+    transfers, distance, stops, highest_floor, lowest_ceiling, stop, _ = label
+    station, rail_line = stop
+
+    # Most optimistic criteria of any itinerary continuing this label
+    at_goal = station == st_goal
+    if rail_line not in transfers_left:
+      continue  # No line sequence reaches the goal any more
+    bound = (transfers + transfers_left[rail_line], distance + math.dist(
+             station_vectors[station.id], goal_vector), stops + (not at_goal),
+             _zone_span(max(highest_floor, goal_floor), min(lowest_ceiling, goal_ceiling)))
+    if any(_dominates(criteria, bound) for criteria, _ in found):
+      continue
+    bag = bags.setdefault(stop, [])
+    if any(_label_dominates(settled, label) for settled in bag):
+      continue
+    bag.append(label[:5])
+    expanded += 1
+
+    if at_goal:
+      found.append(((transfers, distance, stops, _zone_span(highest_floor, lowest_ceiling)), label))
+      continue
+
+    for adjacent, weight in rail_network[stop].items():
+      next_station, next_line = adjacent
+      if next_line != rail_line:  # Changing lines within the same station
+        next_label = (transfers + 1, distance, stops, highest_floor, lowest_ceiling, adjacent,
+                      label)
+      else:
+        floor, ceiling = zone_bounds[next_station.id]
+        next_label = (transfers, distance + weight, stops + 1, max(highest_floor, floor),
+                      min(lowest_ceiling, ceiling), adjacent, label)
+      if adjacent in bags and any(_label_dominates(settled, next_label)
+                                  for settled in bags[adjacent]):
+        continue  # Spared queueing a label that would be discarded once popped
+      estimate = next_label[1] + math.dist(station_vectors[next_station.id], goal_vector)
+      heapq.heappush(heap, (next_label[0], estimate, next_label[2],
+                            _zone_span(*next_label[3:5]), next(tie), next_label))
+
+  report('vertices_expanded', expanded)
+  itineraries = []
+  for (transfers, distance, stops, zones), label in found:
+    route = []
+    while label is not None:
+      route.append(label[5])
+      label = label[6]
+    itineraries.append(Itinerary(transfers, distance, stops, zones, tuple(reversed(route))))
+  return sorted(itineraries, key=lambda itinerary: itinerary.criteria)
+
+
+def top_routes(st_start: Station, st_goal: Station, k: int = 3, key=None,
+               network: as13.MetroNetwork | None = None) -> list[Itinerary]:
+  """
+  The k best Pareto-optimal itineraries, as alternatives to offer. Ranked by key, mapping an
+  Itinerary to a sortable score, otherwise as as13.route_stops() weighs them: distance plus the
+  transfer penalty for each transfer.
+  """
+  network = network or as13.network
+
+  def weighed(itinerary: Itinerary) -> tuple[float, int]:
+    return itinerary.distance + network.transfer_penalty * itinerary.transfers, itinerary.stops
+
+  return sorted(pareto_routes(st_start, st_goal, network), key=key or weighed)[:k]
+
+
+if __name__ == '__main__':
+  by_name = {station.name: station for station in as13.id_stations.values()}
+  acton, upminster, bank = by_name['Acton Town'], by_name['Upminster'], by_name['Bank']
+
+  itineraries = pareto_routes(acton, bank)
+  assert len(itineraries) > 1 and isinstance(itineraries[0].instructions(), (tuple, list))
+  assert pareto_routes(acton, acton)[0].criteria == (0, 0.0, 0, 1)
+
+  stations = [station for station, routes in as13.st_routes.items() if routes]
+  queries = [(st_start, st_goal) for st_start in stations[::19] for st_goal in stations[::11]
+             if st_start != st_goal]
+  start_time = time.perf_counter()
+  results = [(pair, pareto_routes(*pair)) for pair in queries]
+  elapsed = time.perf_counter() - start_time
+  sizes = [len(itineraries) for _, itineraries in results]
+  print(f'{len(queries)} Pareto queries, {elapsed / len(queries) * 1e3:.2f}ms each, '
+        f'{sum(sizes) / len(sizes):.1f} itineraries on average, {max(sizes)} at most')
+
+  rail_network = as13.rail_network
+  for (st_start, st_goal), itineraries in results:
+    assert itineraries
+    for itinerary1, itinerary2 in itertools.permutations(itineraries, 2):
+      assert not _dominates(itinerary1.criteria, itinerary2.criteria)
+    for itinerary in itineraries:
+      route = list(itinerary.route)
+      assert route[0][0] == st_start and route[-1][0] == st_goal
+      assert rail_network.path_valid(route)
+      assert len(itinerary.legs()) == itinerary.transfers + 1
+      assert math.isclose(rail_network.path_length(route) or 0.0, itinerary.distance +
+                          as13.transfer_penalty * itinerary.transfers, abs_tol=1e-9)
+    # The best alternative is exactly as cheap as the single route found by route_stops()
+    best = top_routes(st_start, st_goal, k=1)[0]
+    assert math.isclose(rail_network.path_length(list(best.route)) or 0.0,
+                        rail_network.path_length(as13.route_stops(st_start, st_goal)) or 0.0,
+                        abs_tol=1e-9)
+    # Fewest transfers is no more than the line sequence gen_route_instr() would have chosen
+    assert itineraries[0].transfers <= min(
+      len(as13.route_between_lines(rl_start, rl_goal)) - 1
+      for rl_start in as13.st_routes[st_start] for rl_goal in as13.st_routes[st_goal]
+      if as13.route_between_lines(rl_start, rl_goal))
+
+  # Labels spanning as many zones part way may go on to span different numbers, so the fewest zone
+  # itinerary here survives only if labels are compared by the zones they reach and leave
+  heathrow = pareto_routes(by_name['Finchley Road'], by_name['Heathrow Terminal 4'])
+  assert min(itinerary.zones for itinerary in heathrow) == 5
+
+  alternatives = top_routes(acton, upminster, k=3)
+  assert 1 < len(alternatives) <= 3
+  assert top_routes(acton, upminster, k=2, key=lambda itinerary: itinerary.stops)[0].stops == \
+    min(itinerary.stops for itinerary in pareto_routes(acton, upminster))
+
+  as13.network.close_station(bank)
+  assert all(station != bank for itinerary in pareto_routes(acton, upminster)
+             for station, _ in itinerary.route)
+  assert pareto_routes(acton, bank) == []
+  as13.network.reopen_all()
+
+  print('All assertions passed!')
@@ -0,0 +1,118 @@
+"""
+Bounded LRU caching of route queries, in tiers mirroring the routing functions of as13
+
+Every entry is cached under a stamp, the version of the Graph it was derived from. Mutating that
+graph bumps its version, so entries cached beforehand are treated as misses and dropped on lookup.
+"""
+
+__author__ = 'https://github.com/Drullkus'
+
+import collections
+
+
+class LRUCache:
+  """
+  Mapping of at most maxsize entries, evicting the least recently used, while counting hits,
+  misses, evictions and invalidations (entries dropped for being stale)
+  """
+  def __init__(self, maxsize: int):
+    self.maxsize = maxsize
+    self._entries: collections.OrderedDict = collections.OrderedDict()
+    self.hits = self.misses = self.evictions = self.invalidations = 0
+
+  def __len__(self) -> int:
+    return len(self._entries)
+
+  def __contains__(self, key) -> bool:
+    return key in self._entries
+
+  def lookup(self, key, stamp, compute):
+    """
+    Returns the value cached for the key if it was cached under the same stamp, otherwise calls
+    compute() and caches its result under the stamp
+    """
+    entry = self._entries.get(key)
+    if entry is not None:
+      if entry[0] == stamp:
+        self.hits += 1
+        self._entries.move_to_end(key)
+        return entry[1]
+
+      del self._entries[key]
+      self.invalidations += 1
+
+    self.misses += 1
+    value = compute()
+    self._entries[key] = (stamp, value)
+    if len(self._entries) > self.maxsize:
+      self._entries.popitem(last=False)
+      self.evictions += 1
+    return value
+
+  def invalidate(self, predicate) -> int:
+    """
+    Drops every entry for which predicate(key, value) holds, returning how many were dropped
+    """
+    stale = [key for key, (_, value) in self._entries.items() if predicate(key, value)]
+    for key in stale:
+      del self._entries[key]
+    self.invalidations += len(stale)
+    return len(stale)
+
+  def restamp(self, old_stamp, new_stamp, predicate=None) -> None:
+    """
+    Carries entries cached under old_stamp over to new_stamp, for entries known to be unaffected by
+    whatever changed the stamp. Optionally only entries for which predicate(key) holds.
+    """
+    for key, (stamp, value) in self._entries.items():
+      if stamp == old_stamp and (predicate is None or predicate(key)):
+        self._entries[key] = (new_stamp, value)
+
+  def clear(self) -> None:
+    self.invalidations += len(self._entries)
+    self._entries.clear()
+
+  def stats(self) -> dict[str, int]:
+    return {'size': len(self._entries), 'maxsize': self.maxsize, 'hits': self.hits,
+            'misses': self.misses, 'evictions': self.evictions,
+            'invalidations': self.invalidations}
+
+
+class RouteCache:
+  """
+  Separate tiers for line-to-line paths across the rail supergraph, station paths along a single
+  line's subgraph, and whole itineraries across the rail network
+  """
+  def __init__(self, supergraph_size: int = 256, lines_size: int = 4096,
+               itineraries_size: int = 1024):
+    self.supergraph = LRUCache(supergraph_size)
+    self.lines = LRUCache(lines_size)
+    self.itineraries = LRUCache(itineraries_size)
+
+  def tiers(self) -> dict[str, LRUCache]:
+    return {'supergraph': self.supergraph, 'lines': self.lines, 'itineraries': self.itineraries}
+
+  def clear(self) -> None:
+    for tier in self.tiers().values():
+      tier.clear()
+
+  def stats(self) -> dict[str, dict[str, int]]:
+    return {name: tier.stats() for name, tier in self.tiers().items()}
+
+
+if __name__ == '__main__':
+  cache = LRUCache(2)
+  assert cache.lookup('a', 0, lambda: 1) == 1
+  assert cache.lookup('a', 0, lambda: 2) == 1  # Hit
+  assert cache.lookup('b', 0, lambda: 3) == 3
+  assert cache.lookup('a', 0, lambda: 4) == 1  # Refreshes 'a' as most recently used
+  assert cache.lookup('c', 0, lambda: 5) == 5  # Evicts 'b'
+  assert 'b' not in cache and 'a' in cache
+  assert cache.lookup('a', 1, lambda: 6) == 6  # Stale stamp
+  assert cache.stats() == {'size': 2, 'maxsize': 2, 'hits': 2, 'misses': 4, 'evictions': 1,
+                           'invalidations': 1}
+  cache.restamp(0, 1)
+  assert cache.lookup('c', 1, lambda: 7) == 5
+  assert cache.invalidate(lambda key, value: value == 6) == 1 and 'a' not in cache
+
+  print('All assertions passed!')
@@ -0,0 +1,282 @@
+#!/usr/bin/env python
+"""
+All-pairs route table for the Metro network
+
+Every journey from every station is searched once, ahead of time, across as13.rail_network.
+The resulting predecessor matrix is persisted to a compact binary file keyed by station id, so that
+serving a route query is only a walk back through the table, with no searching at all.
+"""
+
+__author__ = 'https://github.com/Drullkus'
+
+import array
+import functools
+import math
+import multiprocessing
+import os
+import struct
+import time
+
+import as13
+import batch
+from subway_lib import RailLine, Station
+
+_MAGIC = b'RTBL'
+_FORMAT_VERSION = 1
+# Magic, format version, dataset digest, transfer penalty, index typecode, vertex & station counts
+_HEADER = struct.Struct('<4sH32sdcII')
+
+
+def _index_typecode(vertex_count: int) -> str:
+  return 'h' if vertex_count < 2**15 else 'i'
+
+
+def _numbering() -> tuple[list[tuple[Station, RailLine]], list[Station]]:
+  """
+  Orders rail_network vertices and stations by id. Computed within each worker process, as
+  Station and RailLine instances hash by identity and so can't be sent across processes.
+  """
+  return _numbering_of(as13.network, as13.network.rail_network.version)
+
+
+@functools.lru_cache(maxsize=1)
+def _numbering_of(network: as13.MetroNetwork,
+                  version: int) -> tuple[list[tuple[Station, RailLine]], list[Station]]:
+  # Keyed on the graph version, as closures and reopenings remove and restore vertices
+  stops = sorted(network.rail_network.vertices(),
+                 key=lambda stop: (int(network.station_ids[stop[0]]),
+                                   int(network.line_ids[stop[1]])))
+  origins = sorted(network.id_stations.values(),
+                   key=lambda station: int(network.station_ids[station]))
+  return stops, origins
+
+
+class RouteTable:
+  """
+  Precomputed cheapest journeys between every pair of stations.
+
+  Vertices of as13.rail_network are numbered, then for each origin station the table records the
+  predecessor of every vertex in that origin's search tree, along with which vertex of each goal
+  station is reached most cheaply and at what cost. Index -1 marks an unreachable vertex.
+  Tagged with the as13.rail_network version it reflects, as closures outdate it.
+  """
+  def __init__(self, digest: bytes, penalty: float, stops: list[tuple[Station, RailLine]],
+               origins: list[Station], previous: array.array, exits: array.array,
+               costs: array.array):
+    self.digest = digest
+    self.penalty = penalty
+    self._stops = stops
+    self._origins = origins
+    self._origin_index = {station: idx for idx, station in enumerate(origins)}
+    self._previous = previous  # Row per origin, column per vertex
+    self._exits = exits  # Row per origin, column per goal station
+    self._costs = costs  # Row per origin, column per goal station
+    self.source_version = as13.network.rail_network.version
+
+  def _cell(self, st_start: Station, st_goal: Station) -> tuple[int, int]:
+    return self._origin_index[st_start], self._origin_index[st_goal]
+
+  def cost(self, st_start: Station, st_goal: Station) -> float | None:
+    """
+    Journey cost between two stations, or None if unreachable
+    """
+    origin, goal = self._cell(st_start, st_goal)
+    col = origin * len(self._origins) + goal
+    return self._costs[col] if self._exits[col] >= 0 else None
+
+  def stops(self, st_start: Station, st_goal: Station) -> list[tuple[Station, RailLine]]:
+    """
+    Same as as13.route_stops(), reconstructed from the table
+    """
+    origin, goal = self._cell(st_start, st_goal)
+    row = origin * len(self._stops)
+    path = []
+    vertex = self._exits[origin * len(self._origins) + goal]
+    while vertex >= 0:
+      path.append(self._stops[vertex])
+      vertex = self._previous[row + vertex]
+    return path[::-1]
+
+  @classmethod
+  def build(cls, workers: int | None = None) -> 'RouteTable':
+    """
+    Searches from every origin station across a process pool, each worker process sharing the
+    network loaded by as13
+    """
+    stops, origins = _numbering()
+    typecode = _index_typecode(len(stops))
+
+    previous, exits, costs = array.array(typecode), array.array(typecode), array.array('f')
+    if as13.network.closures and 'fork' not in multiprocessing.get_all_start_methods():
+      # Workers would load the network afresh, without its closures, so search here instead
+      rows = map(_search_origin, range(len(origins)))
+      executor = None
+    else:
+      executor = batch.fork_executor(workers)
+      rows = executor.map(_search_origin, range(len(origins)), chunksize=16)
+    try:
+      for row_previous, row_exits, row_costs in rows:
+        previous.frombytes(row_previous)
+        exits.frombytes(row_exits)
+        costs.frombytes(row_costs)
+    finally:
+      if executor is not None:
+        executor.shutdown(cancel_futures=True)
+
+    return cls(as13.network.digest, as13.network.transfer_penalty, stops, origins, previous, exits,
+               costs)
+
+  def save(self, file_path: str) -> bool:
+    """
+    Writes the table, returning False if it couldn't be written, as the table is only rebuilt
+    """
+    header = _HEADER.pack(_MAGIC, _FORMAT_VERSION, self.digest, self.penalty,
+                          self._previous.typecode.encode(), len(self._stops), len(self._origins))
+    ids = array.array('i')
+    for station, rail_line in self._stops:
+      ids.extend((int(as13.station_ids[station]), int(as13.line_ids[rail_line])))
+    ids.extend(int(as13.station_ids[station]) for station in self._origins)
+
+    try:
+      with as13.atomic_open(file_path) as table_file:
+        for chunk in (header, ids, self._previous, self._exits, self._costs):
+          table_file.write(chunk)
+    except OSError:
+      return False
+    return True
+
+  @classmethod
+  def load(cls, file_path: str) -> 'RouteTable | None':
+    """
+    Loads a saved table, or returns None if the file is missing, cut short or was built from
+    other data
+    """
+    if not os.path.exists(file_path):
+      return None
+
+    try:
+      with open(file_path, 'rb') as table_file:
+        data = table_file.read()
+    except OSError:
+      return None
+    if len(data) < _HEADER.size:
+      return None
+
+    magic, version, digest, penalty, typecode, vertex_count, origin_count = \
+      _HEADER.unpack_from(data)
+    if (magic, version, digest, penalty) != (_MAGIC, _FORMAT_VERSION, as13.network.digest,
+                                             as13.network.transfer_penalty):
+      return None  # Stale, the dataset files or transfer penalty have since changed
+    if typecode not in (b'h', b'i'):
+      return None
+
+    layout = (('i', vertex_count * 2 + origin_count),
+              (typecode.decode(), vertex_count * origin_count),
+              (typecode.decode(), origin_count * origin_count),
+              ('f', origin_count * origin_count))
+    if len(data) != _HEADER.size + sum(array.array(code).itemsize * count
+                                       for code, count in layout):
+      return None  # Torn, such as by a write cut short
+
+    arrays = []
+    offset = _HEADER.size
+    for typecode, count in layout:
+      chunk = array.array(typecode)
+      chunk.frombytes(data[offset:offset + count * chunk.itemsize])
+      offset += count * chunk.itemsize
+      arrays.append(chunk)
+    ids, previous, exits, costs = arrays
+
+    stops = [(as13.id_stations[str(st_id)], as13.id_lines[str(line_id)])
+             for st_id, line_id in zip(ids[0:vertex_count * 2:2], ids[1:vertex_count * 2:2])]
+    origins = [as13.id_stations[str(st_id)] for st_id in ids[vertex_count * 2:]]
+
+    return cls(digest, penalty, stops, origins, previous, exits, costs)
+
+  @classmethod
+  def load_or_build(cls, file_path: str, workers: int | None = None) -> 'RouteTable':
+    if table := cls.load(file_path):
+      return table
+
+    table = cls.build(workers)
+    table.save(file_path)
+    return table
+
+
+def _search_origin(origin_index: int) -> tuple[bytes, bytes, bytes]:
+  """
+  Process pool task: one origin's row of the table, as raw array bytes
+  """
+  stops, goals = _numbering()
+  origin = goals[origin_index]
+  typecode = _index_typecode(len(stops))
+  stop_index = {stop: idx for idx, stop in enumerate(stops)}
+  costs, previous = as13.network.rail_router.search_tree((origin, rail_line)
+                                                         for rail_line in as13.st_routes[origin])
+
+  row_previous = array.array(typecode, [-1]) * len(stops)
+  for stop, prior in previous.items():
+    if prior is not None:
+      row_previous[stop_index[stop]] = stop_index[prior]
+
+  row_exits, row_costs = array.array(typecode), array.array('f')
+  for goal in goals:
+    reached = [(costs[stop], stop) for stop in ((goal, rl) for rl in as13.st_routes[goal])
+               if stop in costs]
+    exit_cost, exit_stop = min(reached, key=lambda reach: reach[0], default=(0.0, None))
+    row_exits.append(stop_index[exit_stop] if exit_stop is not None else -1)
+    row_costs.append(exit_cost)
+
+  return row_previous.tobytes(), row_exits.tobytes(), row_costs.tobytes()
+
+
+if __name__ == '__main__':
+  import tempfile
+
+  table_path = f'{as13.network.path}route_table.bin'
+  start_time = time.perf_counter()
+  route_table = RouteTable.build()
+  route_table.save(table_path)
+  print(f'Built route table in {time.perf_counter() - start_time:.2f}s '
+        f'({os.path.getsize(table_path)} bytes)')
+
+  loaded = RouteTable.load(table_path)
+  assert loaded is not None
+  assert not any(name.endswith('.tmp') for name in os.listdir(as13.network.path))  # Saved whole
+  stations = list(as13.id_stations.values())
+  for st_start in stations[::17]:
+    for st_goal in stations[::5]:
+      stops = loaded.stops(st_start, st_goal)
+      assert stops[0][0] == st_start and stops[-1][0] == st_goal
+      expected_cost = as13.rail_network.path_length(as13.route_stops(st_start, st_goal)) or 0.0
+      assert abs((as13.rail_network.path_length(stops) or 0.0) - expected_cost) < 1e-9
+      assert math.isclose(loaded.cost(st_start, st_goal), expected_cost, rel_tol=1e-6)  # float32
+
+  # Torn files are rebuilt rather than loaded, and unwritable paths are no error
+  with open(table_path, 'rb') as table_file:
+    content = table_file.read()
+  with tempfile.TemporaryDirectory() as temp_dir:
+    for size in (0, _HEADER.size - 1, _HEADER.size, len(content) // 2, len(content) - 1):
+      with open(f'{temp_dir}/route_table.bin', 'wb') as torn:
+        torn.write(content[:size])
+      assert RouteTable.load(f'{temp_dir}/route_table.bin') is None
+    assert not loaded.save(f'{temp_dir}/missing/route_table.bin')
+
+  as13.precomputed_routes = loaded
+  assert as13.current_route_table() is loaded
+  as13.network.close_station(stations[0])
+  assert as13.current_route_table() is None  # Outdated by the closure
+  as13.network.reopen_all()
+  as13.precomputed_routes = None
+
+  # Tables built during a closure and after reopening each number the vertices present then
+  bank = next(station for station in stations if station.name == 'Bank')
+  as13.network.close_station(bank)
+  closed = RouteTable.build(workers=2)
+  assert closed.stops(stations[0], bank) == [] and closed.cost(stations[0], bank) is None
+  as13.network.reopen_all()
+  reopened = RouteTable.build(workers=2)
+  assert reopened.stops(stations[0], bank) == loaded.stops(stations[0], bank)
+  assert len(reopened._stops) == len(as13.rail_network) > len(closed._stops)
+
+  print('All assertions passed!')
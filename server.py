@@ -0,0 +1,277 @@
+#!/usr/bin/env python
+"""
+Local HTTP/JSON routing service over the as13 engine
+
+The network is loaded once at startup, then every search runs in a pool of worker processes
+forked from it, keeping the asyncio event loop free to accept and answer other requests meanwhile.
+Identical queries arriving while one is already being searched wait on that same search rather
+than starting another.
+
+Endpoints, all answering JSON:
+  GET  /stations                  Every station, with the ids of the lines serving it
+  GET  /lines                     Every line
+  GET  /route?from=ID&to=ID       Cheapest itinerary between two station ids
+  POST /routes {"pairs": [[from, to], ...]}  Itineraries of many pairs, in the order given
+"""
+
+__author__ = 'https://github.com/Drullkus'
+
+import argparse
+import asyncio
+import json
+import urllib.parse
+from http import HTTPStatus
+
+import as13
+import batch
+
+max_body = 1 << 20  # Bytes accepted per request body
+max_batch = 10000  # Pairs accepted per batch request
+
+
+class HTTPError(Exception):
+  def __init__(self, status: HTTPStatus, message: str):
+    super().__init__(message)
+    self.status = status
+
+
+def _route_pairs(pairs: list[tuple[str, str]]) -> list[batch.RouteResult]:
+  """
+  Worker pool task, routing within the worker process itself
+  """
+  return list(batch.route_batch(pairs, workers=0))
+
+
+class RoutingService:
+  """
+  Request handling, independent of the connection serving it
+  """
+  def __init__(self, workers: int | None = None):
+    self.executor = batch.fork_executor(workers)
+    self.in_flight: dict[tuple, asyncio.Future] = {}
+    self.searches = self.coalesced = 0
+
+    id_stations, line_ids = as13.id_stations, as13.line_ids
+    self._stations = [{'id': st_id, 'name': station.name, 'display_name': station.display_name,
+                       'zone': station.zone, 'coords': station.geo_coords,
+                       'lines': sorted(map(line_ids.__getitem__, as13.st_routes[station]), key=int)}
+                      for st_id, station in id_stations.items()]
+    self._lines = [{'id': line_id, 'name': rail_line.name, 'color': rail_line.color,
+                    'stripe': rail_line.stripe} for line_id, rail_line in as13.id_lines.items()]
+
+  def close(self) -> None:
+    self.executor.shutdown(cancel_futures=True)
+
+  async def _search(self, pairs: tuple[tuple[str, str], ...]) -> list[batch.RouteResult]:
+    """
+    Routes the pairs in the worker pool, sharing one search between identical concurrent queries
+    """
+    if future := self.in_flight.get(pairs):
+      self.coalesced += 1
+      return await asyncio.shield(future)
+
+    future = asyncio.get_running_loop().run_in_executor(self.executor, _route_pairs, list(pairs))
+    self.in_flight[pairs] = future
+    self.searches += 1
+    try:
+      return await asyncio.shield(future)
+    finally:
+      if self.in_flight.get(pairs) is future:
+        del self.in_flight[pairs]
+
+  @staticmethod
+  def _station_id(text) -> str:
+    if not isinstance(text, str) or text not in as13.id_stations:
+      raise HTTPError(HTTPStatus.NOT_FOUND, f'Unknown station {text!r}')
+    return text
+
+  @staticmethod
+  def _content_length(headers: dict[str, str]) -> int:
+    text = headers.get('content-length', '0')
+    if not (text.isascii() and text.isdigit()):
+      raise HTTPError(HTTPStatus.BAD_REQUEST, f'Invalid Content-Length {text!r}')
+    if int(text) > max_body:
+      raise HTTPError(HTTPStatus.REQUEST_ENTITY_TOO_LARGE, f'At most {max_body} bytes')
+    return int(text)
+
+  @staticmethod
+  def _route_json(result: batch.RouteResult) -> dict:
+    id_stations, id_lines = as13.id_stations, as13.id_lines
+    return {'from': result.start, 'to': result.goal, 'reachable': bool(result.legs),
+            'cost': result.cost, 'transfers': result.transfers, 'stops': result.stops,
+            'legs': [{'line': {'id': line_id, 'name': id_lines[line_id].name},
+                      'stations': [{'id': st_id, 'name': id_stations[st_id].name}
+                                   for st_id in st_ids]}
+                     for line_id, st_ids in result.legs]}
+
+  async def handle(self, method: str, target: str, body: bytes) -> dict | list:
+    url = urllib.parse.urlsplit(target)
+    query = dict(urllib.parse.parse_qsl(url.query))
+    endpoint = (method, url.path.rstrip('/') or '/')
+
+    if endpoint == ('GET', '/stations'):
+      return self._stations
+    if endpoint == ('GET', '/lines'):
+      return self._lines
+    if endpoint == ('GET', '/route'):
+      if 'from' not in query or 'to' not in query:
+        raise HTTPError(HTTPStatus.BAD_REQUEST, 'Both from and to station ids are required')
+      pair = self._station_id(query['from']), self._station_id(query['to'])
+      return self._route_json((await self._search((pair,)))[0])
+    if endpoint == ('POST', '/routes'):
+      try:
+        pairs = tuple((self._station_id(start), self._station_id(goal))
+                      for start, goal in json.loads(body)['pairs'])
+      except (ValueError, KeyError, TypeError):
+        raise HTTPError(HTTPStatus.BAD_REQUEST, 'Expected {"pairs": [[from, to], ...]}')
+      if len(pairs) > max_batch:
+        raise HTTPError(HTTPStatus.REQUEST_ENTITY_TOO_LARGE, f'At most {max_batch} pairs')
+      return list(map(self._route_json, await self._search(pairs))) if pairs else []
+
+    if url.path.rstrip('/') in ('/stations', '/lines', '/route', '/routes'):
+      raise HTTPError(HTTPStatus.METHOD_NOT_ALLOWED, f'{method} not allowed on {url.path}')
+    raise HTTPError(HTTPStatus.NOT_FOUND, f'No endpoint at {url.path}')
+
+  async def serve_connection(self, reader: asyncio.StreamReader,
+                             writer: asyncio.StreamWriter) -> None:
+    """
+    Answers each HTTP/1.1 request of one connection in turn, for as long as it is kept alive
+    """
+    try:
+      while request_line := await reader.readline():
+        method, target, version = request_line.decode('latin-1').split()
+        headers = {}
+        while (line := await reader.readline()) not in (b'\r\n', b'\n', b''):
+          name, _, value = line.decode('latin-1').partition(':')
+          headers[name.strip().lower()] = value.strip()
+
+        body = None  # Left unread when the request is refused before it, closing the connection
+        try:
+          body = await reader.readexactly(self._content_length(headers))
+          status, payload = HTTPStatus.OK, await self.handle(method, target, body)
+        except HTTPError as error:
+          status, payload = error.status, {'error': str(error)}
+        except (ConnectionError, asyncio.IncompleteReadError):
+          raise
+        except Exception as error:  # Such as a worker process dying mid-search
+          status, payload = HTTPStatus.INTERNAL_SERVER_ERROR, \
+            {'error': f'Internal error: {type(error).__name__}'}
+
+        keep_alive = headers.get('connection', '').lower() != 'close' and \
+          version == 'HTTP/1.1' and body is not None
+        content = json.dumps(payload).encode()
+        writer.write(f'HTTP/1.1 {status.value} {status.phrase}\r\n'
+                     f'Content-Type: application/json\r\nContent-Length: {len(content)}\r\n'
+                     f'Connection: {"keep-alive" if keep_alive else "close"}\r\n\r\n'.encode()
+                     + content)
+        await writer.drain()
+        if not keep_alive:
+          break
+    except (ConnectionError, asyncio.IncompleteReadError, ValueError):
+      pass  # Client went away, or sent something other than HTTP
+    finally:
+      writer.close()
+
+
+async def serve(host: str = '127.0.0.1', port: int = 8013, workers: int | None = None,
+                ready: asyncio.Future | None = None) -> None:
+  """
+  Runs the service until cancelled, setting ready to the RoutingService and bound port once
+  listening
+  """
+  service = RoutingService(workers)
+  server = await asyncio.start_server(service.serve_connection, host, port)
+  try:
+    if ready is not None:
+      ready.set_result((service, server.sockets[0].getsockname()[1]))
+    async with server:
+      await server.serve_forever()
+  finally:
+    service.close()
+
+
+if __name__ == '__main__':
+  parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+  parser.add_argument('--host', default='127.0.0.1')
+  parser.add_argument('--port', type=int, default=8013)
+  parser.add_argument('--workers', type=int, help='Search processes, defaulting to one per CPU')
+  parser.add_argument('--self-test', action='store_true',
+                      help='Serve on a free port, check every endpoint, then exit')
+  args = parser.parse_args()
+
+  if not args.self_test:
+    print(f'Serving on http://{args.host}:{args.port}')
+    try:
+      asyncio.run(serve(args.host, args.port, args.workers))
+    except KeyboardInterrupt:
+      pass
+    raise SystemExit
+
+  from concurrent.futures.process import BrokenProcessPool
+
+  import loadtest
+
+  async def self_test() -> None:
+    ready = asyncio.get_running_loop().create_future()
+    server_task = asyncio.create_task(serve(port=0, workers=2, ready=ready))
+    service, port = await ready
+    client = loadtest.Client('127.0.0.1', port)
+
+    status, stations = await client.request('GET', '/stations')
+    assert status == 200 and len(stations) == len(as13.id_stations)
+    status, lines = await client.request('GET', '/lines')
+    assert status == 200 and {line['id'] for line in lines} == set(as13.id_lines)
+
+    by_name = {station['name']: station['id'] for station in stations}
+    acton, bank = by_name['Acton Town'], by_name['Bank']
+    status, route = await client.request('GET', f'/route?from={acton}&to={bank}')
+    assert status == 200 and route['reachable']
+    assert route['legs'][0]['stations'][0]['id'] == acton
+    assert route['legs'][-1]['stations'][-1]['name'] == 'Bank'
+    expected = as13.rail_network.path_length(as13.route_stops(as13.id_stations[acton],
+                                                              as13.id_stations[bank]))
+    assert abs(route['cost'] - expected) < 1e-9 and route['transfers'] == len(route['legs']) - 1
+
+    pairs = [[acton, bank], [bank, acton], [acton, acton]]
+    status, routes = await client.request('POST', '/routes', {'pairs': pairs})
+    assert status == 200 and [[route['from'], route['to']] for route in routes] == pairs
+    assert routes[0]['cost'] == route['cost'] and routes[2]['stops'] == 0
+
+    assert (await client.request('GET', '/route?from=0&to=1'))[0] == 404
+    assert (await client.request('GET', f'/route?from={acton}'))[0] == 400
+    assert (await client.request('POST', '/routes', {'pairs': 'all'}))[0] == 400
+    assert (await client.request('POST', '/route'))[0] == 405
+    assert (await client.request('GET', '/nowhere'))[0] == 404
+
+    # Malformed headers are refused, closing the connection as the body can't be delimited
+    raw_reader, raw_writer = await asyncio.open_connection('127.0.0.1', port)
+    raw_writer.write(b'POST /routes HTTP/1.1\r\nContent-Length: abc\r\n\r\n')
+    response = await raw_reader.read()
+    assert response.startswith(b'HTTP/1.1 400 ') and b'Connection: close' in response
+    raw_writer.close()
+
+    # Failed searches answer an error rather than dropping the connection
+    async def broken_search(pairs):
+      raise BrokenProcessPool('A worker process died')
+    service._search = broken_search
+    status, error = await client.request('GET', f'/route?from={acton}&to={bank}')
+    assert status == 500 and error == {'error': 'Internal error: BrokenProcessPool'}
+    del service._search
+    assert (await client.request('GET', f'/route?from={acton}&to={bank}'))[0] == 200
+
+    # Identical queries in flight together share one search
+    searches = service.searches
+    upminster = by_name['Upminster']
+    clients = [loadtest.Client('127.0.0.1', port) for _ in range(8)]
+    answers = await asyncio.gather(*(other.request('GET', f'/route?from={acton}&to={upminster}')
+                                     for other in clients))
+    assert all(answer == answers[0] for answer in answers)
+    assert service.searches == searches + 1 and service.coalesced >= len(clients) - 1
+
+    for other in (client, *clients):
+      await other.close()
+    server_task.cancel()
+    await asyncio.gather(server_task, return_exceptions=True)
+
+  asyncio.run(self_test())
+  print('All assertions passed!')
@@ -0,0 +1,180 @@
+#!/usr/bin/env python
+"""
+Spatial index over station coordinates
+
+Stations are bucketed into a uniform grid of roughly square cells, so that nearest-station, radius
+and bounding-box queries only inspect the few cells around the query instead of every station.
+Coordinates follow Station.geo_coords, as (longitude, latitude) in degrees.
+"""
+
+__author__ = 'https://github.com/Drullkus'
+
+import heapq
+import itertools
+import math
+from typing import Iterable
+
+from subway_lib import Station
+
+EARTH_RADIUS_KM = 6371.0088  # Mean radius
+KM_PER_DEGREE = EARTH_RADIUS_KM * math.pi / 180
+
+
+def haversine(coords1: tuple[float, float], coords2: tuple[float, float]) -> float:
+  """
+  Great-circle distance in kilometres between two (longitude, latitude) coordinates
+  """
+  lon1, lat1, lon2, lat2 = map(math.radians, (*coords1, *coords2))
+  hav = math.sin((lat2 - lat1) / 2)**2 + \
+    math.cos(lat1) * math.cos(lat2) * math.sin((lon2 - lon1) / 2)**2
+  return 2 * EARTH_RADIUS_KM * math.asin(min(1.0, math.sqrt(hav)))
+
+
+def equirectangular(coords1: tuple[float, float], coords2: tuple[float, float]) -> float:
+  """
+  Cheaper approximation of haversine() in kilometres, accurate over city-sized distances
+  """
+  mid_lat = math.radians((coords1[1] + coords2[1]) / 2)
+  return KM_PER_DEGREE * math.hypot((coords2[0] - coords1[0]) * math.cos(mid_lat),
+                                    coords2[1] - coords1[1])
+
+
+class StationIndex:
+  """
+  Uniform grid of stations, with cells cell_km tall and about as wide at the stations' mean latitude
+  """
+  def __init__(self, stations: Iterable[Station], cell_km: float = 1.0):
+    self._stations = list(stations)
+    if not self._stations:
+      raise ValueError('StationIndex requires at least one station')
+
+    lons, lats = zip(*map(Station.coords, self._stations))
+    self.bounds = min(lons), min(lats), max(lons), max(lats)  # Matches within_bbox() arguments
+    mean_lat = math.radians(sum(lats) / len(lats))
+    self._lat_step = cell_km / KM_PER_DEGREE
+    self._lon_step = self._lat_step / math.cos(mean_lat)
+    self._max_abs_lat = max(map(abs, lats))
+
+    self._cells: dict[tuple[int, int], list[Station]] = {}
+    for station in self._stations:
+      self._cells.setdefault(self._cell(station.geo_coords), []).append(station)
+    cols, rows = zip(*self._cells)
+    self._cell_bounds = min(cols), min(rows), max(cols), max(rows)
+
+  def __len__(self) -> int:
+    return len(self._stations)
+
+  def _cell(self, coords: tuple[float, float]) -> tuple[int, int]:
+    return math.floor(coords[0] / self._lon_step), math.floor(coords[1] / self._lat_step)
+
+  def _cells_between(self, low: tuple[int, int], high: tuple[int, int]) -> Iterable[list[Station]]:
+    min_col, min_row, max_col, max_row = self._cell_bounds
+    cols = range(max(low[0], min_col), min(high[0], max_col) + 1)
+    rows = range(max(low[1], min_row), min(high[1], max_row) + 1)
+    if len(cols) * len(rows) > len(self._cells):  # Sparser to scan the occupied cells instead
+      return (stations for (col, row), stations in self._cells.items()
+              if col in cols and row in rows)
+    return (self._cells[cell] for cell in itertools.product(cols, rows) if cell in self._cells)
+
+  def within_bbox(self, min_lon: float, min_lat: float, max_lon: float,
+                  max_lat: float) -> list[Station]:
+    """
+    Every station within the bounding box, edges inclusive
+    """
+    return [station for stations in self._cells_between(self._cell((min_lon, min_lat)),
+                                                        self._cell((max_lon, max_lat)))
+            for station in stations
+            if min_lon <= station.geo_coords[0] <= max_lon and
+            min_lat <= station.geo_coords[1] <= max_lat]
+
+  def within_radius(self, coords: tuple[float, float],
+                    radius_km: float) -> list[tuple[float, Station]]:
+    """
+    Every station within radius_km of the coordinates, as (distance, station) nearest first
+    """
+    lat_reach = radius_km / KM_PER_DEGREE
+    # Widest longitude span of the circle, at whichever of its edges is nearer a pole
+    widest_lat = math.radians(min(abs(coords[1]) + lat_reach, 89.9))
+    lon_reach = lat_reach / math.cos(widest_lat)
+
+    low = self._cell((coords[0] - lon_reach, coords[1] - lat_reach))
+    high = self._cell((coords[0] + lon_reach, coords[1] + lat_reach))
+    found = [(dist, station) for stations in self._cells_between(low, high)
+             for station in stations
+             if (dist := haversine(coords, station.geo_coords)) <= radius_km]
+    found.sort(key=lambda found_station: found_station[0])
+    return found
+
+  def _ring_clearance(self, ring: int, query_lat: float) -> float:
+    """
+    Lower bound in kilometres on the distance to any station beyond the given ring of cells around
+    the query's cell, as such a station lies at least that many whole cells away on either axis
+    """
+    lat_bound = ring * self._lat_step * KM_PER_DEGREE
+    # Haversine distance is at least this for a longitude difference, at the most extreme latitude
+    cos_lat = math.cos(math.radians(min(max(self._max_abs_lat, abs(query_lat)), 89.9)))
+    half_lon = min(math.radians(ring * self._lon_step) / 2, math.pi / 2)
+    lon_bound = 2 * EARTH_RADIUS_KM * math.asin(cos_lat * math.sin(half_lon))
+    return min(lat_bound, lon_bound)
+
+  def nearest(self, coords: tuple[float, float], k: int = 1) -> list[tuple[float, Station]]:
+    """
+    The k stations nearest to the coordinates, as (distance, station) nearest first.
+    Searches outwards ring by ring of grid cells, stopping once no farther ring could do better.
+    """
+    k = min(k, len(self._stations))
+    center_col, center_row = self._cell(coords)
+    min_col, min_row, max_col, max_row = self._cell_bounds
+    max_ring = max(abs(center_col - min_col), abs(center_col - max_col),
+                   abs(center_row - min_row), abs(center_row - max_row))
+
+    best: list[tuple[float, int, Station]] = []  # Max-heap of the k nearest, by negated distance
+    tie = itertools.count()
+    for ring in range(max_ring + 1):
+      # Stations of this ring or beyond lie at least one ring fewer whole cells away
+      if ring and len(best) == k and -best[0][0] <= self._ring_clearance(ring - 1, coords[1]):
+        break
+
+      ring_cells = itertools.chain(
+        ((col, row) for col in range(center_col - ring, center_col + ring + 1)
+         for row in (center_row - ring, center_row + ring)),
+        ((col, row) for col in (center_col - ring, center_col + ring)
+         for row in range(center_row - ring + 1, center_row + ring))
+      ) if ring else ((center_col, center_row),)
+
+      for cell in set(ring_cells):
+        for station in self._cells.get(cell, ()):
+          entry = (-haversine(coords, station.geo_coords), next(tie), station)
+          if len(best) < k:
+            heapq.heappush(best, entry)
+          elif entry > best[0]:
+            heapq.heapreplace(best, entry)
+
+    return [(-neg_dist, station) for neg_dist, _, station in sorted(best, reverse=True)]
+
+
+if __name__ == '__main__':
+  import as13
+
+  stations = list(as13.id_stations.values())
+  index = as13.network.station_index
+  assert len(index) == len(stations)
+
+  by_name = {station.name: station for station in stations}
+  bank, monument = by_name['Bank'], by_name['Monument']
+  assert 0.3 < haversine(bank.geo_coords, monument.geo_coords) < 0.35
+  assert abs(equirectangular(bank.geo_coords, monument.geo_coords) -
+             haversine(bank.geo_coords, monument.geo_coords)) < 1e-3
+
+  for query in [station.geo_coords for station in stations[::11]] + [(-0.1, 51.5), (0.5, 52.0)]:
+    brute = sorted((haversine(query, station.geo_coords), station.name) for station in stations)
+    assert [(dist, station.name) for dist, station in index.nearest(query, 5)] == brute[:5]
+    assert [station.name for _, station in index.within_radius(query, 2.5)] == \
+      [name for dist, name in brute if dist <= 2.5]
+
+  central = {station for station in stations
+           if -0.2 <= station.geo_coords[0] <= -0.1 and 51.5 <= station.geo_coords[1] <= 51.52}
+  assert set(index.within_bbox(-0.2, 51.5, -0.1, 51.52)) == central
+  assert index.bounds == (as13.min_lon, as13.min_lat, as13.max_lon, as13.max_lat)
+
+  print('All assertions passed!')
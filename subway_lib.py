@@ -5,41 +5,113 @@ These are used in place of tuples
 
 __author__ = 'Drullkus'
 
+import array
 
-class RailLine:
+
+_set = object.__setattr__  # Bypasses the records' own __setattr__, refusing all assignments
+
+
+def _restore(cls, values):
+  record = object.__new__(cls)
+  for name, value in zip(cls.__slots__, values):
+    _set(record, name, value)
+  return record
+
+
+class _Record:
+  """
+  Immutable record without a per-instance __dict__. Hashed and compared by identity, which dict
+  and set lookups throughout routing resolve in C, so copies from a snapshot or another process
+  are distinct from the originals and must be matched up by id.
+  """
+  __slots__ = ()
+
+  def __setattr__(self, name, value):
+    raise AttributeError(f'{type(self).__name__} is immutable')
+
+  def __delattr__(self, name):
+    raise AttributeError(f'{type(self).__name__} is immutable')
+
+  def __reduce__(self):
+    return _restore, (type(self), self.astuple())
+
+  def astuple(self) -> tuple:
+    return tuple(getattr(self, name) for name in self.__slots__)
+
+
+class RailLine(_Record):
   """
   Represents an entire line in which contains multiple stations
 
-  Follows CSV format "name","colour","stripe"
+  Follows CSV format "line","name","colour","stripe"
   """
-  def __init__(self, name, color, stripe):
-    self.name = name
-    self.color = color
-    self.stripe = stripe
+  __slots__ = ('id', 'name', 'color', 'stripe')
+
+  def __init__(self, line_id, name, color, stripe):
+    _set(self, 'id', int(line_id))
+    _set(self, 'name', name)
+    _set(self, 'color', color)
+    _set(self, 'stripe', stripe)
 
   def __repr__(self) -> str:
-    return f'RailLine({self.name}, {self.color}, {self.stripe})'
+    return f'RailLine({self.id}, {self.name}, {self.color}, {self.stripe})'
 
   def __str__(self) -> str:
     return self.name
 
-class Station:
+class Station(_Record):
   """
   Represents a station and some additional relevant info
 
-  Follows CSV format "latitude","longitude","name","display_name","zone","total_lines","rail"
+  Follows CSV format "id","latitude","longitude","name","display_name","zone","total_lines","rail"
   """
-  def __init__(self, latitude, longitude, name, display_name, zone, total_lines, rail):
-    self.geo_coords = float(longitude), float(latitude)  # Swizzle coordinate components to better match x,y usage
-    self.name = name
-    self.display_name = name if display_name == 'NULL' else '\n'.join(display_name.split('<br />'))
-    self.zone = zone
-    self.total_lines = total_lines
-    self.rail = rail
+  __slots__ = ('id', 'geo_coords', 'name', 'display_name', 'zone', 'total_lines', 'rail')
+
+  def __init__(self, st_id, latitude, longitude, name, display_name, zone, total_lines, rail):
+    _set(self, 'id', int(st_id))
+    # Swizzle coordinate components to better match x,y usage
+    _set(self, 'geo_coords', (float(longitude), float(latitude)))
+    _set(self, 'name', name)
+    _set(self, 'display_name',
+         name if display_name == 'NULL' else '\n'.join(display_name.split('<br />')))
+    _set(self, 'zone', zone)
+    _set(self, 'total_lines', total_lines)
+    _set(self, 'rail', rail)
 
   def __repr__(self) -> str:
-    return f'''Station({self.geo_coords[0]}, {self.geo_coords[1]}, {self.name}, {self.display_name},
-    {self.zone}, {self.total_lines}, {self.rail})'''
-  
+    return f'''Station({self.id}, {self.geo_coords[0]}, {self.geo_coords[1]}, {self.name},
+    {self.display_name}, {self.zone}, {self.total_lines}, {self.rail})'''
+
   def coords(self) -> tuple[float, float]:
     return self.geo_coords
+
+class StationTable:
+  """
+  Struct-of-arrays copy of many stations, holding each numeric field as one array indexed by row.
+  Every array exposes the buffer protocol, so can be handed to vectorised code without copying.
+  """
+  def __init__(self, stations, ids=None, longitudes=None, latitudes=None, zones=None,
+               total_lines=None):
+    """
+    Builds each array from the stations, unless given as any sequences already in the same order
+    """
+    self.stations: list[Station] = list(stations)
+    self.rows: dict[Station, int] = {station: row for row, station in enumerate(self.stations)}
+    self.ids = ids if ids is not None else array.array('i', (st.id for st in self.stations))
+    self.longitudes = longitudes if longitudes is not None else \
+      array.array('d', (st.geo_coords[0] for st in self.stations))
+    self.latitudes = latitudes if latitudes is not None else \
+      array.array('d', (st.geo_coords[1] for st in self.stations))
+    self.zones = zones if zones is not None else \
+      array.array('f', (float(st.zone) for st in self.stations))
+    self.total_lines = total_lines if total_lines is not None else \
+      array.array('h', (int(st.total_lines) for st in self.stations))
+
+  def __len__(self) -> int:
+    return len(self.stations)
+
+  def __getitem__(self, row: int) -> Station:
+    return self.stations[row]
+
+  def coords(self, row: int) -> tuple[float, float]:
+    return self.longitudes[row], self.latitudes[row]
@@ -0,0 +1,109 @@
+#!/usr/bin/env python
+"""
+Generator of synthetic Metro networks, written in the same CSV schema as the datasets directory
+
+Each line runs along a straight corridor between two random points of the map, with its own
+stations scattered along it. A share of stations, the interchange density, are then also served by
+whichever other line's corridor passes nearest, so that lines cross where they meet.
+"""
+
+__author__ = 'https://github.com/Drullkus'
+
+import argparse
+import csv
+import math
+import os
+import random
+
+from spatial import haversine
+
+# Same extent as the London datasets, as (min_lon, min_lat, max_lon, max_lat)
+bounds = (-0.611, 51.4022, 0.251, 51.7052)
+
+
+def _corridor_offset(corridor, coords: tuple[float, float]) -> tuple[float, float]:
+  """
+  Position along a corridor as a fraction of its length, and distance away from it, in degrees
+  """
+  (lon1, lat1), (lon2, lat2) = corridor
+  d_lon, d_lat = lon2 - lon1, lat2 - lat1
+  along = ((coords[0] - lon1) * d_lon + (coords[1] - lat1) * d_lat) / (d_lon**2 + d_lat**2)
+  nearest = lon1 + along * d_lon, lat1 + along * d_lat
+  return along, math.dist(coords, nearest)
+
+
+def _write_csv(file_path: str, header: tuple[str, ...], rows) -> None:
+  with open(file_path, 'w', newline='') as csv_file:
+    writer = csv.writer(csv_file, quoting=csv.QUOTE_NONNUMERIC)
+    writer.writerow(header)
+    writer.writerows(rows)
+
+
+def generate(directory: str, lines: int = 13, stations: int = 308,
+             interchange_density: float = 0.25, seed: int = 0) -> None:
+  """
+  Writes lines.csv, stations.csv and routes.csv of a random network into the directory.
+
+  interchange_density: Share of stations additionally served by a second line, between 0 and 1.
+  """
+  if lines < 1:
+    raise ValueError('At least one line is needed')
+  if stations < lines * 2:
+    raise ValueError('Every line needs at least two stations')
+
+  rng = random.Random(seed)
+  min_lon, min_lat, max_lon, max_lat = bounds
+
+  def random_point() -> tuple[float, float]:
+    return rng.uniform(min_lon, max_lon), rng.uniform(min_lat, max_lat)
+
+  corridors = [(random_point(), random_point()) for _ in range(lines)]
+
+  coords: list[tuple[float, float]] = []
+  members: list[set[int]] = [set() for _ in range(lines)]
+  for line in range(lines):
+    (lon1, lat1), (lon2, lat2) = corridors[line]
+    for _ in range(stations // lines + (line < stations % lines)):
+      along, jitter = rng.random(), 0.004
+      members[line].add(len(coords))
+      coords.append((lon1 + along * (lon2 - lon1) + rng.gauss(0, jitter),
+                     lat1 + along * (lat2 - lat1) + rng.gauss(0, jitter)))
+
+  for station, station_coords in enumerate(coords):
+    if rng.random() < interchange_density:
+      others = [line for line in range(lines) if station not in members[line]]
+      if not others:
+        continue  # A single line has no other to interchange with
+      nearest = min(others, key=lambda line: _corridor_offset(corridors[line], station_coords)[1])
+      members[nearest].add(station)
+
+  center = ((min_lon + max_lon) / 2, (min_lat + max_lat) / 2)
+  served = [sum(station in line_members for line_members in members) for station in range(stations)]
+  os.makedirs(directory, exist_ok=True)
+  _write_csv(os.path.join(directory, 'lines.csv'), ('line', 'name', 'colour', 'stripe'),
+             ((line + 1, f'Synthetic Line {line + 1}', f'{rng.randrange(0x1000000):06x}', 'NULL')
+              for line in range(lines)))
+  _write_csv(os.path.join(directory, 'stations.csv'),
+             ('id', 'latitude', 'longitude', 'name', 'display_name', 'zone', 'total_lines', 'rail'),
+             ((station + 1, round(lat, 4), round(lon, 4), f'Synthetic {station + 1}', 'NULL',
+               1 + int(haversine(center, (lon, lat)) // 5), served[station], 0)
+              for station, (lon, lat) in enumerate(coords)))
+
+  routes = []
+  for line, line_members in enumerate(members):
+    # Stations in order along the corridor, each adjacent pair joined by track
+    ordered = sorted(line_members, key=lambda st: _corridor_offset(corridors[line], coords[st])[0])
+    routes.extend((station1 + 1, station2 + 1, line + 1)
+                  for station1, station2 in zip(ordered, ordered[1:]))
+  _write_csv(os.path.join(directory, 'routes.csv'), ('station1', 'station2', 'line'), routes)
+
+
+if __name__ == '__main__':
+  parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+  parser.add_argument('directory')
+  parser.add_argument('--lines', type=int, default=13)
+  parser.add_argument('--stations', type=int, default=308)
+  parser.add_argument('--interchange-density', type=float, default=0.25)
+  parser.add_argument('--seed', type=int, default=0)
+  args = parser.parse_args()
+  generate(args.directory, args.lines, args.stations, args.interchange_density, args.seed)
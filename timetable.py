@@ -0,0 +1,411 @@
+#!/usr/bin/env python
+"""
+Time-dependent journey planning over a timetable, by the Connection Scan Algorithm (CSA)
+
+The timetable is read from an optional timetable.csv beside routes.csv, listing every trip's calls
+in order, or otherwise synthesized from the line subgraphs at a fixed headway and running speed.
+Each trip is split into elementary connections, one per hop between consecutive calls, which are
+kept sorted by departure time in flat arrays. Queries are then a single linear scan over a window
+of those arrays, with no priority queue at all.
+
+Times are whole seconds since midnight of the service day, and may run past 24:00:00.
+"""
+
+__author__ = 'https://github.com/Drullkus'
+
+import array
+import bisect
+import csv
+import itertools
+import math
+import os
+import time
+from typing import NamedTuple
+
+import as13
+from graph import Graph
+from spatial import haversine
+from subway_lib import RailLine, Station
+
+timetable_file = 'timetable.csv'  # "trip","line","station","arrival","departure", calls in order
+interchanges_file = 'interchanges.csv'  # "station","seconds", overriding interchange_time
+
+interchange_time = 180  # Seconds to change between trips at a station, walking between platforms
+
+# Synthesized service, when no timetable.csv exists
+service_start = 5 * 3600 + 30 * 60
+service_end = 24 * 3600
+headway = 600  # Seconds between trips of each service pattern, in each direction
+running_speed = 33.0  # Km/h between stations
+dwell_time = 30  # Seconds stood at each intermediate call
+min_running_time = 45  # Seconds between even the closest stations
+
+
+def parse_time(text: str) -> int:
+  hours, minutes, seconds = map(int, text.split(':'))
+  return hours * 3600 + minutes * 60 + seconds
+
+
+def format_time(seconds: int) -> str:
+  return f'{seconds // 3600:02}:{seconds // 60 % 60:02}:{seconds % 60:02}'
+
+
+class Trip(NamedTuple):
+  """
+  One vehicle's run along a line, calling at each station in turn
+  """
+  line: RailLine
+  stations: tuple[Station, ...]
+  arrivals: tuple[int, ...]
+  departures: tuple[int, ...]
+
+
+class Journey(NamedTuple):
+  """
+  Timed itinerary between two stations. Legs are (RailLine, stations) pairs as accepted by
+  as13.gen_st_instr(), each ridden between the (departure, arrival) times of the same index.
+  """
+  departure: int
+  arrival: int
+  legs: list[tuple[RailLine, list[Station]]]
+  times: list[tuple[int, int]]
+
+  @property
+  def duration(self) -> int:
+    return self.arrival - self.departure
+
+  @property
+  def transfers(self) -> int:
+    return max(len(self.legs) - 1, 0)
+
+  def instructions(self) -> tuple[RailLine, str] | list[str | tuple[RailLine, str]]:
+    return as13.gen_legs_instr(self.legs)
+
+
+def _line_patterns(rail_graph: Graph) -> list[list[Station]]:
+  """
+  Stopping patterns covering every track of a line: between pairs of termini, longest first, for
+  as long as each covers more track; then shuttles along whatever track those don't pass over, such
+  as a loop without termini
+  """
+  def by_name(station: Station) -> str:
+    return station.name
+
+  termini = sorted((st for st in rail_graph.vertices() if rail_graph.degree(st) == 1), key=by_name)
+  candidates = [stations for start, end in itertools.combinations(termini, 2)
+                if (stations := rail_graph.shortest_path(start, end))]
+  candidates.sort(key=rail_graph.path_length, reverse=True)
+
+  patterns, covered = [], set()
+  for stations in candidates:
+    track = set(itertools.pairwise(stations))
+    if not track <= covered:
+      patterns.append(stations)
+      covered |= track | {(station2, station1) for station1, station2 in track}
+
+  uncovered = {st: {addr for addr in rail_graph.neighbors(st)
+                    if (st, addr) not in covered}
+               for st in rail_graph.vertices()}
+
+  def ride_from(station: Station) -> list[Station]:
+    ridden = []
+    while uncovered[station]:
+      addr = min(uncovered[station], key=by_name)
+      uncovered[station].discard(addr)
+      uncovered[addr].discard(station)
+      ridden.append(station := addr)
+    return ridden
+
+  for station in sorted(uncovered, key=by_name):
+    if uncovered[station]:
+      # Ridden onwards, then back out from the start along any other uncovered track
+      onwards = [station] + ride_from(station)
+      patterns.append(ride_from(station)[::-1] + onwards)
+
+  return patterns
+
+
+class Timetable:
+  """
+  Trips flattened into connections sorted by departure, stored column by column. Stations are
+  numbered, with interchange times per station number.
+  """
+  def __init__(self, trips: list[Trip], change_times: dict[Station, int] | None = None):
+    self._trips = trips
+    self._stations = list(dict.fromkeys(st for trip in trips for st in trip.stations))
+    self._index = {station: idx for idx, station in enumerate(self._stations)}
+    change_times = change_times or {}
+    self._change = [change_times.get(station, interchange_time) for station in self._stations]
+
+    hops = sorted((trip.departures[pos], trip.arrivals[pos + 1], trip_id, pos)
+                  for trip_id, trip in enumerate(trips) for pos in range(len(trip.stations) - 1))
+    self._departures = array.array('i', (hop[0] for hop in hops))
+    self._arrivals = array.array('i', (hop[1] for hop in hops))
+    self._trip_ids = array.array('i', (hop[2] for hop in hops))
+    self._positions = array.array('i', (hop[3] for hop in hops))
+    self._origins = array.array('i', (self._index[trips[trip_id].stations[pos]]
+                                      for _, _, trip_id, pos in hops))
+    self._destinations = array.array('i', (self._index[trips[trip_id].stations[pos + 1]]
+                                           for _, _, trip_id, pos in hops))
+
+  def __len__(self) -> int:
+    """
+    Total connections
+    """
+    return len(self._departures)
+
+  @property
+  def trips(self) -> list[Trip]:
+    return self._trips
+
+  @classmethod
+  def load(cls, network: as13.MetroNetwork) -> 'Timetable | None':
+    """
+    Reads the dataset's timetable.csv, keyed by the same station and line ids as routes.csv, or
+    returns None if there is none
+    """
+    file_path = f'{network.path}{timetable_file}'
+    if not os.path.exists(file_path):
+      return None
+
+    trips = []
+    for _, calls in itertools.groupby(as13.read_csv(file_path), key=lambda row: row[0]):
+      calls = list(calls)
+      trips.append(Trip(network.id_lines[calls[0][1]],
+                        tuple(network.id_stations[call[2]] for call in calls),
+                        tuple(parse_time(call[3]) for call in calls),
+                        tuple(parse_time(call[4]) for call in calls)))
+    return cls(trips, _read_change_times(network))
+
+  @classmethod
+  def synthesize(cls, network: as13.MetroNetwork) -> 'Timetable':
+    """
+    Runs every stopping pattern of every line in both directions, from service_start until
+    service_end every headway, with running times from great-circle distance at running_speed
+    """
+    trips = []
+    for rail_line, rail_graph in network.rail_subgraphs.items():
+      for pattern_idx, pattern in enumerate(_line_patterns(rail_graph)):
+        for stations in (pattern, pattern[::-1]):
+          offsets = [0]  # Departure from each call, relative to the first
+          for station1, station2 in itertools.pairwise(stations):
+            hop_km = haversine(station1.geo_coords, station2.geo_coords)
+            offsets.append(offsets[-1] + dwell_time +
+                           max(min_running_time, round(hop_km / running_speed * 3600)))
+
+          # Patterns staggered by a minute each, so that they don't all depart together
+          first = service_start + pattern_idx * 60 % headway
+          for start in range(first, service_end, headway):
+            departures = tuple(start + offset for offset in offsets)
+            arrivals = departures[:1] + tuple(dep - dwell_time for dep in departures[1:])
+            trips.append(Trip(rail_line, tuple(stations), arrivals, departures))
+    return cls(trips, _read_change_times(network))
+
+  @classmethod
+  def load_or_synthesize(cls, network: as13.MetroNetwork | None = None) -> 'Timetable':
+    network = network or as13.network
+    return cls.load(network) or cls.synthesize(network)
+
+  def save(self, network: as13.MetroNetwork | None = None) -> None:
+    """
+    Writes the trips as the dataset's timetable.csv, such as to hand-edit a synthesized timetable
+    """
+    network = network or as13.network
+    with open(f'{network.path}{timetable_file}', 'w', newline='') as csv_file:
+      writer = csv.writer(csv_file, quoting=csv.QUOTE_NONNUMERIC)
+      writer.writerow(('trip', 'line', 'station', 'arrival', 'departure'))
+      for trip_id, trip in enumerate(self._trips, 1):
+        for station, arrival, departure in zip(trip.stations, trip.arrivals, trip.departures):
+          writer.writerow((trip_id, network.line_ids[trip.line], network.station_ids[station],
+                           format_time(arrival), format_time(departure)))
+
+  def _leg(self, enter: int, alight: int) -> tuple[tuple[RailLine, list[Station]], tuple[int, int]]:
+    """
+    The leg ridden on one trip from connection enter through connection alight
+    """
+    trip = self._trips[self._trip_ids[enter]]
+    first, last = self._positions[enter], self._positions[alight] + 1
+    return ((trip.line, list(trip.stations[first:last + 1])),
+            (trip.departures[first], trip.arrivals[last]))
+
+  def _journey(self, rides: list[tuple[int, int]]) -> Journey:
+    legs, times = zip(*itertools.starmap(self._leg, rides))
+    return Journey(times[0][0], times[-1][1], list(legs), list(times))
+
+  def earliest_arrival(self, st_start: Station, st_goal: Station, departure: int) -> Journey | None:
+    """
+    The journey departing no earlier than the given time which arrives soonest, or None if the goal
+    can't be reached before service ends. Scans connections from the departure time onwards,
+    stopping once they depart after the goal has already been reached.
+    """
+    source, target = self._index.get(st_start), self._index.get(st_goal)
+    if source is None or target is None:
+      return None
+    if source == target:
+      return Journey(departure, departure, [], [])
+
+    arrivals, destinations, change = self._arrivals, self._destinations, self._change
+    arrived = [math.inf] * len(self._stations)
+    ready = arrived.copy()  # When each station's next trip may be boarded, after changing
+    arrived[source] = ready[source] = departure
+    boarded = [-1] * len(self._trips)  # Connection each trip was boarded at
+    reached_by: dict[int, tuple[int, int]] = {}  # Station -> ride (enter, alight) arriving there
+    goal_arrival = math.inf
+
+    # Most connections are skipped, as neither boarded nor departing a station reached yet, so the
+    # columns they are skipped by are iterated together through views rather than indexed
+    first = bisect.bisect_left(self._departures, departure)
+    columns = (memoryview(column)[first:] for column in (self._departures, self._trip_ids,
+                                                         self._origins))
+    for conn, conn_departure, trip_id, origin in zip(itertools.count(first), *columns):
+      if conn_departure >= goal_arrival:
+        break
+
+      enter = boarded[trip_id]
+      if enter < 0:
+        if ready[origin] > conn_departure:
+          continue
+        enter = boarded[trip_id] = conn
+
+      destination, conn_arrival = destinations[conn], arrivals[conn]
+      if conn_arrival < arrived[destination]:
+        arrived[destination] = conn_arrival
+        ready[destination] = conn_arrival + change[destination]
+        reached_by[destination] = enter, conn
+        if destination == target:
+          goal_arrival = conn_arrival
+
+    if target not in reached_by:
+      return None
+
+    rides, station = [], target
+    while station != source:
+      rides.append(reached_by[station])
+      station = self._origins[rides[-1][0]]
+    return self._journey(rides[::-1])
+
+  def profile(self, st_start: Station, st_goal: Station, earliest: int,
+              latest: int) -> list[Journey]:
+    """
+    Every Pareto-optimal journey departing between the earliest and latest times, in order of
+    departure: each departs later or arrives sooner than every other. Scans connections in
+    reverse, keeping for each station the best arrival at the goal from each departure time.
+    """
+    source, target = self._index.get(st_start), self._index.get(st_goal)
+    if source is None or target is None or source == target:
+      return []
+
+    departures, arrivals, trip_ids = self._departures, self._arrivals, self._trip_ids
+    origins, destinations, change = self._origins, self._destinations, self._change
+    # Journeys departing by latest and arriving after the latest departure's journey are dominated
+    bound = self.earliest_arrival(st_start, st_goal, latest)
+    last = bisect.bisect_left(departures, bound.arrival) if bound else len(departures)
+
+    # Per station, (departure, arrival at goal, enter, alight) by decreasing departure and arrival,
+    # alongside negated departures to bisect over
+    profiles: list[list[tuple[int, int, int, int]]] = [[] for _ in self._stations]
+    neg_departures: list[list[int]] = [[] for _ in self._stations]
+    trip_best: dict[int, tuple[float, int]] = {}  # Trip -> (arrival at goal staying on, alight)
+
+    def onward(station: int, arrival: int) -> int:
+      """
+      Index of the best profile entry catchable at a station after arriving at the given time
+      """
+      return bisect.bisect_right(neg_departures[station], -(arrival + change[station])) - 1
+
+    for conn in range(last - 1, bisect.bisect_left(departures, earliest) - 1, -1):
+      destination, conn_arrival, trip_id = destinations[conn], arrivals[conn], trip_ids[conn]
+      best, alight = trip_best.get(trip_id, (math.inf, -1))
+      if destination == target:
+        if conn_arrival <= best:
+          best, alight = conn_arrival, conn
+      elif (entry := onward(destination, conn_arrival)) >= 0 and \
+          profiles[destination][entry][1] < best:
+        best, alight = profiles[destination][entry][1], conn
+      if best == math.inf:
+        continue
+      trip_best[trip_id] = best, alight
+
+      origin, conn_departure = origins[conn], departures[conn]
+      station_profile = profiles[origin]
+      if not station_profile or best < station_profile[-1][1]:
+        if station_profile and station_profile[-1][0] == conn_departure:
+          station_profile.pop()
+          neg_departures[origin].pop()
+        station_profile.append((conn_departure, best, conn, alight))
+        neg_departures[origin].append(-conn_departure)
+
+    journeys = []
+    for entry in reversed(profiles[source]):
+      if entry[0] > latest:
+        break
+      rides = [entry[2:]]
+      while (station := destinations[rides[-1][1]]) != target:
+        alight_arrival = arrivals[rides[-1][1]]
+        rides.append(profiles[station][onward(station, alight_arrival)][2:])
+      journeys.append(self._journey(rides))
+    return journeys
+
+
+def _read_change_times(network: as13.MetroNetwork) -> dict[Station, int]:
+  file_path = f'{network.path}{interchanges_file}'
+  if not os.path.exists(file_path):
+    return {}
+  return {network.id_stations[st_id]: int(seconds) for st_id, seconds in as13.read_csv(file_path)}
+
+
+if __name__ == '__main__':
+  start_time = time.perf_counter()
+  timetable = Timetable.load_or_synthesize()
+  print(f'Loaded {len(timetable.trips)} trips, {len(timetable)} connections in '
+        f'{time.perf_counter() - start_time:.2f}s')
+  assert parse_time(format_time(25 * 3600 + 61)) == 25 * 3600 + 61
+
+  by_name = {station.name: station for station in as13.id_stations.values()}
+  served = {station for trip in timetable.trips for station in trip.stations}
+  assert served == {station for station, routes in as13.st_routes.items() if routes}
+  # Every track is run over, including the Circle Line's loop
+  for rail_line, rail_graph in as13.rail_subgraphs.items():
+    ridden = {pair for trip in timetable.trips if trip.line is rail_line
+              for pair in itertools.pairwise(trip.stations)}
+    assert {(station1, station2) for station1, station2, _ in rail_graph.edges()} == ridden
+
+  def check_journey(journey: Journey, st_start: Station, st_goal: Station, departure: int) -> None:
+    assert journey.departure >= departure
+    assert journey.legs[0][1][0] == st_start and journey.legs[-1][1][-1] == st_goal
+    for (_, stations), (_, next_stations) in itertools.pairwise(journey.legs):
+      assert stations[-1] == next_stations[0]
+    for (_, arrival), (next_departure, _) in itertools.pairwise(journey.times):
+      assert next_departure - arrival >= interchange_time
+
+  acton, upminster, bank = by_name['Acton Town'], by_name['Upminster'], by_name['Bank']
+  eight = parse_time('08:00:00')
+  journey = timetable.earliest_arrival(acton, upminster, eight)
+  check_journey(journey, acton, upminster, eight)
+  assert isinstance(journey.instructions(), (tuple, list))
+  assert timetable.earliest_arrival(acton, upminster, service_end) is None
+  assert timetable.earliest_arrival(acton, acton, eight).duration == 0
+
+  stations = list(as13.id_stations.values())
+  queries = [(st_start, st_goal) for st_start in stations[::23] for st_goal in stations[::7]
+             if st_start != st_goal and as13.st_routes[st_start] and as13.st_routes[st_goal]]
+  start_time = time.perf_counter()
+  found = [(pair, timetable.earliest_arrival(*pair, eight)) for pair in queries]
+  elapsed = time.perf_counter() - start_time
+  print(f'{len(queries)} earliest arrival queries, {elapsed / len(queries) * 1e3:.2f}ms each')
+  for (st_start, st_goal), journey in found:
+    check_journey(journey, st_start, st_goal, eight)
+    # Departing any later can't arrive any sooner
+    later = timetable.earliest_arrival(st_start, st_goal, journey.departure + 1)
+    assert later is None or later.arrival >= journey.arrival
+
+  hour = parse_time('09:00:00')
+  journeys = timetable.profile(acton, bank, eight, hour)
+  assert journeys and all(eight <= journey.departure <= hour for journey in journeys)
+  for journey, next_journey in itertools.pairwise(journeys):
+    assert journey.departure < next_journey.departure and journey.arrival < next_journey.arrival
+  for journey in journeys:
+    check_journey(journey, acton, bank, eight)
+    assert timetable.earliest_arrival(acton, bank, journey.departure).arrival == journey.arrival
+
+  print('All assertions passed!')
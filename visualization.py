@@ -10,6 +10,7 @@ __author__ = 'Drullkus'
 
 import as13 as metro_data
 import dearpygui.dearpygui as dpg
+from concurrent.futures import Future, ThreadPoolExecutor
 from subway_lib import Station
 
 
@@ -38,96 +39,187 @@ for station in metro_data.id_stations.values():
   st_tooltip = f'{station.name}\n\nConnected Lines:\n{adjoined_rails}'
   station_datas.append((st_color, st_tooltip))
 
+# Station -> position within enum_stations, which matches the order of the plotted coordinates
+station_order: dict[Station, int] = {station: idx for idx, (_, station)
+                                     in enumerate(metro_data.enum_stations)}
+
 node_radius = 4
 node_diam = node_radius * 2
 node_and_half = node_diam * 1.5
 node_double = node_diam * 2
 
+# Stations are culled if further than this outside the view, leaving room for their labels
+cull_margin = 0.02
+# Labels are hidden while zoomed out further than this many pixels per degree
+label_zoom_threshold = 2000
+
+# Westernmost & easternmost stations, whose positions on screen give the plot's transformation
+_west_enum = min(range(len(st_coords) // 2), key=lambda st_enum: st_coords[st_enum * 2])
+_east_enum = max(range(len(st_coords) // 2), key=lambda st_enum: st_coords[st_enum * 2])
+_west_east_span = st_coords[_east_enum * 2] - st_coords[_west_enum * 2]
+
+# Routes are computed off the UI thread, so that frames keep rendering in the meantime
+_router = ThreadPoolExecutor(max_workers=1, thread_name_prefix='router')
+_pending_route: Future | None = None
+
 first_station, second_station = None, None
+_last_render = None  # View, hovered & selected stations when stations were last drawn
 
 
-def _draw_stations(sender, plot_data):
+def _find_hovered(transformed_x, transformed_y, mouse_x: float, mouse_y: float) -> Station | None:
   """
-  Live code: rendered every frame
+  Hit-tests only the few stations nearest the cursor, found through the spatial index
   """
-  global first_station, second_station, instr_panel  # These variables need binding to outer scope
-  do_chart = False
+  for _, candidate in metro_data.station_index.nearest(tuple(dpg.get_plot_mouse_pos()), 3):
+    idx = station_order[candidate]
+    if abs(transformed_x[idx] - mouse_x) < node_radius and \
+        abs(transformed_y[idx] - mouse_y) < node_radius:
+      return candidate
+  return None
+
+
+def _pixels_per_degree(transformed_x) -> float:
+  """
+  Current zoom level, measured between the westernmost and easternmost stations
+  """
+  return abs(transformed_x[_east_enum] - transformed_x[_west_enum]) / _west_east_span
 
-  _helper_data = plot_data[0]
-  # Coordinates, transformed by user behavior with the plot
-  transformed_x, transformed_y = plot_data[1], plot_data[2]
-  mouse_x_pixel_space = _helper_data['MouseX_PixelSpace']
-  mouse_y_pixel_space = _helper_data['MouseY_PixelSpace']
 
+def _render_stations(sender, transformed_x, transformed_y, hovered_station: Station | None):
+  """
+  Redraws only the stations within the plot's current view, with labels only once zoomed in
+  """
   dpg.delete_item(sender, children_only=True, slot=2)
   dpg.push_container_stack(sender)
-  dpg.configure_item('stations', tooltip=False)
 
-  # For some reason, is_mouse_button_clicked() doesn't work so is_mouse_button_down() must be used
-  is_clicked = dpg.is_mouse_button_down(dpg.mvMouseButton_Left)
+  (x_min, x_max), (y_min, y_max) = dpg.get_axis_limits('x_axis'), dpg.get_axis_limits('y_axis')
+  visible = metro_data.station_index.within_bbox(x_min - cull_margin, y_min - cull_margin,
+                                                 x_max + cull_margin, y_max + cull_margin)
+  show_labels = _pixels_per_degree(transformed_x) >= label_zoom_threshold
 
-  for st_enum in range(0, len(transformed_x)):
-    a_station: Station = metro_data.enum_stations[st_enum][1]
+  for a_station in visible:
+    st_enum = station_order[a_station]
+    st_pos = transformed_x[st_enum], transformed_y[st_enum]
 
-    # Draw station label text to the right of the node
-    label_offset = (transformed_x[st_enum] + node_and_half, transformed_y[st_enum] - node_and_half)
-    dpg.draw_text(label_offset, a_station.display_name, size=node_and_half)
+    if show_labels:  # Draw station label text to the right of the node
+      label_offset = (st_pos[0] + node_and_half, st_pos[1] - node_and_half)
+      dpg.draw_text(label_offset, a_station.display_name, size=node_and_half)
 
     # Draw node for the station
-    st_data: tuple[tuple[int, int, int, int] | str] = station_datas[st_enum]
-    dpg.draw_circle((transformed_x[st_enum], transformed_y[st_enum]), node_diam, fill=st_data[0])
-
-    is_hovered = transformed_x[st_enum] + node_radius > mouse_x_pixel_space > transformed_x[st_enum
-                 ] - node_radius and transformed_y[st_enum] - node_radius < mouse_y_pixel_space < \
-                 transformed_y[st_enum] + node_radius
+    dpg.draw_circle(st_pos, node_diam, fill=station_datas[st_enum][0])
 
     # Draw additional circle to distinguish station for being hovered or selected
-    if is_hovered or a_station in (first_station, second_station):
-      dpg.draw_circle((transformed_x[st_enum], transformed_y[st_enum]), node_and_half)
+    if a_station is hovered_station or a_station in (first_station, second_station):
+      dpg.draw_circle(st_pos, node_and_half)
+
+  dpg.pop_container_stack()
+
 
-    if is_hovered:
-      # Render tooltip only if the station is hovered
-      dpg.configure_item('stations', tooltip=True)
-      dpg.set_value('station_tooltip', st_data[1])
+def _show_instructions(instructions):
+  dpg.delete_item(instr_panel, children_only=True)
 
-      # If the mouse is clicked whilst the station is being hovered, then commit it for routing
-      if is_clicked and a_station != second_station:  # Prevent redundant re-selection
-        first_station, second_station = second_station, a_station
-        is_clicked = False  # "Consume" click, prevent selecting overlapped stations instantly
-        if first_station and second_station:
-          do_chart = True  # Finally, charting time!
+  # Since ImGui doesn't support Ansicolors, ImGui tables are used instead for Background colors
+  with (dpg.table(header_row=False, row_background=False, parent=instr_panel, delay_search=True)
+        as table_id):
+    dpg.add_table_column()
+
+    if isinstance(instructions, tuple):
+      # Simple Route: Stays only in one Metro line
+      with dpg.table_row():
+        dpg.add_text(instructions[1])
+
+      dpg.highlight_table_cell(table_id, 0, 0, hex_to_color(instructions[0].color))
+    else:
+      # Disjoint Route: Route requires crossing of multiple Metro lines
+      for idx, row_info in enumerate(instructions):
+        with dpg.table_row():
+          if isinstance(row_info, str):  # Instructs which Metro line to switch to
+            dpg.add_text(row_info, wrap=_text_width)
+          else:  # Instructs which stops to wait through until a desired stop for disembarking
+            dpg.add_text(row_info[1], wrap=_text_width)
+            dpg.highlight_table_cell(table_id, idx, 0, hex_to_color(row_info[0].color))
+
+
+def _request_route(st_start: Station, st_goal: Station):
+  """
+  Submits routing to the background worker, superseding any route still pending
+  """
+  global _pending_route
+  if _pending_route is not None:
+    _pending_route.cancel()  # Never runs if still queued, otherwise its result is discarded
+
+  dpg.delete_item(instr_panel, children_only=True)
+  dpg.add_text(f'Computing route from {st_start.name} to {st_goal.name}...', wrap=_text_width,
+               parent=instr_panel)
+  _pending_route = _router.submit(metro_data.gen_route_instr, st_start, st_goal)
+
+
+def _poll_route():
+  """
+  Fills in instr_panel once the pending route has been computed. DearPyGui items may only be
+  created on the UI thread, hence polling every frame rather than a completion callback.
+  """
+  global _pending_route
+  if _pending_route is None or not _pending_route.done():
+    return
+
+  route, _pending_route = _pending_route, None
+  if route.cancelled():
+    return
+  elif error := route.exception():
+    dpg.delete_item(instr_panel, children_only=True)
+    dpg.add_text(f'Routing failed: {error}', wrap=_text_width, parent=instr_panel)
+  else:
+    _show_instructions(route.result())
+
+
+def _draw_stations(sender, plot_data):
+  """
+  Live code: called every frame, although stations are only redrawn once the view, hovered station
+  or selected stations have changed since the last redraw
+  """
+  global first_station, second_station, _last_render  # These variables need binding to outer scope
+  do_chart = False
+
+  _helper_data = plot_data[0]
+  # Coordinates, transformed by user behavior with the plot
+  transformed_x, transformed_y = plot_data[1], plot_data[2]
+  mouse_x_pixel_space = _helper_data['MouseX_PixelSpace']
+  mouse_y_pixel_space = _helper_data['MouseY_PixelSpace']
+
+  # For some reason, is_mouse_button_clicked() doesn't work so is_mouse_button_down() must be used
+  is_clicked = dpg.is_mouse_button_down(dpg.mvMouseButton_Left)
+  hovered_station = _find_hovered(transformed_x, transformed_y, mouse_x_pixel_space,
+                                  mouse_y_pixel_space)
+
+  # Render tooltip only if a station is hovered
+  dpg.configure_item('stations', tooltip=hovered_station is not None)
+  if hovered_station:
+    dpg.set_value('station_tooltip', station_datas[station_order[hovered_station]][1])
+
+    # If the mouse is clicked whilst the station is being hovered, then commit it for routing
+    if is_clicked and hovered_station != second_station:  # Prevent redundant re-selection
+      first_station, second_station = second_station, hovered_station
+      if first_station and second_station:
+        do_chart = True  # Finally, charting time!
 
   # Convenience: Press X to swap direction between stations
   if dpg.is_key_pressed(dpg.mvKey_X) and first_station and second_station:
     first_station, second_station = second_station, first_station
     do_chart = True  # Also flag for re-charting route
 
-  if do_chart:
-    dpg.delete_item(instr_panel, children_only=True)
-
-    instructions = metro_data.gen_route_instr(first_station, second_station)
-    # Since ImGui doesn't support Ansicolors, ImGui tables are used instead for Background colors
-    with (dpg.table(header_row=False, row_background=False, parent=instr_panel, delay_search=True)
-          as table_id):
-      dpg.add_table_column()
+  # Both reference stations' positions change whenever the view is panned, zoomed or resized
+  view = (transformed_x[_west_enum], transformed_y[_west_enum],
+          transformed_x[_east_enum], transformed_y[_east_enum])
+  render_state = (view, hovered_station, first_station, second_station)
+  if render_state != _last_render:
+    _render_stations(sender, transformed_x, transformed_y, hovered_station)
+    _last_render = render_state
 
-      if isinstance(instructions, tuple):
-        # Simple Route: Stays only in one Metro line
-        with dpg.table_row():
-          dpg.add_text(instructions[1])
-
-        dpg.highlight_table_cell(table_id, 0, 0, hex_to_color(instructions[0].st_color))
-      else:
-        # Disjoint Route: Route requires crossing of multiple Metro lines
-        for idx, row_info in enumerate(instructions):
-          with dpg.table_row():
-            if isinstance(row_info, str):  # Instructs which Metro line to switch to
-              dpg.add_text(row_info, wrap=_text_width)
-            else:  # Instructs which stops to wait through until a desired stop for disembarking
-              dpg.add_text(row_info[1], wrap=_text_width)
-              dpg.highlight_table_cell(table_id, idx, 0, hex_to_color(row_info[0].color))
+  if do_chart:
+    _request_route(first_station, second_station)
 
-  dpg.pop_container_stack()
+  _poll_route()
 
 
 dpg.create_context()
@@ -178,8 +270,8 @@ Double-click to reset view.
             thickness=0.001, color=segment_color, label=line.name
           )
 
-      x_axis = dpg.add_plot_axis(dpg.mvXAxis, label='Longitude')
-      with dpg.plot_axis(dpg.mvYAxis, label='Latitude'):
+      x_axis = dpg.add_plot_axis(dpg.mvXAxis, label='Longitude', tag='x_axis')
+      with dpg.plot_axis(dpg.mvYAxis, label='Latitude', tag='y_axis'):
         with dpg.custom_series(st_coords[0::2], st_coords[1::2], 2, callback=_draw_stations,
                                tag='stations'):
           dpg.add_text('', tag='station_tooltip')
@@ -190,3 +282,4 @@ Double-click to reset view.
 dpg.show_viewport(maximized=True)
 dpg.start_dearpygui()
 dpg.destroy_context()
+_router.shutdown(cancel_futures=True)